@@ -2,9 +2,12 @@
 Manages processing.
 
 Called by cron-job which calls controller.py
+- or run as a daemon, `python3 ./controller.py --watch`, to process files as they arrive (see lib/dir_watcher.py)
 
 Steps (roughly)...
-- Determine if there are new files to process. Assuming there are...
+- Take the run-lock, so overlapping runs (eg cron every minute) skip rather than collide.
+- Determine if there are new files to process, and skip any still being written. Assuming there are
+    (or there are barcodes deferred on an earlier run, while alma was unavailable, to recheck)...
 - Archive each of the files (with timestamp in filename).
     - Alert folk if there are file-name issues.
 - set up alerts-holder and four data-holders
@@ -15,22 +18,20 @@ Steps (roughly)...
     - build data-summary and store it
 - ? Save alerts and data-holders ?
 - Email alert and data-holders as attachments.
+- Save the run's results to the run-history db (see lib/run_history.py).
 """
 
-import json, logging, os, pprint, sys
+import argparse, json, logging, os, signal, sys, time
+
+sys.path.append( os.environ['ANXEODALERTS__ENCLOSING_PROJECT_PATH'] )
+from annex_eod_alerts_code.lib import log_helper
 
 lvl_dct = { 'DEBUG': logging.DEBUG, 'INFO': logging.INFO }
 lvl = os.environ['ANXEODALERTS__LOG_LEVEL']
-logging.basicConfig(
-    filename=os.environ['ANXEODALERTS__LOG_PATH'],
-    level=lvl,
-    format='[%(asctime)s] %(levelname)s [%(module)s-%(funcName)s()::%(lineno)d] %(message)s',
-    datefmt='%d/%b/%Y %H:%M:%S',
-    )
+log_helper.setup_queue_logging( os.environ['ANXEODALERTS__LOG_PATH'], lvl )  # file-writes happen on a listener-thread
 log = logging.getLogger(__name__)
 
-sys.path.append( os.environ['ANXEODALERTS__ENCLOSING_PROJECT_PATH'] )
-from annex_eod_alerts_code.lib import checker, emailer, file_handler
+from annex_eod_alerts_code.lib import categories, checker, dir_watcher, emailer, file_handler, run_history, run_lock
 
 
 class Controller(object):
@@ -40,40 +41,76 @@ class Controller(object):
         self.source_directory = os.environ['ANXEODALERTS__SOURCE_DIR']
         self.archives_directory = os.environ['ANXEODALERTS__ARCHIVES_DIR']
         self.prefix_list = json.loads( os.environ['ANXEODALERTS__PREFIX_LIST_JSON'] )
-        self.tracker_path = os.environ['ANXEODALERTS__TRACKER_FILE_PATH']
+        self.tracker_path = os.environ['ANXEODALERTS__TRACKER_FILE_PATH']  # legacy json-list; imported once into the tracker-store
+        self.tracker_retention_days = float( os.environ.get('ANXEODALERTS__TRACKER_RETENTION_DAYS', '730') )
+        self.tracker = None
+        self.run_lock = run_lock.lock_from_environ( self.tracker_path )
+        self.ready_stable_seconds = float( os.environ.get('ANXEODALERTS__READY_STABLE_SECONDS', '30') )
+        self.ready_max_wait_seconds = float( os.environ.get('ANXEODALERTS__READY_MAX_WAIT_SECONDS', '3600') )
+        self.deferred_files = []  # new files skipped as not-yet-ready, on the latest run
+        self.closed_files = {}  # watch-mode; name -> ( size, mtime_ns ) when inotify saw it closed-after-writing
 
-    def manage_processing( self ):
+    def manage_processing( self, wait_for_lock=False ):
+        """ Runs process_source_directory() under the single-instance run-lock.
+            Without `wait_for_lock`, returns straight away if another run holds the lock (so cron-runs can't overlap).
+            Called by ``if __name__ == '__main__':``, and by watch() """
+        if not self.run_lock.acquire( blocking=wait_for_lock ):
+            log.info( 'another run is in progress; skipping this one' )
+            return
+        try:
+            self.process_source_directory()
+        finally:
+            self.run_lock.release()
+
+    def process_source_directory( self ):
         """ Manages calls to functions.
-            Called by ``if __name__ == '__main__':`` """
+            Called by manage_processing() """
+        ( run_started_at, timings, mark ) = ( time.time(), {}, time.monotonic() )
         ## ensure directories exist ---------------------------------
         err = file_handler.check_directories( [self.source_directory] )
         if err:
             raise Exception( f'Problem finding a directory, ``{err}``' )
         ## check for new files --------------------------------------
-        (err, dir_files) = file_handler.scan_directory( self.source_directory )
+        (err, dir_files) = file_handler.scan_directory( self.source_directory, self.prefix_list )  # newest first
         if err:
             raise Exception( f'Problem scanning source-directory, ``{err}``' )
-        (err, recent_files) = file_handler.load_recent_file_list( self.tracker_path )
-        if err:
-            raise Exception( f'Problem loading recent file-list, ``{err}``' )
-        (err, new_files) = file_handler.get_new_files( self.prefix_list, dir_files, recent_files )
+        if self.tracker is None:  # kept open across runs in watch-mode
+            (err, self.tracker) = file_handler.load_recent_file_list( self.tracker_path )
+            if err:
+                raise Exception( f'Problem loading recent file-list, ``{err}``' )
+        (err, new_files) = file_handler.get_new_files( self.prefix_list, dir_files, self.tracker )
         if err:
             raise Exception( f'Problem checking for new files, ``{err}``' )
-        ## process new files ----------------------------------------
-        if new_files:
+        (err, ready_files) = file_handler.filter_ready_files(
+            new_files, self.source_directory, self.tracker, self.ready_stable_seconds, self.ready_max_wait_seconds, self.closed_files )
+        if err:
+            raise Exception( f'Problem checking whether new files are ready, ``{err}``' )
+        self.deferred_files = [ file_name for file_name in new_files if file_name not in ready_files ]
+        self.closed_files = { name: signature for ( name, signature ) in self.closed_files.items() if name in self.deferred_files }
+        new_files = ready_files
+        mark = lap( timings, 'scan', mark )
+        ## process new files (and recheck barcodes deferred on earlier runs, at most once per interval) --
+        recheck_due = self.tracker.has_deferred_barcodes( time.time() - checker.DEFERRED_RECHECK_SECONDS )
+        if new_files or recheck_due:
             ## archive new files
-            ( err, archive_paths_dct ) = file_handler.archive_new_files( new_files, self.source_directory, self.archives_directory )
-            if err:
-                raise Exception( f'Problem archiving new_files; see logs.' )
+            if new_files:
+                ( err, archive_paths_dct ) = file_handler.archive_new_files( new_files, self.source_directory, self.archives_directory )
+                if err:
+                    raise Exception( f'Problem archiving new_files; see logs.' )
+            else:
+                log.info( 'no new files found; rechecking deferred barcodes' )
+                archive_paths_dct = { category['archive_path_key']: '' for category in categories.CATEGORIES }
+            mark = lap( timings, 'archive', mark )
             ## process new files
             new_file_paths = []
             for file_name in new_files:
                 new_file_path = f'{self.source_directory}/{file_name}'
                 new_file_paths.append( new_file_path )
-            log.debug( f'new_file_paths, ``{pprint.pformat(new_file_paths)}``' )
+            log.debug( 'new_file_paths, ``%s``', log_helper.LazyPformat(new_file_paths) )
             barcode_check_results = self.process_new_files( new_file_paths, archive_paths_dct )
             if err:
                 raise Exception( f'Problem processing new files, ``{err}``' )
+            mark = lap( timings, 'check', mark )
             ## determine whether to send email ----------------------
             ( err, email_check ) = checker.check_whether_to_send_email( barcode_check_results )
             if err:
@@ -83,11 +120,16 @@ class Controller(object):
                 err = emailer.send_mail( barcode_check_results )
                 if err:
                     raise Exception( f'Problem sending email, ``{err}``' )
+            mark = lap( timings, 'email', mark )
             ## delete processed files -------------------------------
-            err = file_handler.delete_processed_files( new_files, self.source_directory )
-            if err:
-                raise Exception( f'Problem deleting processed files, ``{err}``' )
-            log.debug( 'end of manage_processing()' )
+            if new_files:
+                err = file_handler.delete_processed_files( new_files, self.source_directory )
+                if err:
+                    raise Exception( f'Problem deleting processed files, ``{err}``' )
+            mark = lap( timings, 'delete', mark )
+            ## record the run, in one transaction -------------------
+            self.record_run( run_started_at, barcode_check_results, new_files, email_check, timings )
+            log.debug( 'end of process_source_directory()' )
         else:
             log.info( 'no new files found' )
 
@@ -97,22 +139,122 @@ class Controller(object):
             TODO- this will be vastly expanded with other checks and api-updates. """
         ## initialize holder dict -----------------------------------
         results_dct = checker.initialize_results_dct( archive_paths_dct )
-        ## check non-hay-accessions ---------------------------------
-        checker.check_non_hay_accessions( new_file_paths, results_dct, self.tracker_path )
-        ## check hay-accessions -------------------------------------
-        checker.check_hay_accessions( new_file_paths, results_dct, self.tracker_path )
-        ## check non-hay-refiles ------------------------------------
-        checker.check_non_hay_refiles( new_file_paths, results_dct, self.tracker_path )
-        ## check hay-refiles ----------------------------------------
-        checker.check_hay_refiles( new_file_paths, results_dct, self.tracker_path )
+        with checker.BarcodeLookups() as lookups:
+            lookups.prefetch_files( new_file_paths )  # each unique barcode, across all files, is fetched once
+            ## check all categories, concurrently ------------------
+            checker.check_categories( new_file_paths, results_dct, self.tracker, lookups )
+        ## record processed files, in one transaction ---------------
+        self.tracker.commit()
+        self.tracker.compact( self.tracker_retention_days )
+        log.info( f'alma-api metrics, ``{checker.alma_api.metrics}``' )
         return results_dct
 
+    def record_run( self, run_started_at, results_dct, file_names, email_sent, timings ):
+        """ Saves the run's results to the run-history db; a problem is logged, but doesn't fail the run.
+            Called by process_source_directory() """
+        try:
+            history = run_history.history_from_environ( self.tracker_path )
+            try:
+                history.record_run( run_started_at, results_dct, file_names, email_sent, timings, dict(checker.alma_api.metrics) )
+            finally:
+                history.close()
+        except Exception:
+            log.exception( 'Problem recording run-history' )
+        return
+
+    def watch( self ):
+        """ Long-running alternative to the cron-run: processes files as they land in the source-directory.
+            The tracker-store and the alma-api connection-pool stay open between runs.
+            A full rescan also happens every ANXEODALERTS__WATCH_RESCAN_SECONDS, in case an event was missed,
+              and not-yet-ready files are rechecked once they've had time to settle.
+            With inotify, a file closed-after-writing is ready at once, without the ANXEODALERTS__READY_STABLE_SECONDS wait.
+            Runs until SIGTERM/SIGINT.
+            Called by ``if __name__ == '__main__':`` when `--watch` is passed """
+        settle_seconds = float( os.environ.get('ANXEODALERTS__WATCH_SETTLE_SECONDS', '2') )
+        rescan_seconds = float( os.environ.get('ANXEODALERTS__WATCH_RESCAN_SECONDS', '300') )
+        self.stop_requested = False
+        signal.signal( signal.SIGTERM, self.request_stop )
+        signal.signal( signal.SIGINT, self.request_stop )
+        watcher = dir_watcher.watcher_from_environ( self.source_directory )
+        try:
+            self.run_once()  # catch up on anything that arrived while not watching
+            last_run = time.monotonic()
+            while not self.stop_requested:
+                names = watcher.wait( timeout=1.0 )  # short timeout, so a stop-request is noticed promptly
+                self.note_closed( watcher, names )
+                relevant = ( names is None ) or any( name[0:5] in self.prefix_list for name in names )
+                since_last_run = time.monotonic() - last_run
+                retry_deferred = bool( self.deferred_files ) and since_last_run >= self.ready_stable_seconds
+                if not relevant and not retry_deferred and since_last_run < rescan_seconds:
+                    continue
+                ## let a batch of arriving files settle, so they're handled in one run --
+                while relevant and not self.stop_requested:
+                    more_names = watcher.wait( timeout=settle_seconds )
+                    if not more_names:
+                        break
+                    self.note_closed( watcher, more_names )
+                self.run_once()
+                last_run = time.monotonic()
+        finally:
+            watcher.close()
+        log.info( 'watch stopped' )
+
+    def note_closed( self, watcher, names ) -> None:
+        """ Records the size and mtime of files the watcher reports as completely written, for filter_ready_files().
+            Called by watch() """
+        if not names or not watcher.signals_closed:
+            return
+        for name in names:
+            if name[0:5] not in self.prefix_list:
+                continue
+            try:
+                stat_result = os.stat( f'{self.source_directory}/{name}' )
+            except FileNotFoundError:
+                continue
+            self.closed_files[name] = ( stat_result.st_size, stat_result.st_mtime_ns )
+        return
+
+    def run_once( self ):
+        """ One processing-run; in watch-mode an error is logged rather than ending the daemon.
+            Called by watch() """
+        try:
+            self.manage_processing( wait_for_lock=True )  # a cron-run in progress finishes first
+        except Exception:
+            log.exception( 'problem processing; will retry on the next event or rescan' )
+
+    def request_stop( self, signum, frame ):
+        """ Signal-handler; lets the current run finish, then ends watch().
+            Called on SIGTERM/SIGINT, when watching """
+        log.info( f'received signal ``{signum}``; stopping after the current run' )
+        self.stop_requested = True
+
     ## end Controller()
 
 
+def lap( timings: dict, step: str, mark: float ) -> float:
+    """ Records the seconds since `mark` as timings[step]; returns the new mark.
+        Called by Controller.process_source_directory() """
+    now = time.monotonic()
+    timings[step] = round( now - mark, 3 )
+    return now
+
+
+
+def parse_args() -> dict:
+    """ Parses arguments when module called via __main__ """
+    parser = argparse.ArgumentParser( description='Processes new end-of-day files.' )
+    parser.add_argument( '--watch', help='keep running, processing files as they arrive (instead of one cron-run)', action='store_true' )
+    args: dict = vars( parser.parse_args() )
+    return args
+
 
 if __name__ == '__main__':
-    log.info( '\n\nstarting processing...' )
+    args: dict = parse_args()
     c = Controller()
-    c.manage_processing()
-    log.info( 'processing complete\n---' )
+    if args['watch']:
+        log.info( '\n\nstarting watch...' )
+        c.watch()
+    else:
+        log.info( '\n\nstarting processing...' )
+        c.manage_processing()
+        log.info( 'processing complete\n---' )
@@ -0,0 +1,130 @@
+"""
+Persistent sqlite cache of alma item-api responses, keyed by barcode.
+
+- Successful responses are kept for the positive-ttl.
+- "No items found for barcode" responses are kept (negative-caching) for the shorter negative-ttl.
+- Other error-responses are never cached.
+- The table is trimmed, oldest-first, to max_entries.
+
+Enabled by setting ANXEODALERTS__ALMA_CACHE_PATH; see cache_from_environ().
+"""
+
+import json, logging, os, threading, time
+
+from annex_eod_alerts_code.lib import db_helper
+
+log = logging.getLogger(__name__)
+
+
+class ItemCache(object):
+    """ Barcode -> parsed item-api response. """
+
+    def __init__( self, db_path: str, positive_ttl_seconds: float = 72*3600, negative_ttl_seconds: float = 3600, max_entries: int = 200000 ):
+        self.db_path = db_path
+        self.positive_ttl_seconds = positive_ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.max_entries = max_entries
+        self.puts_since_eviction = 0
+        self.lock = threading.Lock()
+        self.conn = db_helper.connect( db_path )
+        with self.conn:
+            self.conn.execute( '''CREATE TABLE IF NOT EXISTS items (
+                barcode TEXT PRIMARY KEY,
+                is_negative INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                response_json TEXT NOT NULL )''' )
+            self.conn.execute( 'CREATE INDEX IF NOT EXISTS items_fetched_at ON items (fetched_at)' )
+
+    def get( self, barcode: str ):
+        """ Returns the cached response-dict, or None if absent or expired.
+            Called by alma_client.AlmaClient.get_item() """
+        with self.lock:
+            row = self.conn.execute( 'SELECT is_negative, fetched_at, response_json FROM items WHERE barcode = ?', (barcode,) ).fetchone()
+        if row is None:
+            return None
+        ( is_negative, fetched_at, response_json ) = row
+        ttl = self.negative_ttl_seconds if is_negative else self.positive_ttl_seconds
+        if time.time() - fetched_at > ttl:
+            log.debug( f'cache entry expired for barcode, ``{barcode}``' )
+            return None
+        return json.loads( response_json )
+
+    def put( self, barcode: str, item_data: dict ) -> None:
+        """ Stores a cacheable response; ignores anything that's neither a found-item nor a no-items-found response.
+            Called by alma_client.AlmaClient.get_item() """
+        if 'item_data' in item_data:
+            is_negative = 0
+        elif is_no_items_found( item_data ):
+            is_negative = 1
+        else:
+            log.debug( f'not caching error-response for barcode, ``{barcode}``' )
+            return
+        with self.lock:
+            with self.conn:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO items (barcode, is_negative, fetched_at, response_json) VALUES (?, ?, ?, ?)',
+                    (barcode, is_negative, time.time(), json.dumps(item_data)) )
+            self.puts_since_eviction += 1
+            if self.puts_since_eviction >= 1000:
+                self.evict_locked()
+
+    def invalidate( self, barcode: str ) -> None:
+        """ Drops a barcode's entry, eg after a PUT has changed the item.
+            Called by alma_client.AlmaClient.update_item() """
+        with self.lock:
+            with self.conn:
+                self.conn.execute( 'DELETE FROM items WHERE barcode = ?', (barcode,) )
+
+    def evict( self ) -> None:
+        """ Removes expired entries, then trims to max_entries, oldest first.
+            Called by alma_client.AlmaClient.close() """
+        with self.lock:
+            self.evict_locked()
+
+    def evict_locked( self ) -> None:
+        """ Eviction work; caller holds self.lock.
+            Called by put() and evict() """
+        now = time.time()
+        with self.conn:
+            self.conn.execute(
+                'DELETE FROM items WHERE (is_negative = 1 AND fetched_at < ?) OR (is_negative = 0 AND fetched_at < ?)',
+                (now - self.negative_ttl_seconds, now - self.positive_ttl_seconds) )
+            ( count, ) = self.conn.execute( 'SELECT COUNT(*) FROM items' ).fetchone()
+            excess = count - self.max_entries
+            if excess > 0:
+                self.conn.execute(
+                    'DELETE FROM items WHERE barcode IN (SELECT barcode FROM items ORDER BY fetched_at ASC LIMIT ?)', (excess,) )
+                log.debug( f'evicted ``{excess}`` oldest cache entries' )
+        self.puts_since_eviction = 0
+
+    def close( self ) -> None:
+        with self.lock:
+            self.conn.close()
+
+    ## end class ItemCache()
+
+
+def is_no_items_found( item_data: dict ) -> bool:
+    """ Returns True if the item-api response is alma's "no items found for barcode" error.
+        Called by ItemCache.put() and alma_client.classify_item_response() """
+    try:
+        for error in item_data['errorList']['error']:
+            if 'no items found for barcode' in error.get( 'errorMessage', '' ).lower():
+                return True
+    except Exception:
+        pass
+    return False
+
+
+def cache_from_environ():
+    """ Returns an ItemCache if ANXEODALERTS__ALMA_CACHE_PATH is set, otherwise None.
+        Called by alma_client.client_from_environ() and the lib scripts. """
+    db_path: str = os.environ.get( 'ANXEODALERTS__ALMA_CACHE_PATH', '' )
+    if not db_path:
+        return None
+    cache = ItemCache(
+        db_path,
+        positive_ttl_seconds=float( os.environ.get('ANXEODALERTS__ALMA_CACHE_POSITIVE_TTL_HOURS', '72') ) * 3600,
+        negative_ttl_seconds=float( os.environ.get('ANXEODALERTS__ALMA_CACHE_NEGATIVE_TTL_HOURS', '1') ) * 3600,
+        max_entries=int( os.environ.get('ANXEODALERTS__ALMA_CACHE_MAX_ENTRIES', '200000') ) )
+    return cache
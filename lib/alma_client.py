@@ -0,0 +1,190 @@
+"""
+Shared client for the Alma items-api.
+
+One keep-alive `requests.Session` per client, so connections (and TLS handshakes) are reused across barcodes.
+Url-templates and headers are built once, at instantiation, rather than on every call.
+An optional alma_cache.ItemCache short-circuits repeat GETs.
+
+Throttling (429) and server-errors (5xx), and connection-problems, are retried with capped, jittered exponential backoff;
+  a Retry-After header is honoured in full, and one longer than max_retry_after_seconds defers the call at once.
+If they persist, AlmaUnavailableError is raised -- so callers can tell "alma is unavailable" apart from
+  "no items found for barcode". A shared circuit-breaker stops calls entirely during an outage.
+"""
+
+import logging, os, threading, time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from annex_eod_alerts_code.lib import alma_cache, item_record, throttle
+
+log = logging.getLogger(__name__)
+
+TRANSIENT_STATUS_CODES: set = { 429, 500, 502, 503, 504 }
+
+
+class AlmaUnavailableError(Exception):
+    """ Raised when alma couldn't be reached, or kept throttling/erroring, after retries -- or the circuit-breaker is open. """
+    pass
+
+
+class AlmaClient(object):
+    """ Wraps GET and PUT calls to the alma items-api. """
+
+    def __init__( self, get_url_root: str, api_key: str, put_url_root: str = '', timeout: float = 20, pool_size: int = 10, rate_limiter=None, cache=None,
+                  max_retries: int = 3, backoff_base_seconds: float = 0.5, backoff_cap_seconds: float = 8.0, breaker=None, max_retry_after_seconds: float = 60.0 ):
+        self.get_url_template: str = f'{get_url_root}?item_barcode={{barcode}}&apikey={api_key}'
+        self.put_url_root: str = put_url_root
+        self.put_url_query: str = f'?generate_description=false&apikey={api_key}'
+        self.get_headers: dict = {'Accept': 'application/json'}
+        self.put_headers: dict = {'Accept': 'application/json', 'Content-Type': 'application/json'}
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter  # optional; anything with an acquire() method, eg throttle.TokenBucket
+        self.cache = cache  # optional alma_cache.ItemCache
+        self.max_retries = max_retries
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_cap_seconds = backoff_cap_seconds
+        self.max_retry_after_seconds = max_retry_after_seconds  # a longer Retry-After isn't waited out; the call is deferred
+        self.breaker = breaker if breaker else throttle.CircuitBreaker()
+        self.session = requests.Session()
+        adapter = HTTPAdapter( pool_connections=1, pool_maxsize=pool_size )
+        self.session.mount( 'https://', adapter )
+        self.session.mount( 'http://', adapter )
+        self.metrics: dict = { 'get_count': 0, 'put_count': 0, 'exception_count': 0, 'cache_hit_count': 0, 'retry_count': 0, 'elapsed_seconds': 0.0 }
+        self.metrics_lock = threading.Lock()
+
+    def get_item( self, barcode: str, bypass_cache: bool = False ) -> dict:
+        """ Returns the item-api json for the barcode (including alma's error-json, eg "no items found");
+              raises AlmaUnavailableError if alma couldn't be reached.
+            `bypass_cache` forces a fresh GET (the result still refreshes the cache); the write-path uses it.
+            Called by checker.check_alma_api(), the lib scripts, and the proof-of-concept scripts. """
+        if self.cache and not bypass_cache:
+            cached_data = self.cache.get( barcode )
+            if cached_data is not None:
+                with self.metrics_lock:
+                    self.metrics['cache_hit_count'] += 1
+                return cached_data
+        url: str = self.get_url_template.format( barcode=barcode )
+        r = self.request( 'get', url, 'get_count', headers=self.get_headers )
+        item_data: dict = r.json()
+        if self.cache:
+            self.cache.put( barcode, item_data )
+        return item_data
+
+    def update_item( self, mmsid: str, holding_id: str, item_pid: str, payload_data: dict ) -> dict:
+        """ PUTs payload_data to the item and returns the response json; raises AlmaUnavailableError if alma couldn't be reached.
+            (The PUT replaces the whole item, so retrying it is safe.)
+            Called by script_query_and_change.try_update() and proof_of_concept_api_WRITE.py """
+        assert self.put_url_root, 'put_url_root not configured'
+        put_url_base: str = self.put_url_root.replace( '{MMSID}', mmsid ).replace( '{HOLDING_ID}', holding_id ).replace( '{ITEM_PID}', item_pid )
+        url: str = f'{put_url_base}{self.put_url_query}'
+        if self.cache:
+            self.cache.invalidate( payload_data.get('item_data', {}).get('barcode', '') )
+        r = self.request( 'put', url, 'put_count', headers=self.put_headers, json=payload_data )
+        return r.json()
+
+    def request( self, method: str, url: str, metric_key: str, **kwargs ):
+        """ Performs the pooled request, retrying transient failures, and updating metrics.
+            Called by get_item() and update_item() """
+        attempt = 0
+        while True:
+            try:
+                is_trial: bool = self.breaker.before_call()
+            except throttle.CircuitOpenError as e:
+                raise AlmaUnavailableError( repr(e) )
+            try:
+                if self.rate_limiter:
+                    self.rate_limiter.acquire()
+                ( r, problem, retry_after ) = ( None, '', 0.0 )
+                start = time.monotonic()
+                try:
+                    r = self.session.request( method, url, timeout=self.timeout, **kwargs )
+                    if r.status_code in TRANSIENT_STATUS_CODES:
+                        problem = f'status-code ``{r.status_code}``'
+                        retry_after = parse_retry_after( r.headers.get('Retry-After', '') )
+                except requests.exceptions.RequestException as e:
+                    problem = repr( e )
+                self.record( metric_key, time.monotonic() - start, exception=(r is None) )
+                if not problem:
+                    self.breaker.record_success()
+                    return r
+                self.breaker.record_failure()
+            finally:
+                if is_trial:
+                    self.breaker.end_trial()  # so an unexpected exception can't leave the breaker waiting on the trial for good
+            if attempt >= self.max_retries:
+                raise AlmaUnavailableError( f'alma {method} failed after ``{attempt + 1}`` attempts; last problem, {problem}' )
+            if retry_after > self.max_retry_after_seconds:
+                raise AlmaUnavailableError( f'alma {method} asked for a ``{retry_after}``-second Retry-After, over the ``{self.max_retry_after_seconds}``-second limit; {problem}' )
+            delay = max( retry_after, throttle.backoff_seconds(attempt, self.backoff_base_seconds, self.backoff_cap_seconds) )  # Retry-After is a floor
+            log.warning( f'transient alma {method} problem, {problem}; retrying in ``{delay:.2f}`` seconds' )
+            with self.metrics_lock:
+                self.metrics['retry_count'] += 1
+            time.sleep( delay )
+            attempt += 1
+
+    def record( self, metric_key: str, elapsed: float, exception: bool = False ):
+        """ Updates call-metrics.
+            Called by request() """
+        with self.metrics_lock:
+            self.metrics[metric_key] += 1
+            self.metrics['elapsed_seconds'] += elapsed
+            if exception:
+                self.metrics['exception_count'] += 1
+
+    def close( self ):
+        """ Closes pooled connections, and trims the cache.
+            Called by the lib scripts at the end of a run. """
+        self.session.close()
+        if self.cache:
+            self.cache.evict()
+            self.cache.close()
+
+    ## end class AlmaClient()
+
+
+def parse_retry_after( header_value: str ) -> float:
+    """ Returns the Retry-After header's delay-seconds; 0 if absent or in http-date form.
+        Called by AlmaClient.request() """
+    try:
+        return max( 0.0, float(header_value) )
+    except ValueError:
+        return 0.0
+
+
+def classify_item_response( err, item_data ) -> str:
+    """ Returns 'found', 'not_found' (alma's "no items found for barcode"), 'unavailable' (AlmaUnavailableError: retries
+          used up, a too-long Retry-After, or the circuit-breaker open), or 'failed' (any other error or error-body, eg an
+          invalid barcode or a bad api-key; retrying won't help, so it's reported rather than deferred).
+        `item_data` is a raw response, or an item_record.ItemRecord projected from a found-item response.
+        Called by checker.classify_barcode() """
+    if err:
+        return 'unavailable' if is_unavailable_error( err ) else 'failed'
+    if isinstance( item_data, item_record.ItemRecord ) or 'item_data' in item_data:
+        return 'found'
+    if alma_cache.is_no_items_found( item_data ):
+        return 'not_found'
+    return 'failed'
+
+
+def is_unavailable_error( err ) -> bool:
+    """ Returns True if a lookup's err is an AlmaUnavailableError, or its repr (as checker.check_alma_api() returns it).
+        Called by classify_item_response() """
+    return isinstance( err, AlmaUnavailableError ) or str( err ).startswith( f'{AlmaUnavailableError.__name__}(' )
+
+
+def client_from_environ( api_key_envar: str = 'ANXEODALERTS__ITEM_API_KEY', **kwargs ) -> AlmaClient:
+    """ Builds a client from the standard envars; `api_key_envar` allows the scripts to use the write-key.
+        Called by checker, the lib scripts, and the proof-of-concept scripts. """
+    client = AlmaClient(
+        get_url_root=os.environ['ANXEODALERTS__ITEM_API_ROOT'],
+        api_key=os.environ[api_key_envar],
+        put_url_root=os.environ.get( 'ANXEODALERTS__ITEM_PUT_API_ROOT', '' ),
+        cache=alma_cache.cache_from_environ(),
+        max_retries=int( os.environ.get('ANXEODALERTS__ALMA_MAX_RETRIES', '3') ),
+        max_retry_after_seconds=float( os.environ.get('ANXEODALERTS__ALMA_MAX_RETRY_AFTER_SECONDS', '60') ),
+        breaker=throttle.CircuitBreaker(
+            failure_threshold=int( os.environ.get('ANXEODALERTS__ALMA_BREAKER_THRESHOLD', '10') ),
+            reset_seconds=float( os.environ.get('ANXEODALERTS__ALMA_BREAKER_RESET_SECONDS', '60') ) ),
+        **kwargs )
+    return client
@@ -0,0 +1,203 @@
+'''
+Date-sharded archive layout.
+
+- Archives go in `<ARCHIVES_DIR>/YYYY/MM/` (by archive-date), optionally gzipped (ANXEODALERTS__ARCHIVE_GZIP=true).
+- Each month-directory has a `manifest.jsonl`: one line per archive, with its file-name, prefix, barcode-count,
+    and the sha256 of its (uncompressed) contents.
+- Each month-directory also keeps the month's combined barcode-lists, `COMBINED_<YYYY>-<M>_<PREFIX>_BARCODES.txt`,
+    updated as each archive is written, so script_create_monthly_file `--normalize` doesn't have to re-read the month's archives.
+- migrate_flat_archives() moves a flat (pre-sharding) archive-directory into the layout, once.
+
+Usage (one-time migration)...
+- assumes:
+    - ANXEODALERTS__ENCLOSING_PROJECT_PATH is set
+    - ANXEODALERTS__TRACKER_FILE_PATH is set (so the migration waits on, and holds, the controller's run-lock);
+        otherwise, stop the controller first
+- % cd ./annex_eod_alerts_code
+- % source ../env/bin/activate
+- % python3 ./lib/archive_store.py --migrate --archive_dir_path /path/to/dir
+'''
+
+import argparse, gzip, json, logging, os, re, shutil, sys
+
+sys.path.append( os.environ['ANXEODALERTS__ENCLOSING_PROJECT_PATH'] )
+from annex_eod_alerts_code.lib import barcode_reader, checksums, run_lock
+
+log = logging.getLogger(__name__)
+
+
+MANIFEST_NAME = 'manifest.jsonl'
+ARCHIVE_NAME_PATTERN = re.compile( r'^ORIG_(?P<prefix>[A-Z]{5})_(?P<year>\d{4})-(?P<month>\d{2})-\d{2}T[^.]*\.(txt|dat)(\.gz)?$' )
+
+
+def compress_from_environ() -> bool:
+    """ Returns whether new archives should be gzipped (ANXEODALERTS__ARCHIVE_GZIP).
+        Called by file_handler.archive_new_files() """
+    return os.environ.get( 'ANXEODALERTS__ARCHIVE_GZIP', 'false' ).lower() == 'true'
+
+
+def parse_archive_name( file_name: str ):
+    """ Returns ( prefix, year, month ) for an archive file-name (eg `ORIG_QHACS_2021-10-01T08-30-05.txt`), else None.
+        Called by month_archive_names() and migrate_flat_archives() """
+    match = ARCHIVE_NAME_PATTERN.match( file_name )
+    if match is None:
+        return None
+    return ( match.group('prefix'), match.group('year'), match.group('month') )
+
+
+def month_dir( archive_dir: str, year, month, create: bool = True ) -> str:
+    """ Returns (and by default creates) the month's shard-directory, `<archive_dir>/YYYY/MM`.
+        Called by file_handler.archive_new_files(), script_create_monthly_file, and migrate_flat_archives() """
+    month_path = os.path.join( archive_dir, f'{int(year):04d}', f'{int(month):02d}' )
+    if create:
+        os.makedirs( month_path, exist_ok=True )
+    return month_path
+
+
+def rollup_path( month_path: str, year, month, prefix: str ) -> str:
+    """ Returns the path of the month's combined barcode-list for a prefix (named as script_create_monthly_file names its output).
+        Called by record_archive(), and script_create_monthly_file """
+    return os.path.join( month_path, f'COMBINED_{int(year)}-{int(month)}_{prefix}_BARCODES.txt' )
+
+
+def write_compressed( source_path: str, archive_path: str ) -> None:
+    """ Gzips the source-file to the archive-path, via a temp-file and rename.
+        Called by file_handler.archive_new_files() """
+    temp_path = f'{archive_path}.part'
+    with open( source_path, 'rb' ) as source_fh, gzip.open( temp_path, 'wb', compresslevel=6 ) as archive_fh:
+        shutil.copyfileobj( source_fh, archive_fh, 1024 * 1024 )
+    os.replace( temp_path, archive_path )
+    return
+
+
+def write_checksum_file( archive_path: str, checksum: str ) -> str:
+    """ Writes `<archive_path>.sha256` (`sha256sum -c` format, so for a gzipped archive it's the checksum of the .gz-file);
+          returns its path.
+        Called by file_handler.archive_new_files() and migrate_flat_archives() """
+    checksum_path = f'{archive_path}.sha256'
+    with open( checksum_path, 'w' ) as fh:
+        fh.write( f'{checksum}  {os.path.basename(archive_path)}\n' )
+    return checksum_path
+
+
+def record_archive( month_path: str, year, month, prefix: str, archive_path: str, content_path: str, checksum: str ) -> int:
+    """ Adds a new archive's barcodes to the month's rollup for its prefix, then appends its manifest-line;
+          returns its barcode-count. `content_path` is read for the barcodes (the uncompressed source, when there is one).
+        The manifest-line is written last, so a listed archive is always reflected in the rollup.
+        Called by file_handler.archive_new_files() and migrate_flat_archives() """
+    barcode_count = update_rollup( rollup_path(month_path, year, month, prefix), barcode_reader.iter_barcodes(content_path) )
+    entry: dict = {
+        'file': os.path.basename( archive_path ),
+        'prefix': prefix,
+        'line_count': barcode_count,
+        'sha256': checksum,
+        'compressed': archive_path.endswith( '.gz' ) }
+    with open( os.path.join(month_path, MANIFEST_NAME), 'a' ) as fh:
+        fh.write( json.dumps(entry) + '\n' )
+        fh.flush()
+        os.fsync( fh.fileno() )
+    log.debug( f'recorded archive, ``{entry}``' )
+    return barcode_count
+
+
+def update_rollup( path: str, barcodes ) -> int:
+    """ Appends the barcodes not already in the rollup-file, keeping first-seen order; returns the count of barcodes read.
+        The file is rewritten via a temp-file and rename, so it's never seen half-updated.
+        Called by record_archive() """
+    existing: dict = {}  # insertion-ordered set
+    if os.path.exists( path ):
+        existing = dict.fromkeys( barcode_reader.iter_barcodes(path) )
+    ( barcode_count, added ) = ( 0, [] )
+    for barcode in barcodes:
+        barcode_count += 1
+        if barcode not in existing:
+            existing[barcode] = None
+            added.append( barcode )
+    if added or not os.path.exists( path ):
+        temp_path = f'{path}.part'
+        with open( temp_path, 'w' ) as fh:
+            fh.writelines( f'{barcode}\n' for barcode in existing )
+        os.replace( temp_path, path )
+    return barcode_count
+
+
+def read_manifest( month_path: str ) -> list:
+    """ Returns the month's manifest-entries, oldest first; [] if there's no manifest.
+        Called by script_create_monthly_file, and migrate_flat_archives() """
+    try:
+        with open( os.path.join(month_path, MANIFEST_NAME) ) as fh:
+            return [ json.loads(line) for line in fh if line.strip() ]
+    except FileNotFoundError:
+        return []
+
+
+def month_archive_names( month_path: str ) -> list:
+    """ Returns the archive file-names in a month-directory (checksum-files, rollups, and the manifest are skipped).
+        Called by script_create_monthly_file """
+    try:
+        with os.scandir( month_path ) as entries:
+            return sorted( entry.name for entry in entries if entry.is_file() and parse_archive_name(entry.name) )
+    except FileNotFoundError:
+        return []
+
+
+def migrate_flat_archives( archive_dir: str ) -> int:
+    """ Moves archives from the top of `archive_dir` into their month-directories (oldest first, so rollups keep
+          chronological order), with checksum-files, manifest-lines, and rollups; returns the count moved.
+        Safe to re-run: files already in a month's manifest are only moved.
+        Called by __main__ """
+    flat_names: list = []
+    with os.scandir( archive_dir ) as entries:
+        for entry in entries:
+            if entry.is_file() and parse_archive_name( entry.name ):
+                flat_names.append( entry.name )
+    flat_names.sort( key=lambda name: (name.split('_')[2], name) )  # by archive-timestamp
+    recorded: dict = {}  # month_path -> set of manifest file-names
+    for file_name in flat_names:
+        ( prefix, year, month ) = parse_archive_name( file_name )
+        month_path = month_dir( archive_dir, year, month )
+        if month_path not in recorded:
+            recorded[month_path] = { entry['file'] for entry in read_manifest(month_path) }
+        ( source_path, archive_path ) = ( os.path.join(archive_dir, file_name), os.path.join(month_path, file_name) )
+        os.replace( source_path, archive_path )
+        checksum_name = f'{file_name}.sha256'
+        if os.path.exists( os.path.join(archive_dir, checksum_name) ):
+            os.replace( os.path.join(archive_dir, checksum_name), os.path.join(month_path, checksum_name) )
+        if file_name in recorded[month_path]:
+            continue
+        if file_name.endswith( '.gz' ):
+            with gzip.open( archive_path, 'rb' ) as fh:
+                checksum = checksums.hash_fileobj( fh )
+        else:
+            checksum = checksums.hash_file( archive_path )
+        if not os.path.exists( os.path.join(month_path, checksum_name) ):
+            write_checksum_file( archive_path, checksums.hash_file(archive_path) if file_name.endswith('.gz') else checksum )
+        record_archive( month_path, year, month, prefix, archive_path, archive_path, checksum )
+        recorded[month_path].add( file_name )
+    log.info( f'moved ``{len(flat_names)}`` archive(s) into month-directories under ``{archive_dir}``' )
+    return len( flat_names )
+
+
+def parse_args() -> dict:
+    """ Parses arguments when module called via __main__ """
+    parser = argparse.ArgumentParser( description='Moves flat archives into the YYYY/MM layout.' )
+    parser.add_argument( '--migrate', help='move flat archives into month-directories', action='store_true', required=True )
+    parser.add_argument( '--archive_dir_path', '-a', help='archive directory-path required', required=True )
+    args: dict = vars( parser.parse_args() )
+    return args
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=os.environ.get( 'ANXEODALERTS__LOG_LEVEL', 'INFO' ),
+        format='[%(asctime)s] %(levelname)s [%(module)s-%(funcName)s()::%(lineno)d] %(message)s',
+        datefmt='%d/%b/%Y %H:%M:%S' )
+    args: dict = parse_args()
+    lock = run_lock.lock_from_environ( os.environ['ANXEODALERTS__TRACKER_FILE_PATH'] ) if 'ANXEODALERTS__TRACKER_FILE_PATH' in os.environ else None
+    if lock:
+        lock.acquire( blocking=True )  # so the controller doesn't archive mid-migration
+    try:
+        migrate_flat_archives( args['archive_dir_path'] )
+    finally:
+        if lock:
+            lock.release()
@@ -0,0 +1,142 @@
+'''
+Indexed history of every barcode in the archived end-of-day files: ( barcode, category, archive-file, date ).
+
+- file_handler.archive_new_files() adds each new archive's barcodes as it's written.
+- backfill() indexes an existing archive-directory (flat or YYYY/MM-sharded) once; re-runs skip indexed archives.
+- history() and last_seen() are index-lookups, eg "when was this barcode last refiled, and where?".
+
+The db lives at ANXEODALERTS__BARCODE_HISTORY_DB_PATH (default: `barcode_history.sqlite3` in the archives-directory).
+
+Usage...
+- assumes:
+    - ANXEODALERTS__ENCLOSING_PROJECT_PATH and ANXEODALERTS__ARCHIVES_DIR are set
+- % cd ./annex_eod_alerts_code
+- % source ../env/bin/activate
+- % python3 ./lib/barcode_history.py --backfill
+- % python3 ./lib/barcode_history.py --barcode 31236090000000
+'''
+
+import argparse, logging, os, sys, threading, time
+
+sys.path.append( os.environ['ANXEODALERTS__ENCLOSING_PROJECT_PATH'] )
+from annex_eod_alerts_code.lib import archive_store, barcode_reader, categories, db_helper
+
+log = logging.getLogger(__name__)
+
+
+class BarcodeHistory(object):
+    """ barcode -> the archives it appeared in. """
+
+    def __init__( self, db_path: str ):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = db_helper.connect( db_path )
+        with self.conn:
+            self.conn.execute( '''CREATE TABLE IF NOT EXISTS barcode_events (
+                barcode TEXT NOT NULL,
+                category TEXT NOT NULL,
+                archive_file TEXT NOT NULL,
+                archived_on TEXT NOT NULL,
+                PRIMARY KEY (barcode, archive_file) ) WITHOUT ROWID''' )
+            self.conn.execute( 'CREATE INDEX IF NOT EXISTS barcode_events_barcode_date ON barcode_events (barcode, archived_on)' )
+            self.conn.execute( 'CREATE TABLE IF NOT EXISTS indexed_archives ( archive_file TEXT PRIMARY KEY, barcode_count INTEGER NOT NULL, indexed_at REAL NOT NULL )' )
+
+    def record_archive( self, archive_path: str, barcodes ):
+        """ Adds an archive's barcodes, in one transaction; returns the count read, or None if the archive was already indexed.
+            Called by file_handler.archive_new_files() and backfill() """
+        archive_file: str = os.path.basename( archive_path )
+        parsed = archive_store.parse_archive_name( archive_file )
+        if parsed is None:
+            raise Exception( f'not an archive file-name, ``{archive_file}``' )
+        prefix: str = parsed[0]
+        archived_on: str = archive_file.split( '_' )[2].split( 'T' )[0]  # `ORIG_QHACS_2021-10-01T08-30-05.txt` -> `2021-10-01`
+        with self.lock:
+            if self.conn.execute( 'SELECT 1 FROM indexed_archives WHERE archive_file = ?', (archive_file,) ).fetchone():
+                log.debug( f'already indexed, ``{archive_file}``' )
+                return None
+            rows: list = [ (barcode, prefix, archive_file, archived_on) for barcode in barcodes ]
+            with self.conn:
+                self.conn.executemany( 'INSERT OR IGNORE INTO barcode_events (barcode, category, archive_file, archived_on) VALUES (?, ?, ?, ?)', rows )
+                self.conn.execute( 'INSERT INTO indexed_archives (archive_file, barcode_count, indexed_at) VALUES (?, ?, ?)', (archive_file, len(rows), time.time()) )
+        log.debug( f'indexed ``{len(rows)}`` barcodes from ``{archive_file}``' )
+        return len( rows )
+
+    def history( self, barcode: str, limit: int = 100 ) -> list:
+        """ Returns the barcode's appearances, newest first, as dicts of category, archive_file, and archived_on.
+            Called by __main__, and available to the checker and the lib scripts """
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT category, archive_file, archived_on FROM barcode_events WHERE barcode = ? ORDER BY archived_on DESC, archive_file DESC LIMIT ?',
+                (barcode, limit) ).fetchall()
+        return [ {'category': category, 'archive_file': archive_file, 'archived_on': archived_on} for ( category, archive_file, archived_on ) in rows ]
+
+    def last_seen( self, barcode: str, categories_filter: list = None ):
+        """ Returns the barcode's most recent appearance (optionally only in the given prefixes, eg ['QSREF', 'QHREF']), or None.
+            Available to the checker and the lib scripts """
+        sql = 'SELECT category, archive_file, archived_on FROM barcode_events WHERE barcode = ?'
+        params: list = [ barcode ]
+        if categories_filter:
+            sql += f' AND category IN ({", ".join("?" for category in categories_filter)})'
+            params.extend( categories_filter )
+        with self.lock:
+            row = self.conn.execute( sql + ' ORDER BY archived_on DESC, archive_file DESC LIMIT 1', params ).fetchone()
+        if row is None:
+            return None
+        return { 'category': row[0], 'archive_file': row[1], 'archived_on': row[2] }
+
+    def close( self ) -> None:
+        self.conn.close()
+
+    ## end class BarcodeHistory()
+
+
+def backfill( history: BarcodeHistory, archive_dir: str ) -> int:
+    """ Indexes every not-yet-indexed archive under `archive_dir` (flat and YYYY/MM-sharded); returns the count indexed.
+        Called by __main__ """
+    indexed_count = 0
+    for ( dir_path, dir_names, file_names ) in os.walk( archive_dir ):
+        dir_names.sort()
+        for file_name in sorted( file_names ):
+            if archive_store.parse_archive_name( file_name ) is None:
+                continue
+            archive_path = os.path.join( dir_path, file_name )
+            if history.record_archive( archive_path, barcode_reader.iter_barcodes(archive_path) ) is not None:
+                indexed_count += 1
+    log.info( f'indexed ``{indexed_count}`` archive(s) under ``{archive_dir}``' )
+    return indexed_count
+
+
+def history_from_environ() -> BarcodeHistory:
+    """ Returns the BarcodeHistory at ANXEODALERTS__BARCODE_HISTORY_DB_PATH.
+        Called by file_handler.archive_new_files() and __main__ """
+    default_path: str = os.path.join( os.environ.get('ANXEODALERTS__ARCHIVES_DIR', '.'), 'barcode_history.sqlite3' )
+    return BarcodeHistory( os.environ.get('ANXEODALERTS__BARCODE_HISTORY_DB_PATH', default_path) )
+
+
+def parse_args() -> dict:
+    """ Parses arguments when module called via __main__ """
+    parser = argparse.ArgumentParser( description='Queries (or backfills) the barcode-history db.' )
+    parser.add_argument( '--barcode', '-b', help='barcode to look up' )
+    parser.add_argument( '--backfill', help='index the archives-directory (ANXEODALERTS__ARCHIVES_DIR, or --archive_dir_path)', action='store_true' )
+    parser.add_argument( '--archive_dir_path', '-a', help='archive directory-path, for --backfill', default='' )
+    parser.add_argument( '--limit', help='max appearances to show', type=int, default=100 )
+    args: dict = vars( parser.parse_args() )
+    if not args['barcode'] and not args['backfill']:
+        parser.error( '--barcode or --backfill required' )
+    return args
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=os.environ.get( 'ANXEODALERTS__LOG_LEVEL', 'INFO' ),
+        format='[%(asctime)s] %(levelname)s [%(module)s-%(funcName)s()::%(lineno)d] %(message)s',
+        datefmt='%d/%b/%Y %H:%M:%S' )
+    args: dict = parse_args()
+    history = history_from_environ()
+    if args['backfill']:
+        backfill( history, args['archive_dir_path'] or os.environ['ANXEODALERTS__ARCHIVES_DIR'] )
+    if args['barcode']:
+        for entry in history.history( args['barcode'], args['limit'] ):
+            results_key: str = categories.CATEGORIES_BY_PREFIX.get( entry['category'], {} ).get( 'results_key', '' )
+            print( f'{entry["archived_on"]}  {entry["category"]}  {results_key:<20}  {entry["archive_file"]}' )
+    history.close()
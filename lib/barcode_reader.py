@@ -0,0 +1,50 @@
+"""
+Streaming barcode-file reader shared by checker and the lib scripts.
+
+The file is memory-mapped and split in bulk, a chunk at a time, so memory stays flat on very large files,
+  and callers can start work on the first barcodes before the rest of the file is parsed.
+Surrounding whitespace (including CRLF line-endings) is stripped, and blank lines are skipped.
+Gzipped files (`.gz`, eg compressed archives) are streamed line by line instead.
+"""
+
+import gzip, logging, mmap, os
+
+log = logging.getLogger(__name__)
+
+
+def iter_barcodes( file_path, chunk_size: int = 1024 * 1024 ):
+    """ Yields barcodes, in file order.
+        Called by checker, script_query_and_change, script_file_path_to_csv, script_create_monthly_file, and archive_store """
+    if str( file_path ).endswith( '.gz' ):
+        yield from iter_gzipped_barcodes( file_path )
+        return
+    with open( file_path, 'rb' ) as fh:
+        size: int = os.fstat( fh.fileno() ).st_size
+        if size == 0:  # mmap can't map an empty file
+            return
+        with mmap.mmap( fh.fileno(), 0, access=mmap.ACCESS_READ ) as mm:
+            start = 0
+            while start < size:
+                end = min( start + chunk_size, size )
+                if end < size:  # end the chunk on a line-boundary
+                    newline_index = mm.rfind( b'\n', start, end )
+                    if newline_index == -1:
+                        newline_index = mm.find( b'\n', end )
+                    end = size if newline_index == -1 else newline_index + 1
+                for line in mm[start:end].split( b'\n' ):
+                    barcode = line.strip()
+                    if barcode:
+                        yield barcode.decode( 'utf8' )
+                start = end
+    return
+
+
+def iter_gzipped_barcodes( file_path ):
+    """ Yields barcodes from a gzipped file, in file order.
+        Called by iter_barcodes() """
+    with gzip.open( file_path, 'rb' ) as fh:
+        for line in fh:
+            barcode = line.strip()
+            if barcode:
+                yield barcode.decode( 'utf8' )
+    return
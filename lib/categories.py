@@ -0,0 +1,17 @@
+"""
+Registry of the end-of-day file categories.
+
+Each entry ties a GFA file-name prefix to its results_dct key and its archive_paths_dct key.
+Adding a category is a matter of adding an entry here.
+"""
+
+CATEGORIES: tuple = (
+    { 'prefix': 'QSACS', 'results_key': 'non_hay_accessions', 'archive_path_key': 'non_hay_accessions_archive_path' },
+    { 'prefix': 'QHACS', 'results_key': 'hay_accessions', 'archive_path_key': 'hay_accessions_archive_path' },
+    { 'prefix': 'QSREF', 'results_key': 'non_hay_refiles', 'archive_path_key': 'non_hay_refiles_archive_path' },
+    { 'prefix': 'QHREF', 'results_key': 'hay_refiles', 'archive_path_key': 'hay_refiles_archive_path' },
+    )
+
+CATEGORIES_BY_PREFIX: dict = { category['prefix']: category for category in CATEGORIES }
+
+PREFIXES: list = [ category['prefix'] for category in CATEGORIES ]
@@ -1,171 +1,162 @@
-import json, logging, os, pathlib, pprint, time
-import requests
+import concurrent.futures, logging, os, pathlib, threading, time
+
+from annex_eod_alerts_code.lib import alma_client, barcode_reader, categories, item_mirror, item_record, item_rules, log_helper, throttle
 
 log = logging.getLogger(__name__)
 
+ALMA_REQUESTS_PER_SECOND = float( os.environ.get('ANXEODALERTS__ALMA_REQUESTS_PER_SECOND', '10') )
+ALMA_MAX_WORKERS = int( os.environ.get('ANXEODALERTS__ALMA_MAX_WORKERS', '8') )
+alma_rate_limiter = throttle.TokenBucket( ALMA_REQUESTS_PER_SECOND )  # shared by all four checks
+alma_api = alma_client.client_from_environ( timeout=10, pool_size=ALMA_MAX_WORKERS, rate_limiter=alma_rate_limiter )
+( item_mirror_store, ITEM_MIRROR_MAX_AGE_SECONDS ) = item_mirror.mirror_from_environ()  # store is None unless configured
+barcode_log_sampler = log_helper.sampler_from_environ()  # per-barcode debug-output is logged for every nth barcode
+DEFERRED_RECHECK_SECONDS = float( os.environ.get('ANXEODALERTS__DEFERRED_RECHECK_SECONDS', '3600') )  # a deferred barcode is rechecked at most this often
+DEFERRED_MAX_RECHECKS = int( os.environ.get('ANXEODALERTS__DEFERRED_MAX_RECHECKS', '24') )  # then it's reported as a failed lookup
+RECHECK_LISTS: dict = {  # recheck-outcome -> results_dct list-key
+    'not_found': 'list_of_rechecked_not_found', 'failed': 'list_of_rechecked_lookup_failed', 'misplaced': 'list_of_rechecked_misplaced' }
+
 
 def initialize_results_dct( archive_paths_dct ):
     """ Creates structure to hold check-data.
-        Called by manages_check_barcodes() """
-    results_dct = {
-        'non_hay_accessions': {
-            'count_barcodes': 0,
-            'count_problematic_barcodes': 0,
-            'list_of_barcodes_not_found_in_alma': [],
-            'path_to_archived_file': archive_paths_dct['non_hay_accessions_archive_path']
-        },
-        'non_hay_refiles': {
-            'count_barcodes': 0,
-            'count_problematic_barcodes': 0,
-            'list_of_barcodes_not_found_in_alma': [],
-            'path_to_archived_file': archive_paths_dct['non_hay_refiles_archive_path']
-        },
-        'hay_accessions': {
-            'count_barcodes': 0,
-            'count_problematic_barcodes': 0,
-            'list_of_barcodes_not_found_in_alma': [],
-            'path_to_archived_file': archive_paths_dct['hay_accessions_archive_path']
-        },
-        'hay_refiles': {
+        Called by controller.process_new_files() """
+    results_dct = {}
+    for category in categories.CATEGORIES:
+        results_dct[category['results_key']] = {
             'count_barcodes': 0,
             'count_problematic_barcodes': 0,
             'list_of_barcodes_not_found_in_alma': [],
-            'path_to_archived_file': archive_paths_dct['hay_refiles_archive_path']
-        },
-    }
-    log.debug( f'initialized results_dct, ``{pprint.pformat(results_dct)}``' )
+            'count_failed_lookups': 0,
+            'list_of_barcodes_lookup_failed': [],  # alma returned some other error (eg invalid barcode, bad api-key); not retried
+            'count_deferred_barcodes': 0,
+            'list_of_barcodes_deferred': [],  # alma unavailable (throttling, server-errors, outage); not checked, but kept for a later recheck
+            'count_misplaced_barcodes': 0,
+            'list_of_barcodes_misplaced': [],  # found, but library/location doesn't match the file's annex (see item_rules.py)
+            'barcode_outcomes': [],  # ( barcode, outcome ) for every barcode in the file, including 'ok'; see classify_barcode()
+            ## barcodes deferred on earlier runs, rechecked this run; counted apart from this run's file
+            'count_rechecked_barcodes': 0,
+            'list_of_rechecked_not_found': [],
+            'list_of_rechecked_lookup_failed': [],  # includes barcodes still unavailable after DEFERRED_MAX_RECHECKS rechecks
+            'list_of_rechecked_misplaced': [],
+            'count_still_deferred_barcodes': 0,  # still unavailable; kept for the next recheck, not re-listed
+            'rechecked_outcomes': [],  # ( barcode, outcome ) for every rechecked barcode
+            'path_to_archived_file': archive_paths_dct[category['archive_path_key']]
+        }
+    log.debug( 'initialized results_dct, ``%s``', log_helper.LazyPformat(results_dct) )
     return results_dct
 
 
-def check_non_hay_accessions( new_file_paths, results_dct, tracker_path ):
-    """ Manages check of non-hay accessions and updates results_dct.
+def check_categories( new_file_paths, results_dct, tracker, lookups=None ):
+    """ Checks every registered category concurrently, each updating its own section of results_dct.
+        Raises the first category-problem, after all categories have finished.
         Called by controller.process_new_files() """
-    try:
-        assert type(new_file_paths) == list
-        assert type(results_dct) == dict
-        assert type(tracker_path) == str
-        target_file_path = select_path( new_file_paths, 'QSACS' )
-        barcode_list = []
-        if target_file_path:
-            barcode_list = load_barcodes( target_file_path )
-        results_dct['non_hay_accessions']['count_barcodes'] = len( barcode_list )
-        for barcode in barcode_list:
-            log.debug( f'barcode, ``{barcode}``' )
-            ( err, alma_api_data_dct ) = check_alma_api( barcode )
-            time.sleep( .25 )
-            try:
-                if alma_api_data_dct['item_data']['barcode'] != barcode:
-                    log.debug( 'barcode found; continuing' )
-                    pass
-            except Exception as e:
-                log.exception( repr(e) )
-                results_dct['non_hay_accessions']['count_problematic_barcodes'] += 1
-                results_dct['non_hay_accessions']['list_of_barcodes_not_found_in_alma'].append( barcode )
-        log.debug( f'updated results_dct, ``{pprint.pformat(results_dct)}``' )
-        if target_file_path:
-            update_tracker( target_file_path, tracker_path )
-        return
-    except Exception as e:
-        message = f'Problem checking non-hay-accessions; exception, ``{repr(e)}``'
-        raise Exception( message )
+    assert type(new_file_paths) == list
+    assert type(results_dct) == dict
+    with concurrent.futures.ThreadPoolExecutor( max_workers=len(categories.CATEGORIES) ) as executor:
+        futures = [ executor.submit(check_category, category, new_file_paths, results_dct, tracker, lookups) for category in categories.CATEGORIES ]
+    for future in futures:
+        future.result()  # re-raises a category's exception
+    log.debug( 'updated results_dct, ``%s``', log_helper.LazyPformat(results_dct) )
+    return
 
 
-def check_hay_accessions( new_file_paths, results_dct, tracker_path ):
-    """ Manages check of non-hay accessions and updates results_dct.
-        Called by controller.process_new_files() """
+def check_category( category, new_file_paths, results_dct, tracker, lookups=None ):
+    """ Manages check of one category's file and updates its results_dct section.
+        Also rechecks the category's barcodes deferred on earlier runs and due a recheck (see recheck_deferred()),
+          and adds this run's deferred barcodes to the tracker-store.
+        Called by check_categories() """
     try:
-        target_file_path = select_path( new_file_paths, 'QHACS' )
+        category_results = results_dct[category['results_key']]
+        target_file_path = select_path( new_file_paths, category['prefix'] )
         barcode_list = []
         if target_file_path:
-            barcode_list = load_barcodes( target_file_path )
-        results_dct['hay_accessions']['count_barcodes'] = len( barcode_list )
-        for barcode in barcode_list:
-            log.debug( f'barcode, ``{barcode}``' )
-            ( err, alma_api_data_dct ) = check_alma_api( barcode )
-            time.sleep( .25 )
-            try:
-                if alma_api_data_dct['item_data']['barcode'] != barcode:
-                    log.debug( 'barcode found; continuing' )
-                    pass
-            except Exception as e:
-                log.exception( repr(e) )
-                results_dct['hay_accessions']['count_problematic_barcodes'] += 1
-                results_dct['hay_accessions']['list_of_barcodes_not_found_in_alma'].append( barcode )
-        log.debug( f'updated results_dct, ``{pprint.pformat(results_dct)}``' )
+            barcode_list = lookups.load_barcodes( target_file_path ) if lookups else load_barcodes( target_file_path )
+        category_results['count_barcodes'] = len( barcode_list )
+        api_results = lookup_barcodes( barcode_list, lookups )
+        for ( barcode, ( err, alma_api_data_dct ) ) in zip( barcode_list, api_results ):
+            outcome = classify_barcode( category['prefix'], err, alma_api_data_dct )
+            if outcome == 'unavailable':
+                log.warning( f'barcode, ``{barcode}`` deferred; alma unavailable, ``{err}``' )
+            tally_outcome( category_results, barcode, outcome )
+            category_results['barcode_outcomes'].append( (barcode, outcome) )
+        recheck_deferred( category, barcode_list, category_results, tracker, lookups )
         if target_file_path:
-            update_tracker( target_file_path, tracker_path )
+            update_tracker( target_file_path, tracker, category['results_key'], category_results['list_of_barcodes_deferred'] )
         return
     except Exception as e:
-        message = f'Problem checking hay-accessions; exception, ``{repr(e)}``'
+        label = category['results_key'].replace( '_', '-' )
+        message = f'Problem checking {label}; exception, ``{repr(e)}``'
         raise Exception( message )
 
 
-def check_non_hay_refiles( new_file_paths, results_dct, tracker_path ):
-    """ Manages check of non-hay refiles and updates results_dct.
-        Called by controller.process_new_files() """
-    try:
-        target_file_path = select_path( new_file_paths, 'QSREF' )
-        barcode_list = []
-        if target_file_path:
-            barcode_list = load_barcodes( target_file_path )
-        results_dct['non_hay_refiles']['count_barcodes'] = len( barcode_list )
-        for barcode in barcode_list:
-            log.debug( f'barcode, ``{barcode}``' )
-            ( err, alma_api_data_dct ) = check_alma_api( barcode )
-            time.sleep( .25 )
-            try:
-                if alma_api_data_dct['item_data']['barcode'] != barcode:
-                    log.debug( 'barcode found; continuing' )
-                    pass
-            except Exception as e:
-                log.exception( repr(e) )
-                results_dct['non_hay_refiles']['count_problematic_barcodes'] += 1
-                results_dct['non_hay_refiles']['list_of_barcodes_not_found_in_alma'].append( barcode )
-        log.debug( f'updated results_dct, ``{pprint.pformat(results_dct)}``' )
-        if target_file_path:
-            update_tracker( target_file_path, tracker_path )
+def recheck_deferred( category, barcode_list, category_results, tracker, lookups=None ):
+    """ Rechecks the category's barcodes deferred on earlier runs and not checked for DEFERRED_RECHECK_SECONDS.
+        Checked ones are cleared from the tracker-store, and their problems listed in the rechecked-lists; still-unavailable
+          ones are kept, until their DEFERRED_MAX_RECHECKS-th recheck, when they're reported as failed lookups instead.
+        A carried barcode that's also in this run's file is reported from the file, not again here.
+        Called by check_category() """
+    carried_rows = tracker.deferred_barcodes( category['results_key'], time.time() - DEFERRED_RECHECK_SECONDS )
+    if not carried_rows:
         return
-    except Exception as e:
-        message = f'Problem checking non-hay-accessions; exception, ``{repr(e)}``'
-        raise Exception( message )
+    carried_list = [ barcode for ( barcode, recheck_count ) in carried_rows ]
+    listed = set( barcode_list )
+    ( resolved, still_deferred ) = ( [], [] )
+    for ( ( barcode, recheck_count ), ( err, alma_api_data_dct ) ) in zip( carried_rows, lookup_barcodes(carried_list, lookups) ):
+        outcome = classify_barcode( category['prefix'], err, alma_api_data_dct )
+        if outcome == 'unavailable' and recheck_count + 1 < DEFERRED_MAX_RECHECKS:
+            still_deferred.append( barcode )
+            if barcode not in listed:
+                category_results['count_rechecked_barcodes'] += 1
+                category_results['count_still_deferred_barcodes'] += 1
+                category_results['rechecked_outcomes'].append( (barcode, outcome) )
+            continue
+        if outcome == 'unavailable':
+            log.warning( f'barcode, ``{barcode}`` still unavailable after ``{recheck_count + 1}`` rechecks; reporting it as a failed lookup' )
+            outcome = 'failed'
+        resolved.append( barcode )
+        if barcode not in listed:
+            category_results['count_rechecked_barcodes'] += 1
+            category_results['rechecked_outcomes'].append( (barcode, outcome) )
+            if outcome in ( 'not_found', 'failed', 'misplaced' ):
+                category_results[RECHECK_LISTS[outcome]].append( barcode )
+    tracker.stage_resolved( category['results_key'], resolved )
+    tracker.stage_rechecked( category['results_key'], still_deferred )
+    log.info( f'rechecked ``{len(carried_rows)}`` previously-deferred {category["results_key"]} barcodes; ``{len(resolved)}`` resolved' )
+    return
 
 
-def check_hay_refiles( new_file_paths, results_dct, tracker_path ):
-    """ Manages check of hay refiles and updates results_dct.
-        Called by controller.process_new_files() """
-    try:
-        target_file_path = select_path( new_file_paths, 'QHREF' )
-        barcode_list = []
-        if target_file_path:
-            barcode_list = load_barcodes( target_file_path )
-        results_dct['hay_refiles']['count_barcodes'] = len( barcode_list )
-        for barcode in barcode_list:
-            log.debug( f'barcode, ``{barcode}``' )
-            ( err, alma_api_data_dct ) = check_alma_api( barcode )
-            time.sleep( .25 )
-            try:
-                if alma_api_data_dct['item_data']['barcode'] != barcode:
-                    log.debug( 'barcode found; continuing' )
-                    pass
-            except Exception as e:
-                log.exception( repr(e) )
-                results_dct['hay_refiles']['count_problematic_barcodes'] += 1
-                results_dct['hay_refiles']['list_of_barcodes_not_found_in_alma'].append( barcode )
-        log.debug( f'updated results_dct, ``{pprint.pformat(results_dct)}``' )
-        if target_file_path:
-            update_tracker( target_file_path, tracker_path )
-        return
-    except Exception as e:
-        message = f'Problem checking non-hay-accessions; exception, ``{repr(e)}``'
-        raise Exception( message )
+def classify_barcode( prefix, err, alma_api_data_dct ):
+    """ Returns 'not_found', 'failed', 'unavailable', 'misplaced', or 'ok' for a barcode's lookup-result.
+        Called by check_category() and recheck_deferred() """
+    outcome = alma_client.classify_item_response( err, alma_api_data_dct )
+    if outcome == 'found':
+        outcome = 'misplaced' if item_rules.misplaced_fields( prefix, alma_api_data_dct ) else 'ok'
+    return outcome
+
+
+def tally_outcome( category_results, barcode, outcome ):
+    """ Counts and lists a barcode's problem-outcome in its category's results.
+        Called by check_category() """
+    if outcome == 'not_found':
+        category_results['count_problematic_barcodes'] += 1
+        category_results['list_of_barcodes_not_found_in_alma'].append( barcode )
+    elif outcome == 'failed':
+        category_results['count_failed_lookups'] += 1
+        category_results['list_of_barcodes_lookup_failed'].append( barcode )
+    elif outcome == 'unavailable':
+        category_results['count_deferred_barcodes'] += 1
+        category_results['list_of_barcodes_deferred'].append( barcode )
+    elif outcome == 'misplaced':
+        category_results['count_misplaced_barcodes'] += 1
+        category_results['list_of_barcodes_misplaced'].append( barcode )
+    return
 
 
 def select_path( new_file_paths, selector ):
     """ Returns proper path from paths-list.
-        Called by check_non_hay_accessions() and others """
+        Called by check_category() """
     assert type(new_file_paths) == list
     assert type(selector) == str
-    log.debug( f'new_file_paths, ``{pprint.pformat(new_file_paths)}``' )
+    log.debug( 'new_file_paths, ``%s``', log_helper.LazyPformat(new_file_paths) )
     log.debug( f'selector, ``{selector}``' )
     target_file_path = ''
     for file_path in new_file_paths:
@@ -179,85 +170,161 @@ def select_path( new_file_paths, selector ):
     return target_file_path
 
 
-def load_barcodes( file_path ):
-    """ Opens file; loads barcods into list.
-        Called by check_non_hay_accessions() and others. """
-    log.debug( 'starting load_barcodes()' )
+def load_barcodes( file_path, on_barcode=None ):
+    """ Streams the file's barcodes into a list (blank lines skipped); `on_barcode`, if given, is called with each barcode as it's read.
+        Called by check_category() and BarcodeLookups.load_barcodes() """
     log.debug( f'file_path, ``{file_path}``' )
+    barcodes = []
     try:
-        barcodes = []
-        with open( file_path, 'rb') as fp:
-            for line in fp:
-                log.debug( f'line, ``{line}``' )
-                barcode = line.decode('utf8').strip()
-                barcodes.append( barcode )
+        for barcode in barcode_reader.iter_barcodes( file_path ):
+            barcodes.append( barcode )
+            if on_barcode:
+                on_barcode( barcode )
     except Exception as e:
         log.exception( 'Problem preparing barcode list.' )
-    log.debug( f'barcodes, ``{barcodes}``' )
+    log.debug( f'``{len(barcodes)}`` barcodes loaded' )
     return barcodes
 
 
 def check_alma_api( barcode ):
-    """ Checks alma-api with barcode and returns data.
-        Called by check_non_hay_accessions() and others. """
+    """ Checks alma-api with barcode and returns ( err, data ); found items are returned as compact item_record.ItemRecord
+          projections, so the run's lookups don't hold full api-responses.
+        If the local item-mirror is configured, a fresh mirror-record answers without an api-call;
+          live api results for annex items refresh the mirror.
+        Called by BarcodeLookups.submit() """
     ( err, alma_api_data_dct ) = ( None, {} )
+    if item_mirror_store:
+        mirrored_data = item_mirror_store.lookup( barcode, ITEM_MIRROR_MAX_AGE_SECONDS )
+        if mirrored_data is not None:
+            log.debug( 'barcode, ``%s`` found in item-mirror', barcode )
+            return ( err, item_record.project(mirrored_data) )
     try:
-        URL_ROOT = os.environ['ANXEODALERTS__ITEM_API_ROOT']
-        API_KEY = os.environ['ANXEODALERTS__ITEM_API_KEY']
-        headers = {'Accept': 'application/json'}
-        url = "%s?item_barcode={barcode}&apikey=%s" % ( URL_ROOT, API_KEY )
-        log.debug( f'url, ``{url}``' )
-        full_url = url.format(barcode=barcode)
-        log.debug( f'full_url, ``{full_url}``' )
-        req = requests.get( full_url, headers=headers, timeout=10 )
-        alma_api_data_dct = req.json()
-        log.debug( f'alma_api_data_dct, ``{pprint.pformat(alma_api_data_dct)}``' )
-        log.debug( f'keys, ``{alma_api_data_dct.keys()}``' )
+        alma_api_data_dct = alma_api.get_item( barcode )
+        if item_mirror_store and 'item_data' in alma_api_data_dct:
+            item_mirror_store.upsert_from_api( alma_api_data_dct )
+        if log.isEnabledFor( logging.DEBUG ) and barcode_log_sampler.sample():
+            log.debug( 'sampled alma_api_data_dct for barcode, ``%s``, ``%s``', barcode, log_helper.LazyPformat(alma_api_data_dct) )
+        alma_api_data_dct = item_record.project( alma_api_data_dct )
+    except alma_client.AlmaUnavailableError as e:
+        log.warning( f'alma unavailable for barcode, ``{barcode}``; ``{e}``' )
+        err = repr(e)
     except Exception as e:
         log.exception( f'Problem accessing alma-api with barcode, ``{barcode}``' )
         err = repr(e)
         # raise Exception( err )
-    log.debug( f'alma_api_data_dct, ``{alma_api_data_dct}``' )
     return ( err, alma_api_data_dct )
 
 
+def lookup_barcodes( barcode_list, lookups=None ):
+    """ Returns ( err, alma_api_data_dct ) tuples in barcode_list order.
+        Uses the run's shared BarcodeLookups when given; otherwise looks up just this list.
+        Called by check_category() """
+    if not barcode_list:
+        return []
+    if lookups:
+        return lookups.get_many( barcode_list )
+    with BarcodeLookups() as list_lookups:
+        api_results = list_lookups.get_many( barcode_list )
+    return api_results
+
+
+class BarcodeLookups(object):
+    """ Single-flight alma lookups for one run.
+        Each unique barcode is fetched at most once, on a bounded worker-pool, no matter how many
+          files (or concurrently-running checks) ask for it. Also holds each file's loaded barcode-list,
+          so files read for the up-front prefetch aren't re-read by the checks. """
+
+    def __init__( self, max_workers=None ):
+        self.executor = concurrent.futures.ThreadPoolExecutor( max_workers=(max_workers or ALMA_MAX_WORKERS) )
+        self.futures = {}
+        self.barcode_lists = {}
+        self.lock = threading.Lock()
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, *args ):
+        self.executor.shutdown( wait=True )
+
+    def load_barcodes( self, file_path, submit=False ):
+        """ Returns the file's barcode-list, loading it once.
+            With `submit`, each new barcode's lookup starts as soon as it's read, before the rest of the file is parsed.
+            Called by prefetch_files() and check_category() """
+        with self.lock:
+            if file_path in self.barcode_lists:
+                return self.barcode_lists[file_path]
+        barcode_list = load_barcodes( file_path, on_barcode=(self.submit if submit else None) )
+        with self.lock:
+            self.barcode_lists[file_path] = barcode_list
+        return barcode_list
+
+    def prefetch_files( self, file_paths ):
+        """ Starts lookups for the deduplicated barcodes of all the run's files.
+            Called by controller.process_new_files() """
+        total_count = 0
+        for file_path in file_paths:
+            barcode_list = self.load_barcodes( file_path, submit=True )
+            total_count += len( barcode_list )
+        log.info( f'``{len(self.futures)}`` unique barcodes to look up, from ``{total_count}`` listed' )
+
+    def submit( self, barcode ):
+        """ Ensures a lookup is in flight (or done) for the barcode; returns its future.
+            Called by load_barcodes() and submit_many() """
+        with self.lock:
+            future = self.futures.get( barcode )
+            if future is None:
+                future = self.executor.submit( check_alma_api, barcode )
+                self.futures[barcode] = future
+        return future
+
+    def submit_many( self, barcode_list ):
+        """ Returns the lookup futures in barcode_list order.
+            Called by get_many() """
+        return [ self.submit(barcode) for barcode in barcode_list ]
+
+    def get_many( self, barcode_list ):
+        """ Returns ( err, alma_api_data_dct ) tuples in barcode_list order.
+            Called by lookup_barcodes() """
+        futures = self.submit_many( barcode_list )
+        return [ future.result() for future in futures ]
+
+    ## end class BarcodeLookups()
+
+
 def check_whether_to_send_email( results_dct ):
     ( err, send_email_result ) = ( None, False )
     try:
         assert type(results_dct) == dict
-        if ( results_dct['non_hay_accessions']['count_problematic_barcodes'] > 1 ):
-            send_email_result = True
-        elif ( results_dct['non_hay_refiles']['count_problematic_barcodes'] > 1 ):
-            send_email_result = True
-        elif ( results_dct['hay_accessions']['count_problematic_barcodes'] > 1 ):
-            send_email_result = True
-        elif ( results_dct['hay_refiles']['count_problematic_barcodes'] > 1 ):
-            send_email_result = True
+        for category in categories.CATEGORIES:
+            category_results = results_dct[category['results_key']]
+            if ( category_results['count_problematic_barcodes'] + category_results['count_failed_lookups'] > 1 ):  # failed lookups were once counted as not-found
+                send_email_result = True
+                break
+            if ( category_results['count_deferred_barcodes'] > 0 ):
+                send_email_result = True
+                break
+            if ( category_results['list_of_rechecked_not_found'] or category_results['list_of_rechecked_lookup_failed'] ):  # else never reported
+                send_email_result = True
+                break
     except Exception as e:
         err = repr(e)
     log.debug( f'send_email_result, ``{send_email_result}``' )
     return ( err, send_email_result )
 
 
-def update_tracker( file_path, tracker_path ):
-    """ Updates tracker with filename.
-        Called by check_hay_accessions(), etc. """
+def update_tracker( file_path, tracker, results_key='', deferred_barcodes=None ):
+    """ Stages the file-name, and its deferred barcodes, in the tracker-store; the controller commits the run's names
+          in one transaction, so a file is never marked processed without its deferred barcodes being kept for a recheck.
+        Called by check_category() """
     try:
         assert type(file_path) == str
-        assert type(tracker_path) == str
         log.debug( f'file_path, ``{file_path}``' )
-        assert type(file_path) == str
-        assert type(tracker_path) == str
-        recently_processed_files = []
-        with open( tracker_path ) as fh_reader:
-            recently_processed_files = json.loads( fh_reader.read() )
         path_obj = pathlib.Path( file_path )
         file_name = path_obj.name
         log.debug( f'file_name, ``{file_name}``')
-        recently_processed_files.append( file_name )
-        with open( tracker_path, 'w' ) as fh_writer:
-            jsn = json.dumps( recently_processed_files, sort_keys=True, indent=2 )
-            fh_writer.write( jsn )
+        tracker.stage( file_name )
+        if deferred_barcodes:
+            tracker.stage_deferred( results_key, file_name, deferred_barcodes )
         return
     except Exception as e:
         message = f'Problem updating tracker; exception, ``{repr(e)}``'
@@ -0,0 +1,21 @@
+"""
+sha256 checksums of file-contents, for archive-verification and for identifying a lib-script's input-file.
+"""
+
+import hashlib
+
+
+def hash_file( file_path: str, chunk_size: int = 1024 * 1024 ) -> str:
+    """ Returns the sha256 hex-digest of the file's contents.
+        Called by file_handler and archive_store for archive-checksums, and by run_journal.journal_from_environ() """
+    with open( file_path, 'rb' ) as fh:
+        return hash_fileobj( fh, chunk_size )
+
+
+def hash_fileobj( fh, chunk_size: int = 1024 * 1024 ) -> str:
+    """ Returns the sha256 hex-digest of an open binary file's (remaining) contents.
+        Called by hash_file(), and by archive_store for gzipped archives """
+    digest = hashlib.sha256()
+    for chunk in iter( lambda: fh.read(chunk_size), b'' ):
+        digest.update( chunk )
+    return digest.hexdigest()
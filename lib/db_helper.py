@@ -0,0 +1,25 @@
+import logging, os, sqlite3
+
+log = logging.getLogger(__name__)
+
+
+def connect( db_path: str ) -> sqlite3.Connection:
+    """ Returns a sqlite connection set up for the small local stores (WAL journaling, so a crash mid-write can't corrupt them).
+        The connection may be shared across threads; callers serialize access with their own lock.
+        Called by alma_cache.ItemCache() and the other sqlite-backed stores. """
+    parent_dir: str = os.path.dirname( os.path.abspath(db_path) )
+    os.makedirs( parent_dir, exist_ok=True )
+    conn = sqlite3.connect( db_path, timeout=30, check_same_thread=False )
+    conn.execute( 'PRAGMA journal_mode=WAL' )
+    conn.execute( 'PRAGMA synchronous=NORMAL' )
+    log.debug( f'connected to db, ``{db_path}``' )
+    return conn
+
+
+def ensure_column( conn: sqlite3.Connection, table: str, column: str, definition: str ) -> None:
+    """ Adds a column to a table created by an earlier version of a store, if it's missing.
+        Called by tracker_store.TrackerStore() and run_history.RunHistory() """
+    existing: list = [ row[1] for row in conn.execute(f'PRAGMA table_info({table})') ]
+    if column not in existing:
+        conn.execute( f'ALTER TABLE {table} ADD COLUMN {column} {definition}' )
+        log.info( f'added column ``{column}`` to table ``{table}``' )
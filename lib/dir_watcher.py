@@ -0,0 +1,133 @@
+"""
+Watches the source-directory for arriving files, for controller.py's `--watch` mode.
+
+- InotifyWatcher uses Linux inotify (IN_CLOSE_WRITE, IN_MOVED_TO), via ctypes, so a finished file is noticed within moments.
+- PollingWatcher compares directory-snapshots (name, size, mtime) on an interval, for filesystems without inotify
+    (eg some network mounts) and non-Linux hosts.
+- Both expose wait( timeout ), returning the names that changed: [] on timeout, or None if events may have been
+    missed (inotify queue-overflow) and the caller should rescan.
+- `signals_closed` says whether the returned names are known to be completely written (closed by their writer,
+    or moved in whole), so the controller can skip the size-stability wait for them.
+
+ANXEODALERTS__WATCH_MODE: 'auto' (default; inotify, falling back to polling), 'inotify', or 'poll'.
+"""
+
+import ctypes, ctypes.util, logging, os, select, struct, time
+
+log = logging.getLogger(__name__)
+
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+EVENT_HEADER = struct.Struct( 'iIII' )  # wd, mask, cookie, name-length
+
+
+class InotifyWatcher(object):
+    """ inotify watch on one directory. """
+
+    signals_closed: bool = True
+
+    def __init__( self, dir_path: str ):
+        self.dir_path = dir_path
+        libc = ctypes.CDLL( ctypes.util.find_library('c') or 'libc.so.6', use_errno=True )
+        self.fd = libc.inotify_init1( os.O_NONBLOCK | os.O_CLOEXEC )
+        if self.fd < 0:
+            error_number = ctypes.get_errno()
+            raise OSError( error_number, f'inotify_init1 failed, ``{os.strerror(error_number)}``' )
+        watch_descriptor = libc.inotify_add_watch( self.fd, os.fsencode(dir_path), IN_CLOSE_WRITE | IN_MOVED_TO )
+        if watch_descriptor < 0:
+            error_number = ctypes.get_errno()
+            os.close( self.fd )
+            raise OSError( error_number, f'inotify_add_watch failed for ``{dir_path}``, ``{os.strerror(error_number)}``' )
+        log.info( f'watching ``{dir_path}`` with inotify' )
+
+    def wait( self, timeout: float ):
+        """ Returns names closed-after-writing or moved-in, [] on timeout, or None on queue-overflow.
+            Called by controller.Controller.watch() """
+        ( readable, _, _ ) = select.select( [self.fd], [], [], timeout )
+        if not readable:
+            return []
+        try:
+            data = os.read( self.fd, 64 * 1024 )
+        except BlockingIOError:
+            return []
+        ( names, offset ) = ( [], 0 )
+        while offset + EVENT_HEADER.size <= len( data ):
+            ( wd, mask, cookie, name_length ) = EVENT_HEADER.unpack_from( data, offset )
+            offset += EVENT_HEADER.size
+            if mask & IN_Q_OVERFLOW:
+                log.warning( 'inotify queue overflowed; rescan needed' )
+                return None
+            name = data[offset:offset + name_length].rstrip( b'\0' )
+            offset += name_length
+            if name:
+                names.append( os.fsdecode(name) )
+        return names
+
+    def close( self ) -> None:
+        os.close( self.fd )
+
+    ## end class InotifyWatcher()
+
+
+class PollingWatcher(object):
+    """ Snapshot-comparison watch on one directory. """
+
+    signals_closed: bool = False  # a changed snapshot may be a file mid-write
+
+    def __init__( self, dir_path: str, interval_seconds: float = 5.0 ):
+        self.dir_path = dir_path
+        self.interval_seconds = interval_seconds
+        self.snapshot = self.take_snapshot()
+        self.next_poll = time.monotonic() + interval_seconds
+        log.info( f'watching ``{dir_path}`` by polling every ``{interval_seconds}`` seconds' )
+
+    def take_snapshot( self ) -> dict:
+        """ Returns {name: (size, mtime)} for the directory's files.
+            Called by __init__() and wait() """
+        snapshot: dict = {}
+        with os.scandir( self.dir_path ) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    stat_result = entry.stat()
+                    snapshot[entry.name] = ( stat_result.st_size, stat_result.st_mtime )
+        return snapshot
+
+    def wait( self, timeout: float ):
+        """ Returns names that are new or changed since the last snapshot, or [] if none by the timeout.
+            Snapshots are taken at most every `interval_seconds`, however short the timeout.
+            Called by controller.Controller.watch() """
+        deadline = time.monotonic() + timeout
+        while True:
+            now = time.monotonic()
+            if now >= self.next_poll:
+                self.next_poll = now + self.interval_seconds
+                snapshot = self.take_snapshot()
+                names = [ name for ( name, signature ) in snapshot.items() if self.snapshot.get(name) != signature ]
+                self.snapshot = snapshot
+                if names:
+                    return names
+            if now >= deadline:
+                return []
+            time.sleep( max(0, min(self.next_poll, deadline) - now) )
+
+    def close( self ) -> None:
+        pass
+
+    ## end class PollingWatcher()
+
+
+def watcher_from_environ( dir_path: str ):
+    """ Returns an InotifyWatcher, or a PollingWatcher where inotify isn't available (or ANXEODALERTS__WATCH_MODE is 'poll').
+        Called by controller.Controller.watch() """
+    mode: str = os.environ.get( 'ANXEODALERTS__WATCH_MODE', 'auto' ).lower()
+    interval_seconds = float( os.environ.get('ANXEODALERTS__WATCH_POLL_SECONDS', '5') )
+    if mode in ( 'auto', 'inotify' ):
+        try:
+            return InotifyWatcher( dir_path )
+        except ( OSError, AttributeError ) as e:  # AttributeError: libc without inotify (non-Linux)
+            if mode == 'inotify':
+                raise
+            log.warning( f'inotify unavailable, ``{repr(e)}``; falling back to polling' )
+    return PollingWatcher( dir_path, interval_seconds )
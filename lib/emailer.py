@@ -1,41 +1,109 @@
-import datetime, json, logging, os, pprint, smtplib, time
+import csv, datetime, gzip, io, json, logging, os, pprint
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
-import requests
+from annex_eod_alerts_code.lib import categories, outbox
 
 
 log = logging.getLogger(__name__)
 
+GZIP_THRESHOLD_BYTES = int( os.environ.get('ANXEODALERTS__ATTACHMENT_GZIP_THRESHOLD_BYTES', '65536') )  # larger attachments are gzipped
+MAX_ROWS_PER_ATTACHMENT = int( os.environ.get('ANXEODALERTS__ATTACHMENT_MAX_ROWS', '50000') )  # bounds message-size; the archived file has everything
+
+## results_dct barcode-lists reported as attachment rows -> issue label
+ISSUE_LISTS: tuple = (
+    ( 'list_of_barcodes_not_found_in_alma', 'not found in alma' ),
+    ( 'list_of_barcodes_lookup_failed', 'alma lookup failed' ),
+    ( 'list_of_barcodes_deferred', 'deferred; alma unavailable' ),
+    ( 'list_of_barcodes_misplaced', 'misplaced; library/location not the annex' ),
+    ( 'list_of_rechecked_not_found', 'not found in alma; rechecked, deferred on an earlier run' ),
+    ( 'list_of_rechecked_lookup_failed', 'alma lookup failed; rechecked, deferred on an earlier run' ),
+    ( 'list_of_rechecked_misplaced', 'misplaced; rechecked, deferred on an earlier run' ),
+    )
+
 
 def send_mail( barcode_check_results ):
-    """ Composes and sends email.
-        Called by controller.manage_processing() """
-    EMAIL_HOST = os.environ['ANXEODALERTS__EMAIL_HOST']
-    EMAIL_PORT = os.environ['ANXEODALERTS__EMAIL_PORT']
+    """ Composes the run's one report-email -- a short summary body, plus a barcode-CSV per category with issues --
+          and queues it in the outbox, which sends it in the background; returns err.
+        Called by controller.process_source_directory() """
     EMAIL_FROM = os.environ['ANXEODALERTS__EMAIL_FROM']
     EMAIL_RECIPIENTS = json.loads( os.environ['ANXEODALERTS__EMAIL_RECIPIENTS_JSON'] )
     try:
-        assert type(EMAIL_HOST) == str
-        assert type(EMAIL_PORT) == str
         assert type(EMAIL_FROM) == str
         assert type(EMAIL_RECIPIENTS) == list
-        log.debug( f'EMAIL_HOST, ``{EMAIL_HOST}``' )
-        log.debug( f'EMAIL_PORT, ``{EMAIL_PORT}``' )
         log.debug( f'EMAIL_FROM, ``{EMAIL_FROM}``' )
         log.debug( f'EMAIL_RECIPIENTS, ``{EMAIL_RECIPIENTS}``' )
 
-        message = json.dumps( barcode_check_results, indent=2, sort_keys=True )
-        s = smtplib.SMTP( EMAIL_HOST, EMAIL_PORT )
-        body = f'datetime: `{str(datetime.datetime.now())}`\n\nbarcode check-results...\n\n{message}\n\n[END]'
-        eml = MIMEText( f'{body}' )
+        eml = MIMEMultipart()
         eml['Subject'] = 'end-of-day barcode check agains Alma'
         eml['From'] = EMAIL_FROM
         eml['To'] = ';'.join( EMAIL_RECIPIENTS )
-        s.sendmail( EMAIL_FROM, EMAIL_RECIPIENTS, eml.as_string())
+        ( summary_lines, attachments ) = ( [], [] )
+        for category in categories.CATEGORIES:
+            category_results = barcode_check_results[category['results_key']]
+            summary_lines.append( summarize_category(category['results_key'], category_results) )
+            ( csv_bytes, row_count, truncated ) = build_category_csv( category_results )
+            if row_count:
+                attachment = csv_attachment( f'{category["results_key"]}.csv', csv_bytes )
+                attachments.append( attachment )
+                note = f' (first {row_count} rows; see the archived file for the rest)' if truncated else ''
+                summary_lines.append( f'    attached: {attachment.get_filename()}{note}' )
+        summary = '\n'.join( summary_lines )
+        body = f'datetime: `{str(datetime.datetime.now())}`\n\nbarcode check-results...\n\n{summary}\n\n[END]'
+        eml.attach( MIMEText(body, _subtype='plain', _charset='utf-8') )
+        for attachment in attachments:
+            eml.attach( attachment )
+        outbox.send( eml, EMAIL_FROM, EMAIL_RECIPIENTS )
     except Exception as e:
         err = repr( e )
-        log.exception( f'Problem sending mail, ``{err}``' )
-    return
+        log.exception( f'Problem queuing mail, ``{err}``' )
+        return err
+    return None
+
+
+def summarize_category( results_key: str, category_results: dict ) -> str:
+    """ Returns a category's summary-lines for the email-body.
+        Called by send_mail() """
+    lines = [
+        f'{results_key}: {category_results["count_barcodes"]} barcodes; '
+        f'{category_results["count_problematic_barcodes"]} not found in alma; '
+        f'{category_results["count_deferred_barcodes"]} deferred; '
+        f'{category_results.get("count_misplaced_barcodes", 0)} misplaced',
+        f'    archived file: {category_results["path_to_archived_file"]}' ]
+    if category_results.get( 'count_failed_lookups', 0 ):
+        lines.append( f'    {category_results["count_failed_lookups"]} alma lookups failed (eg invalid barcode); not retried' )
+    if category_results.get( 'count_rechecked_barcodes', 0 ):
+        lines.append(
+            f'    rechecked {category_results["count_rechecked_barcodes"]} barcodes deferred on earlier runs; '
+            f'{category_results["count_still_deferred_barcodes"]} still deferred' )
+    return '\n'.join( lines )
+
+
+def build_category_csv( category_results: dict, max_rows: int = 0 ) -> tuple:
+    """ Returns ( csv_bytes, row_count, truncated ) of barcode/issue rows, capped at max_rows.
+        Called by send_mail() """
+    max_rows = max_rows or MAX_ROWS_PER_ATTACHMENT
+    ( buffer, row_count, truncated ) = ( io.StringIO(), 0, False )
+    writer = csv.writer( buffer, dialect='excel' )
+    writer.writerow( ['barcode', 'issue'] )
+    for ( list_key, issue ) in ISSUE_LISTS:
+        for barcode in category_results.get( list_key, [] ):
+            if row_count >= max_rows:
+                truncated = True
+                break
+            writer.writerow( [barcode, issue] )
+            row_count += 1
+    return ( buffer.getvalue().encode('utf-8'), row_count, truncated )
+
+
+def csv_attachment( file_name: str, csv_bytes: bytes, gzip_threshold_bytes: int = 0 ) -> MIMEApplication:
+    """ Returns a CSV attachment, gzipped (and named .csv.gz) if larger than the threshold.
+        Called by send_mail() and the lib scripts' send_mail() """
+    gzip_threshold_bytes = gzip_threshold_bytes or GZIP_THRESHOLD_BYTES
+    if len( csv_bytes ) > gzip_threshold_bytes:
+        ( csv_bytes, file_name ) = ( gzip.compress(csv_bytes), f'{file_name}.gz' )
+    return MIMEApplication( csv_bytes, Name=file_name )
 
 
 # def _send_mail( message ):
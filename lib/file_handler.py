@@ -1,11 +1,13 @@
-import json, logging, os, pathlib, pprint, shutil, time
+import errno, logging, os, pathlib, pprint, shutil, time
+
+from annex_eod_alerts_code.lib import archive_store, barcode_history, barcode_reader, categories, checksums, tracker_store
 
 log = logging.getLogger(__name__)
 
 
 def check_directories( dir_paths ):
     """ Checks that directories exists.
-        Called by controller.manage_processing() """
+        Called by controller.process_source_directory() """
     log.debug( 'starting check_directories()' )
     err = None
     try:
@@ -26,35 +28,33 @@ def check_directories( dir_paths ):
     return err
 
 
-def scan_directory( dir_path ):
-    """ Returns file-paths in directory.
-        Called by controller.manage_processing()
-        TODO- get list sorted reverse-chronologically for faster subsequent processing. """
+def scan_directory( dir_path, prefix_list=None ):
+    """ Returns file-names in directory, newest first (by mtime).
+        Uses os.scandir type-info, so entries are skipped without extra stats; with `prefix_list`, names without a
+          listed prefix are dropped during the scan, and only the remaining candidates are stat'd for their mtime.
+        Called by controller.process_source_directory() """
     log.debug( 'starting scan_directory' )
     ( err, new_file_list ) = ( None, None )
     try:
         assert type(dir_path) == str
-        if (dir_path.endswith('/') == False):
-            directory = dir_path + '/'
-        else:
-            directory = dir_path
-        log.debug( f'scanned-directory, ``{directory}``' )
-        file_list = os.listdir(directory)
-        log.debug( f'file_list (count-``{len(file_list)}``), ``{pprint.pformat(file_list)}``' )
-        ## eliminate `.DS_Store`, eliminate directories, eliminate `.cnt` files
-        new_file_list = []
-        for file_name in file_list:
-            if file_name == '.DS_Store':
-                continue
-            elif '.cnt' in file_name:
-                continue
-            else:
-                sub_dir_name = dir_path + file_name
-                if os.path.isdir( sub_dir_name ):
+        prefixes = set( prefix_list ) if prefix_list is not None else None
+        log.debug( f'scanned-directory, ``{dir_path}``' )
+        ## eliminate `.DS_Store`, `.cnt` files, non-prefix files, and directories
+        ( candidates, entry_count ) = ( [], 0 )
+        with os.scandir( dir_path ) as entries:
+            for entry in entries:
+                entry_count += 1
+                file_name = entry.name
+                if file_name == '.DS_Store' or '.cnt' in file_name:
                     continue
-                else:
-                    new_file_list.append( file_name )
-        log.debug( f'pruned file-list (count-``{len(new_file_list)}``), ``{new_file_list}``' )
+                if prefixes is not None and file_name[0:5] not in prefixes:
+                    continue
+                if not entry.is_file():
+                    continue
+                candidates.append( (entry.stat().st_mtime, file_name) )
+        candidates.sort( key=lambda candidate: (-candidate[0], candidate[1]) )
+        new_file_list = [ file_name for ( mtime, file_name ) in candidates ]
+        log.debug( f'pruned file-list (count-``{len(new_file_list)}`` of ``{entry_count}`` entries), ``{new_file_list}``' )
     except Exception as e:
         err = repr(e)
         log.exception( f'Problem scanning directory, ``{err}``' )
@@ -62,37 +62,40 @@ def scan_directory( dir_path ):
 
 
 def load_recent_file_list( tracker_path ):
-    """ Loads tracker file of recently processed files.
-        Called by controller.manage_processing() """
+    """ Opens the tracker-store of processed files (importing the legacy json tracker-file on first use).
+        The returned store supports `file_name in recent_files`.
+        Called by controller.process_source_directory() """
     log.debug( 'loading recently processed files' )
-    ( err, recently_processed_files ) = ( None, [] )
+    ( err, recently_processed_files ) = ( None, None )
     try:
-        with open( tracker_path ) as fh:
-            recently_processed_files = json.loads( fh.read() )
+        recently_processed_files = tracker_store.store_from_environ( tracker_path )
     except Exception as e:
         err = repr(e)
-        log.exception( 'Problem opening tracker file' )
+        log.exception( 'Problem opening tracker store' )
     log.debug( f'err, ``{err}``' )
-    log.debug( f'recently_processed_files, ``{pprint.pformat(recently_processed_files)}``' )
     return ( err, recently_processed_files )
 
 
 def get_new_files( prefix_list, dir_files, recent_files ):
-    """ Returns target new-files in from dir_files.
-        Called by controller.manage_processing()
-        TODO: go through dir_files instead, and break when I have four files. """
+    """ Returns target new-files from dir_files: the newest not-yet-processed file for each prefix.
+        dir_files is expected newest-first (see scan_directory()); stops as soon as every prefix has a file.
+        Older unprocessed files for a prefix stay in place, for a later run.
+        Called by controller.process_source_directory() """
     log.debug( 'starting get_new_files()' )
     ( err, new_file_list ) = ( None, None )
     try:
         assert type(prefix_list) == list
         assert type(dir_files) == list
-        assert type(recent_files) == list
-        new_file_list = []
+        assert hasattr( recent_files, '__contains__' )  # tracker_store.TrackerStore, or a list
+        selected: dict = {}  # prefix -> file_name
         for file_name in dir_files:
-            if file_name[0:5] in prefix_list:
+            prefix = file_name[0:5]
+            if prefix in prefix_list and prefix not in selected:
                 if file_name not in recent_files:
-                    new_file_list.append( file_name )
-        new_file_list.sort()  # don't need to do this for the production code, but it makes testing easier.
+                    selected[prefix] = file_name
+                    if len( selected ) == len( set(prefix_list) ):
+                        break
+        new_file_list = sorted( selected.values() )  # don't need to do this for the production code, but it makes testing easier.
         if len( new_file_list ) > 0:
             log.info( f'new legit files, ``{new_file_list}``' )
         else:
@@ -103,44 +106,110 @@ def get_new_files( prefix_list, dir_files, recent_files ):
     return ( err, new_file_list )
 
 
+def filter_ready_files( new_files, source_dir, tracker, stable_seconds: float = 30, max_wait_seconds: float = 3600, closed_files=None ):
+    """ Returns the new-files that are completely written; partial ones are skipped, to be picked up by a later run.
+        - With a `.cnt` companion (`<name>.cnt` or `<stem>.cnt`), a file is ready when its barcode-count matches the count.
+            A file whose count still doesn't match after `max_wait_seconds` unmodified is let through, with a warning,
+            so a bad count-file can't hold it back forever.
+        - Otherwise a file is ready when its size and mtime are unchanged since a scan at least `stable_seconds` ago;
+            a file first seen already unmodified for `stable_seconds` is ready straight away.
+        - In watch-mode, `closed_files` maps names inotify saw closed-after-writing (or moved in) to their ( size, mtime_ns )
+            at that moment; such a file, unchanged since, is ready straight away.
+        Only a stat is needed per file, except when a count-file has to be checked.
+        Called by controller.process_source_directory() """
+    log.debug( 'starting filter_ready_files()' )
+    ( err, ready_files ) = ( None, None )
+    try:
+        assert type(new_files) == list
+        ready_files = []
+        now = time.time()
+        for file_name in new_files:
+            file_path = f'{source_dir}/{file_name}'
+            stat_result = os.stat( file_path )
+            quiet_seconds = now - stat_result.st_mtime
+            expected_count = read_count_file( source_dir, file_name )
+            if expected_count is not None:
+                line_count = sum( 1 for barcode in barcode_reader.iter_barcodes(file_path) )
+                if line_count == expected_count:
+                    ready_files.append( file_name )
+                elif quiet_seconds >= max_wait_seconds:
+                    log.warning( f'``{file_name}`` has ``{line_count}`` barcodes but its count-file says ``{expected_count}``; unmodified for ``{int(quiet_seconds)}`` seconds, so processing anyway' )
+                    ready_files.append( file_name )
+                else:
+                    log.info( f'``{file_name}`` not ready; ``{line_count}`` of ``{expected_count}`` barcodes' )
+                continue
+            if closed_files and closed_files.get( file_name ) == ( stat_result.st_size, stat_result.st_mtime_ns ):
+                ready_files.append( file_name )  # its writer closed it, and it hasn't been reopened for writing since
+                continue
+            observed_at = tracker.observe( file_name, stat_result.st_size, stat_result.st_mtime_ns )
+            if ( observed_at is not None and now - observed_at >= stable_seconds ) or ( observed_at is None and quiet_seconds >= stable_seconds ):
+                ready_files.append( file_name )
+            else:
+                log.info( f'``{file_name}`` not ready; size not yet stable' )
+        log.debug( f'ready_files, ``{ready_files}``' )
+    except Exception as e:
+        err = repr(e)
+        log.exception( f'Problem checking file-readiness, ``{err}``' )
+    return ( err, ready_files )
+
+
+def read_count_file( source_dir, file_name ):
+    """ Returns the count from a file's `.cnt` companion, or None if there's no (readable) count-file.
+        Called by filter_ready_files() """
+    stem = os.path.splitext( file_name )[0]
+    for count_name in ( f'{file_name}.cnt', f'{stem}.cnt' ):
+        try:
+            with open( f'{source_dir}/{count_name}' ) as fh:
+                return int( fh.read().split()[0] )
+        except FileNotFoundError:
+            continue
+        except ( ValueError, IndexError ):
+            log.warning( f'unreadable count-file, ``{count_name}``; falling back to the size-check' )
+            return None
+    return None
+
+
 def archive_new_files( new_file_names: list, source_dir: str, archive_dir: str ):
     """ Archives files and returns paths-dict.
-        Called by controller.manage_processing() """
+        Archives go in the `YYYY/MM/` month-directory, and each is added to the month's manifest and rollups (see archive_store).
+        An uncompressed archive is a hard-link to the source-file where possible (no data copied; delete_processed_files()
+          later removes the source-name, completing the move), else a kernel-side copy; see archive_file().
+          With ANXEODALERTS__ARCHIVE_GZIP=true, archives are gzipped instead.
+        A sha256 checksum is written alongside each archive, as `<archive-name>.sha256` (`sha256sum -c` format).
+        Each archive's barcodes are also added to the barcode-history db.
+        Called by controller.process_source_directory() """
     ( err, paths_dct ) = ( None, {} )
     try:
-        paths_dct = {
-            'non_hay_accessions_archive_path': '',
-            'hay_accessions_archive_path': '',
-            'non_hay_refiles_archive_path': '',
-            'hay_refiles_archive_path': '' }
+        paths_dct = { category['archive_path_key']: '' for category in categories.CATEGORIES }
         datestamp = make_datestamp()
-        archive_path: str = ''
+        ( year, month ) = ( datestamp[0:4], datestamp[5:7] )
+        month_path = archive_store.month_dir( archive_dir, year, month )
+        compress: bool = archive_store.compress_from_environ()
         for file_name in new_file_names:
             source_path = f'{source_dir}/{file_name}'
             log.debug( f'source_path, ``{source_path}``' )
-            if file_name[0:5] == 'QSACS':
-                archive_file_name = f'ORIG_QSACS_{datestamp}.txt'
-                archive_path = f'{archive_dir}/{archive_file_name}'
-                paths_dct['non_hay_accessions_archive_path'] = archive_path
-            elif file_name[0:5] == 'QHACS':
-                archive_file_name = f'ORIG_QHACS_{datestamp}.txt'
-                archive_path = f'{archive_dir}/{archive_file_name}'
-                paths_dct['hay_accessions_archive_path'] = archive_path
-            elif file_name[0:5] == 'QSREF':
-                archive_file_name = f'ORIG_QSREF_{datestamp}.txt'
-                archive_path = f'{archive_dir}/{archive_file_name}'
-                paths_dct['non_hay_refiles_archive_path'] = archive_path
-            elif file_name[0:5] == 'QHREF':
-                archive_file_name = f'ORIG_QHREF_{datestamp}.txt'
-                archive_path = f'{archive_dir}/{archive_file_name}'
-                paths_dct['hay_refiles_archive_path'] = archive_path
+            archive_path: str = ''
+            category = categories.CATEGORIES_BY_PREFIX.get( file_name[0:5] )
+            if category:
+                archive_file_name = f'ORIG_{category["prefix"]}_{datestamp}.txt' + ( '.gz' if compress else '' )
+                archive_path = f'{month_path}/{archive_file_name}'
+                paths_dct[category['archive_path_key']] = archive_path
             if archive_path == '':
                 raise Exception( 'problem setting archive_path' )
             else:
-                shutil.copyfile( source_path, archive_path )
-                time.sleep( .25 )
-                path_test = pathlib.Path( archive_path )
-                assert path_test.is_file()
+                checksum = checksums.hash_file( source_path )
+                archive_checksum = checksum
+                if compress:
+                    archive_store.write_compressed( source_path, archive_path )
+                    ( method, archive_checksum ) = ( 'gzip', checksums.hash_file(archive_path) )
+                else:
+                    method = archive_file( source_path, archive_path )
+                    if method == 'copy' and checksums.hash_file( archive_path ) != checksum:
+                        raise Exception( f'checksum mismatch after copying ``{source_path}`` to ``{archive_path}``' )
+                archive_store.write_checksum_file( archive_path, archive_checksum )
+                archive_store.record_archive( month_path, year, month, category['prefix'], archive_path, source_path, checksum )
+                log.debug( f'archived ``{source_path}`` by {method}, to ``{archive_path}``' )
+                index_barcode_history( archive_path, source_path )
     except Exception as e:
         err = repr(e)
         log.exception( 'Problem archiving new files, ``{err}``')
@@ -149,6 +218,72 @@ def archive_new_files( new_file_names: list, source_dir: str, archive_dir: str )
     return ( err, paths_dct )
 
 
+def index_barcode_history( archive_path: str, source_path: str ) -> None:
+    """ Adds the archive's barcodes to the barcode-history db; a problem is logged, but doesn't fail the archiving,
+          and the archive can be indexed later by `barcode_history.py --backfill`.
+        Called by archive_new_files() """
+    try:
+        history = barcode_history.history_from_environ()
+        try:
+            history.record_archive( archive_path, barcode_reader.iter_barcodes(source_path) )
+        finally:
+            history.close()
+    except Exception:
+        log.exception( f'Problem adding ``{archive_path}`` to the barcode-history db; run `barcode_history.py --backfill` later' )
+    return
+
+
+def archive_file( source_path: str, archive_path: str ) -> str:
+    """ Hard-links the archive to the source-file; across filesystems (or where links aren't supported), copies instead.
+        Returns 'hardlink' or 'copy'.
+        Called by archive_new_files() """
+    try:
+        os.link( source_path, archive_path )
+        return 'hardlink'
+    except OSError as e:
+        if e.errno not in ( errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EOPNOTSUPP ):
+            raise
+        log.debug( f'cannot hard-link ``{source_path}``, ``{repr(e)}``; copying' )
+    copy_file( source_path, archive_path )
+    return 'copy'
+
+
+def copy_file( source_path: str, destination_path: str ) -> None:
+    """ Copies in the kernel, with os.copy_file_range() (falling back to shutil.copyfile(), which uses sendfile on Linux),
+          via a temp-file and rename, so the destination is never seen partially written.
+        Called by archive_file() """
+    temp_path = f'{destination_path}.part'
+    try:
+        with open( source_path, 'rb' ) as source_fh, open( temp_path, 'wb' ) as destination_fh:
+            remaining: int = os.fstat( source_fh.fileno() ).st_size
+            while remaining > 0:
+                copied = os.copy_file_range( source_fh.fileno(), destination_fh.fileno(), remaining )
+                if copied == 0:
+                    break
+                remaining -= copied
+    except ( AttributeError, OSError ) as e:  # AttributeError: no copy_file_range (non-Linux)
+        log.debug( f'copy_file_range unavailable, ``{repr(e)}``; using shutil.copyfile()' )
+        shutil.copyfile( source_path, temp_path )
+    os.replace( temp_path, destination_path )
+    return
+
+
+def verify_archive( archive_path: str ):
+    """ Checks an archive (as stored; for a gzipped archive, the .gz-file) against its `.sha256` file; returns ( err, is_intact ).
+        Called on demand, eg when an archive is re-read months later """
+    ( err, is_intact ) = ( None, None )
+    try:
+        with open( f'{archive_path}.sha256' ) as fh:
+            expected: str = fh.read().split()[0]
+        is_intact = ( checksums.hash_file(archive_path) == expected )
+        if not is_intact:
+            log.warning( f'archive ``{archive_path}`` does not match its checksum' )
+    except Exception as e:
+        err = repr(e)
+        log.exception( f'Problem verifying archive, ``{err}``' )
+    return ( err, is_intact )
+
+
 # def archive_new_files( new_file_names, source_dir, archive_dir ):
 #     """ Archives files and returns paths-dict.
 #         Called by controller.manage_processing() """
@@ -207,7 +342,7 @@ def make_datestamp( time_obj=None ):
 
 def delete_processed_files( new_files, source_dir ):
     """ Deletes processed files.
-        Called by controller.manage_processing() """
+        Called by controller.process_source_directory() """
     err = None
     try:
         assert type(new_files) == list
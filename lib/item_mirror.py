@@ -0,0 +1,209 @@
+'''
+Local, indexed mirror of alma items in the annex locations (RKSTORAGE, HAYSTOR).
+
+- Loaded from a bulk alma export (CSV, or XML with one element per item).
+- Kept current incrementally: the checker upserts every item it fetches from the live api.
+- When ANXEODALERTS__ITEM_MIRROR_PATH is set, the checker looks barcodes up here first,
+    and falls back to the live api only for misses and for records older than ANXEODALERTS__ITEM_MIRROR_MAX_AGE_HOURS.
+
+Usage (import)...
+- assumes:
+    - ANXEODALERTS__ENCLOSING_PROJECT_PATH is set
+- % cd ./annex_eod_alerts_code
+- % source ../env/bin/activate
+- % python3 ./lib/item_mirror.py --export_path /path/to/export.csv --db_path /path/to/item_mirror.sqlite3
+'''
+
+import argparse, csv, logging, os, sys, threading, time
+import xml.etree.ElementTree as ET
+
+sys.path.append( os.environ['ANXEODALERTS__ENCLOSING_PROJECT_PATH'] )
+from annex_eod_alerts_code.lib import db_helper
+
+log = logging.getLogger(__name__)
+
+
+ANNEX_LOCATIONS: set = { 'RKSTORAGE', 'HAYSTOR' }
+
+CODE_FIELDS: tuple = ( 'library', 'location', 'base_status', 'process_type' )
+
+## export column/tag names -> mirror fields; first match wins
+FIELD_ALIASES: dict = {
+    'barcode': [ 'barcode', 'Barcode' ],
+    'title': [ 'title', 'Title' ],
+    'mms_id': [ 'mms_id', 'MMS Id', 'MMS ID' ],
+    'holding_id': [ 'holding_id', 'Holding Id', 'HOL Id' ],
+    'pid': [ 'pid', 'Item Id', 'Physical Item Id', 'item_pid' ],
+    'library_value': [ 'library', 'Library Code', 'library_code' ],
+    'library_desc': [ 'library_desc', 'Library Name', 'Library' ],
+    'location_value': [ 'location', 'Location Code', 'location_code' ],
+    'location_desc': [ 'location_desc', 'Location Name', 'Location' ],
+    'base_status_value': [ 'base_status', 'Base Status Code', 'base_status_code' ],
+    'base_status_desc': [ 'base_status_desc', 'Base Status', 'Status' ],
+    'process_type_value': [ 'process_type', 'Process Type Code', 'process_type_code' ],
+    'process_type_desc': [ 'process_type_desc', 'Process Type' ],
+    }
+
+COLUMNS: list = list( FIELD_ALIASES.keys() )
+
+
+class ItemMirror(object):
+    """ Barcode -> item library/location/status record. """
+
+    def __init__( self, db_path: str ):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = db_helper.connect( db_path )
+        column_sql = ', '.join( f'{column} TEXT' for column in COLUMNS if column != 'barcode' )
+        with self.conn:
+            self.conn.execute( f'CREATE TABLE IF NOT EXISTS items ( barcode TEXT PRIMARY KEY, {column_sql}, synced_at REAL NOT NULL, source TEXT NOT NULL )' )
+            self.conn.execute( 'CREATE INDEX IF NOT EXISTS items_location ON items (location_value)' )
+
+    def lookup( self, barcode: str, max_age_seconds: float ):
+        """ Returns an item-api-shaped dict for a fresh-enough record, otherwise None.
+            Called by checker.check_alma_api() """
+        with self.lock:
+            row = self.conn.execute( f'SELECT {", ".join(COLUMNS)}, synced_at FROM items WHERE barcode = ?', (barcode,) ).fetchone()
+        if row is None:
+            return None
+        record = dict( zip(COLUMNS + ['synced_at'], row) )
+        if time.time() - record['synced_at'] > max_age_seconds:
+            log.debug( f'mirror record stale for barcode, ``{barcode}``' )
+            return None
+        return record_to_item_data( record )
+
+    def upsert_records( self, records: list, source: str ) -> int:
+        """ Inserts/replaces field-dict records, in one transaction; returns the count written.
+            Called by import_export() and upsert_from_api() """
+        now = time.time()
+        placeholders = ', '.join( ['?'] * (len(COLUMNS) + 2) )
+        rows = [ tuple(record.get(column) for column in COLUMNS) + (now, source) for record in records if record.get('barcode') ]
+        with self.lock:
+            with self.conn:
+                self.conn.executemany( f'INSERT OR REPLACE INTO items ({", ".join(COLUMNS)}, synced_at, source) VALUES ({placeholders})', rows )
+        return len( rows )
+
+    def upsert_from_api( self, item_data: dict ) -> None:
+        """ Records a live item-api response, if the item is in an annex location.
+            Called by checker.check_alma_api() """
+        record = item_data_to_record( item_data )
+        if record['location_value'] in ANNEX_LOCATIONS:
+            self.upsert_records( [record], source='api' )
+
+    def import_export( self, export_path: str, annex_only: bool = True, batch_size: int = 5000 ) -> int:
+        """ Loads a bulk alma export (.csv, or .xml), in batches; returns the count imported.
+            Called by manage_import() """
+        reader = iter_xml_records if export_path.lower().endswith( '.xml' ) else iter_csv_records
+        ( batch, total ) = ( [], 0 )
+        for record in reader( export_path ):
+            if annex_only and record.get( 'location_value' ) not in ANNEX_LOCATIONS:
+                continue
+            batch.append( record )
+            if len( batch ) >= batch_size:
+                total += self.upsert_records( batch, source=os.path.basename(export_path) )
+                batch = []
+        total += self.upsert_records( batch, source=os.path.basename(export_path) )
+        log.info( f'imported ``{total}`` items from ``{export_path}``' )
+        return total
+
+    ## end class ItemMirror()
+
+
+def normalize_record( raw: dict ) -> dict:
+    """ Maps export column/tag names to mirror fields.
+        Called by iter_csv_records() and iter_xml_records() """
+    record: dict = {}
+    for ( field, aliases ) in FIELD_ALIASES.items():
+        value = None
+        for alias in aliases:
+            if raw.get( alias ) not in ( None, '' ):
+                value = raw[alias].strip()
+                break
+        record[field] = value
+    return record
+
+
+def iter_csv_records( export_path: str ):
+    """ Yields normalized records from a csv export.
+        Called by ItemMirror.import_export() """
+    with open( export_path, newline='', encoding='utf-8-sig' ) as fh:
+        for raw in csv.DictReader( fh ):
+            yield normalize_record( raw )
+
+
+def iter_xml_records( export_path: str ):
+    """ Yields normalized records from an xml export of `<item>` (or `<record>`) elements with one child-element per field.
+        Called by ItemMirror.import_export() """
+    for ( event, element ) in ET.iterparse( export_path, events=('end',) ):
+        if element.tag in ( 'item', 'record' ):
+            raw = { child.tag: (child.text or '') for child in element }
+            yield normalize_record( raw )
+            element.clear()
+
+
+def item_data_to_record( item_data: dict ) -> dict:
+    """ Flattens an item-api response to mirror fields.
+        Called by ItemMirror.upsert_from_api() """
+    record: dict = {
+        'barcode': item_data['item_data']['barcode'],
+        'title': item_data['bib_data'].get( 'title' ),
+        'mms_id': item_data['bib_data'].get( 'mms_id' ),
+        'holding_id': item_data['holding_data'].get( 'holding_id' ),
+        'pid': item_data['item_data'].get( 'pid' ) }
+    for field in CODE_FIELDS:
+        code: dict = item_data['item_data'].get( field ) or {}
+        record[f'{field}_value'] = code.get( 'value' )
+        record[f'{field}_desc'] = code.get( 'desc' )
+    return record
+
+
+def record_to_item_data( record: dict ) -> dict:
+    """ Rebuilds the item-api-shaped subset the checker and scripts read.
+        Called by ItemMirror.lookup() """
+    item_data: dict = {
+        'bib_data': { 'title': record['title'], 'mms_id': record['mms_id'] },
+        'holding_data': { 'holding_id': record['holding_id'] },
+        'item_data': { 'barcode': record['barcode'], 'pid': record['pid'] },
+        'mirror_synced_at': record['synced_at'] }
+    for field in CODE_FIELDS:
+        item_data['item_data'][field] = { 'desc': record[f'{field}_desc'], 'value': record[f'{field}_value'] or '' }
+    return item_data
+
+
+def mirror_from_environ():
+    """ Returns ( ItemMirror, max_age_seconds ) if ANXEODALERTS__ITEM_MIRROR_PATH is set, otherwise ( None, 0 ).
+        Called by checker """
+    db_path: str = os.environ.get( 'ANXEODALERTS__ITEM_MIRROR_PATH', '' )
+    if not db_path:
+        return ( None, 0 )
+    max_age_seconds = float( os.environ.get('ANXEODALERTS__ITEM_MIRROR_MAX_AGE_HOURS', '168') ) * 3600
+    return ( ItemMirror(db_path), max_age_seconds )
+
+
+def manage_import( export_path: str, db_path: str, annex_only: bool ) -> None:
+    """ Manages a bulk import.
+        Called by __main__ """
+    mirror = ItemMirror( db_path )
+    mirror.import_export( export_path, annex_only=annex_only )
+    return
+
+
+def parse_args() -> dict:
+    """ Parses arguments when module called via __main__ """
+    parser = argparse.ArgumentParser( description='Required: export_path; db_path defaults to ANXEODALERTS__ITEM_MIRROR_PATH.' )
+    parser.add_argument( '--export_path', '-e', help='alma export file (.csv or .xml) required', required=True )
+    parser.add_argument( '--db_path', '-d', help='mirror db path', default=os.environ.get('ANXEODALERTS__ITEM_MIRROR_PATH', '') )
+    parser.add_argument( '--all_locations', help='import items in all locations, not just the annex ones', action='store_true' )
+    args: dict = vars( parser.parse_args() )
+    return args
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format='[%(asctime)s] %(levelname)s [%(module)s-%(funcName)s()::%(lineno)d] %(message)s',
+        datefmt='%d/%b/%Y %H:%M:%S' )
+    args: dict = parse_args()
+    log.debug( f'args, ```{args}```' )
+    assert args['db_path'], 'db_path required (or set ANXEODALERTS__ITEM_MIRROR_PATH)'
+    manage_import( args['export_path'], args['db_path'], annex_only=(not args['all_locations']) )
@@ -0,0 +1,83 @@
+"""
+Compact record of the handful of item-response fields the checker and the lib scripts actually use.
+
+- ItemRecord uses __slots__ (no per-instance dict).
+- Code-dicts (eg `{'desc': 'Annex Storage', 'value': 'RKSTORAGE'}`) are interned: every record with the same code
+    shares one dict, so they must be treated as read-only.
+- project() parses a raw item-response into a record, so the raw response can be dropped;
+    callers keep the raw response only when a PUT needs it.
+"""
+
+import logging, sys
+
+log = logging.getLogger(__name__)
+
+
+CODE_FIELDS: tuple = ( 'library', 'location', 'base_status', 'process_type' )
+
+_code_pool: dict = {}  # ( (key, value), ... ) -> shared code-dict
+
+
+def intern_code( code ):
+    """ Returns the shared, read-only instance of a code-dict; non-dicts are returned as-is.
+        Called by ItemRecord.from_item_data() """
+    if type( code ) != dict:
+        return code
+    try:
+        pool_key = tuple( code.items() )  # keeps key-order, so repr() is unchanged
+        return _code_pool.setdefault( pool_key, {key: (sys.intern(value) if type(value) == str else value) for (key, value) in code.items()} )
+    except TypeError:  # unhashable nested value; don't intern
+        return code
+
+
+class ItemRecord(object):
+    """ Title, ids, and interned codes for one item. """
+
+    __slots__ = ( 'barcode', 'title', 'mms_id', 'holding_id', 'pid', 'library', 'location', 'base_status', 'process_type', 'changes' )
+
+    def __init__( self, barcode, title, mms_id, holding_id, pid, library, location, base_status, process_type, changes=None ):
+        self.barcode = barcode
+        self.title = title
+        self.mms_id = mms_id
+        self.holding_id = holding_id
+        self.pid = pid
+        self.library = intern_code( library )
+        self.location = intern_code( location )
+        self.base_status = intern_code( base_status )
+        self.process_type = intern_code( process_type )
+        self.changes = changes  # {field: ideal-code} from item_rules.diff_item(), once evaluated
+
+    @classmethod
+    def from_item_data( cls, item_data: dict ):
+        """ Builds a record from a found-item api-response.
+            Called by project() """
+        ( bib_data, holding_data, item_fields ) = ( item_data['bib_data'], item_data['holding_data'], item_data['item_data'] )
+        return cls(
+            item_fields.get( 'barcode' ), bib_data.get( 'title' ), bib_data.get( 'mms_id' ), holding_data.get( 'holding_id' ), item_fields.get( 'pid' ),
+            *[ item_fields.get(field) for field in CODE_FIELDS ] )
+
+    def get( self, field: str, default=None ):
+        """ Dict-style access to the code-fields, so item_rules can read a record like an item-response's `item_data`. """
+        if field in CODE_FIELDS:
+            return getattr( self, field )
+        return default
+
+    def as_dict( self ) -> dict:
+        """ Returns the record's fields, for the run-journal. """
+        return { name: getattr(self, name) for name in self.__slots__ }
+
+    ## end class ItemRecord()
+
+
+def project( item_data: dict ):
+    """ Returns an ItemRecord for a found-item response; error-responses (and {}) are small, and are returned as-is.
+        Called by checker.check_alma_api() and the lib scripts """
+    if 'item_data' in item_data:
+        return ItemRecord.from_item_data( item_data )
+    return item_data
+
+
+def as_jsonable( item ):
+    """ Returns a json-serializable form of a record or a raw response.
+        Called by the lib scripts, for the run-journal """
+    return item.as_dict() if isinstance( item, ItemRecord ) else item
@@ -0,0 +1,81 @@
+"""
+Field-level rules for where an annex item belongs, by end-of-day file-type (based on March 25, 2022 email logic).
+
+- QHACS/QHREF items belong in HAY/HAYSTOR; QSACS/QSREF items in ROCK/RKSTORAGE.
+- An item with the TECHNICAL process-type has it cleared; an item with any other (non-empty) process-type is left alone.
+- Otherwise base_status should be "Item in place", and library/location should match the file-type's placement.
+
+Only the governed fields are compared (by code-value), and the item-response is copied only when a PUT is needed.
+Used by script_query_and_change (to build PUT payloads) and checker (to flag misplaced items, read-only).
+"""
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+GOVERNED_FIELDS: tuple = ( 'library', 'location', 'base_status', 'process_type' )
+
+HAY_PLACEMENT: tuple = (
+    ( 'library', {'desc': 'John Hay Library', 'value': 'HAY'} ),
+    ( 'location', {'desc': 'Annex Hay', 'value': 'HAYSTOR'} ),
+    )
+ROCK_PLACEMENT: tuple = (
+    ( 'library', {'desc': 'Rockefeller Library', 'value': 'ROCK'} ),
+    ( 'location', {'desc': 'Annex Storage', 'value': 'RKSTORAGE'} ),
+    )
+PLACEMENTS: dict = { 'QHACS': HAY_PLACEMENT, 'QHREF': HAY_PLACEMENT, 'QSACS': ROCK_PLACEMENT, 'QSREF': ROCK_PLACEMENT }
+
+BASE_STATUS_IDEAL: dict = {'desc': 'Item in place', 'value': '1'}
+PROCESS_TYPE_CLEARED: dict = {'desc': None, 'value': ''}
+TECHNICAL_PROCESS_TYPE_VALUE: str = 'TECHNICAL'
+
+
+def compile_rules( file_type: str ) -> tuple:
+    """ Returns the ( field, ideal-code ) pairs applied once the process-type gate passes.
+        An unrecognized file-type gets no placement rules.
+        Called on import, to build RULES_BY_FILE_TYPE """
+    return ( ('base_status', BASE_STATUS_IDEAL), ) + PLACEMENTS.get( file_type, () )
+
+
+RULES_BY_FILE_TYPE: dict = { file_type: compile_rules(file_type) for file_type in PLACEMENTS }
+DEFAULT_RULES: tuple = compile_rules( '' )
+
+
+def code_value( code ) -> str:
+    """ Returns the `value` of an alma code-dict (eg `{'desc': 'Annex Hay', 'value': 'HAYSTOR'}`), '' if absent.
+        Called by diff_item() and misplaced_fields() """
+    return ( code or {} ).get( 'value' ) or ''
+
+
+def diff_item( file_type: str, item_fields: dict ) -> dict:
+    """ Returns {field: ideal-code} for the governed fields that should change; {} if none.
+        `item_fields` is the item-response's `item_data` section, or an item_record.ItemRecord.
+        Called by script_query_and_change.evaluate_data() """
+    changes: dict = {}
+    process_type_value: str = code_value( item_fields.get('process_type') )
+    if process_type_value == TECHNICAL_PROCESS_TYPE_VALUE:
+        changes['process_type'] = PROCESS_TYPE_CLEARED
+    elif process_type_value != '':
+        log.debug( f'process_type, ``{process_type_value}``; leaving item alone' )
+        return changes
+    for ( field, ideal ) in RULES_BY_FILE_TYPE.get( file_type, DEFAULT_RULES ):
+        if code_value( item_fields.get(field) ) != ideal['value']:
+            changes[field] = ideal
+    return changes
+
+
+def build_payload( item_data: dict, changes: dict ) -> dict:
+    """ Returns a PUT payload: the item-response with `changes` applied.
+        Only the top-level dict and its `item_data` section are copied; everything else is shared, read-only.
+        Called by script_query_and_change.evaluate_data(), only when there are changes """
+    payload_data: dict = dict( item_data )
+    payload_data['item_data'] = { **item_data['item_data'], **changes }
+    return payload_data
+
+
+def misplaced_fields( file_type: str, item_fields ) -> list:
+    """ Returns the placement fields (library, location) that don't match the file-type's placement.
+        `item_fields` is the item-response's `item_data` section, or an item_record.ItemRecord.
+        Called by checker.check_category() """
+    return [ field for ( field, ideal ) in PLACEMENTS.get( file_type, () ) if code_value( item_fields.get(field) ) != ideal['value'] ]
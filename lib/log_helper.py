@@ -0,0 +1,63 @@
+"""
+Logging helpers for the hot paths.
+
+- LazyPformat defers pprint-formatting until a record is actually emitted, so DEBUG-only payload-dumps cost nothing at INFO.
+    Pass it as a %-style argument -- `log.debug( 'data, ``%s``', LazyPformat(data) )` -- not inside an f-string.
+- Sampler lets per-barcode debug-output be logged for only every nth barcode.
+- setup_queue_logging() puts file-writes on a background QueueListener thread, so they don't block the lookup loop.
+"""
+
+import atexit, itertools, logging, logging.handlers, os, pprint, queue, threading
+
+log = logging.getLogger(__name__)
+
+LOG_FORMAT: str = '[%(asctime)s] %(levelname)s [%(module)s-%(funcName)s()::%(lineno)d] %(message)s'
+LOG_DATEFMT: str = '%d/%b/%Y %H:%M:%S'
+
+
+class LazyPformat(object):
+    """ Wraps an object; pformats it only when str()'d by a handler. """
+
+    __slots__ = ( 'obj', )
+
+    def __init__( self, obj ):
+        self.obj = obj
+
+    def __str__( self ):
+        return pprint.pformat( self.obj )
+
+
+class Sampler(object):
+    """ Thread-safe every-nth-call sampler for per-barcode debug-output. """
+
+    def __init__( self, every_n: int ):
+        self.every_n = max( 1, int(every_n) )
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def sample( self ) -> bool:
+        """ Returns True for the first call, then every nth. """
+        with self.lock:
+            return next( self.counter ) % self.every_n == 0
+
+
+def sampler_from_environ() -> Sampler:
+    """ Returns a Sampler for ANXEODALERTS__LOG_SAMPLE_EVERY (default 25; 1 logs every barcode).
+        Called by checker and the lib scripts. """
+    return Sampler( int(os.environ.get('ANXEODALERTS__LOG_SAMPLE_EVERY', '25')) )
+
+
+def setup_queue_logging( filename: str, level ) -> logging.handlers.QueueListener:
+    """ Configures the root-logger to hand records to a queue; a listener-thread writes them to `filename`.
+        The listener is stopped (and the queue flushed) at exit.
+        Called by controller.py and outbox.py """
+    record_queue: queue.Queue = queue.Queue( -1 )
+    file_handler = logging.FileHandler( filename )
+    file_handler.setFormatter( logging.Formatter(LOG_FORMAT, datefmt=LOG_DATEFMT) )
+    listener = logging.handlers.QueueListener( record_queue, file_handler, respect_handler_level=False )
+    root_logger = logging.getLogger()
+    root_logger.setLevel( level )
+    root_logger.addHandler( logging.handlers.QueueHandler(record_queue) )
+    listener.start()
+    atexit.register( listener.stop )
+    return listener
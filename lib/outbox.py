@@ -0,0 +1,229 @@
+'''
+Durable email outbox.
+
+- enqueue() writes a ready-to-send MIME message (`<id>.eml`, plus its `<id>.json` envelope) into the spool directory,
+    so callers don't wait on -- or fail because of -- the SMTP server.
+- drain() sends everything spooled over one reused SMTP connection, retrying transient failures with backoff;
+    sent messages are deleted, permanently-rejected ones are moved to `failed/`, and anything else stays for the next drain.
+- send() enqueues and then starts a background drain-process, which outlives the caller.
+- Nothing else retries on its own: a message still deferred after max_attempts waits for the next drain,
+    so run `--drain` from cron as well (see below).
+
+Spool directory: ANXEODALERTS__OUTBOX_DIR (default: `outbox/`, alongside the tracker-file).
+The drain-process logs to ANXEODALERTS__LOG_PATH.
+
+Usage (drain manually)...
+- assumes:
+    - ANXEODALERTS__ENCLOSING_PROJECT_PATH, ANXEODALERTS__EMAIL_HOST, and ANXEODALERTS__EMAIL_PORT are set
+    - ANXEODALERTS__OUTBOX_DIR or ANXEODALERTS__TRACKER_FILE_PATH is set
+- % cd ./annex_eod_alerts_code
+- % source ../env/bin/activate
+- % python3 ./lib/outbox.py --drain
+
+Usage (cron; eg every 15 minutes)...
+- */15 * * * * . /path/to/env/bin/activate && python3 /path/to/annex_eod_alerts_code/lib/outbox.py --drain
+'''
+
+import argparse, fcntl, json, logging, os, smtplib, subprocess, sys, tempfile, time, uuid
+
+sys.path.append( os.environ['ANXEODALERTS__ENCLOSING_PROJECT_PATH'] )
+from annex_eod_alerts_code.lib import log_helper, throttle
+
+log = logging.getLogger(__name__)
+
+
+class Outbox(object):
+    """ Spool-directory of outgoing messages. """
+
+    def __init__( self, spool_dir: str ):
+        self.spool_dir = spool_dir
+        self.failed_dir = os.path.join( spool_dir, 'failed' )
+        os.makedirs( self.failed_dir, exist_ok=True )
+
+    def enqueue( self, msg, from_addr: str, recipients: list ) -> str:
+        """ Spools a message; returns its .eml path. The envelope is written first, and each file is renamed into place,
+              so a drain never sees a partial message.
+            Called by send() """
+        now_ns: int = time.time_ns()
+        message_id: str = f'{time.strftime("%Y%m%dT%H%M%S", time.localtime(now_ns // 10**9))}.{now_ns % 10**9:09d}_{uuid.uuid4().hex[:12]}'  # sorts oldest-first
+        self.write_atomically( f'{message_id}.json', json.dumps({'from': from_addr, 'recipients': list(recipients)}).encode('utf-8') )
+        eml_path = self.write_atomically( f'{message_id}.eml', msg.as_bytes() )
+        log.info( f'queued message, ``{eml_path}``' )
+        return eml_path
+
+    def write_atomically( self, file_name: str, data: bytes ) -> str:
+        """ Writes via a temp-file and rename.
+            Called by enqueue() """
+        ( fd, temp_path ) = tempfile.mkstemp( dir=self.spool_dir, prefix='.tmp_' )
+        with os.fdopen( fd, 'wb' ) as fh:
+            fh.write( data )
+            fh.flush()
+            os.fsync( fh.fileno() )
+        final_path = os.path.join( self.spool_dir, file_name )
+        os.replace( temp_path, final_path )
+        return final_path
+
+    def pending( self ) -> list:
+        """ Returns spooled .eml paths, oldest first.
+            Called by drain() and drain_locked() """
+        return sorted( os.path.join(self.spool_dir, name) for name in os.listdir(self.spool_dir) if name.endswith('.eml') )
+
+    def drain( self, host: str, port: int, max_attempts: int = 5, backoff_base_seconds: float = 1.0, backoff_cap_seconds: float = 30.0 ) -> int:
+        """ Sends all spooled messages over one SMTP connection; returns the count sent.
+            Only one drain runs at a time; a concurrent call returns 0 immediately. The running drain re-lists the spool
+              until it's empty, and checks it once more after unlocking, so a message queued by a turned-away call is still sent.
+            Stops early (leaving messages spooled) if a message still can't be sent after max_attempts.
+            Called by manage_drain() """
+        sent_count = 0
+        while True:
+            ( batch_sent_count, outcome ) = self.drain_locked( host, port, max_attempts, backoff_base_seconds, backoff_cap_seconds )
+            sent_count += batch_sent_count
+            if outcome != 'drained' or not self.pending():
+                break
+            log.debug( 'messages queued while unlocking; draining again' )
+        log.info( f'sent ``{sent_count}`` message(s); ``{len(self.pending())}`` still spooled' )
+        return sent_count
+
+    def drain_locked( self, host: str, port: int, max_attempts: int, backoff_base_seconds: float, backoff_cap_seconds: float ) -> tuple:
+        """ Sends spooled messages while holding the drain-lock; returns ( sent_count, 'drained'|'deferred'|'locked' ).
+            Called by drain() """
+        with open( os.path.join(self.spool_dir, '.drain.lock'), 'w' ) as lock_fh:
+            try:
+                fcntl.flock( lock_fh, fcntl.LOCK_EX | fcntl.LOCK_NB )
+            except BlockingIOError:
+                log.info( 'another drain is running' )
+                return ( 0, 'locked' )
+            ( smtp, sent_count, outcome ) = ( None, 0, 'sent' )
+            try:
+                batch = self.pending()
+                while batch and outcome != 'deferred':
+                    for eml_path in batch:
+                        ( smtp, outcome ) = self.send_one( smtp, host, port, eml_path, max_attempts, backoff_base_seconds, backoff_cap_seconds )
+                        if outcome == 'sent':
+                            sent_count += 1
+                        elif outcome == 'deferred':
+                            break  # server still unavailable; the rest wait for the next drain
+                    batch = self.pending()
+            finally:
+                if smtp is not None:
+                    try:
+                        smtp.quit()
+                    except Exception:
+                        log.debug( 'problem on smtp quit; ignoring' )
+        return ( sent_count, 'deferred' if outcome == 'deferred' else 'drained' )
+
+    def send_one( self, smtp, host: str, port: int, eml_path: str, max_attempts: int, backoff_base_seconds: float, backoff_cap_seconds: float ) -> tuple:
+        """ Sends one spooled message, (re)connecting as needed; returns ( smtp, 'sent'|'failed'|'deferred' ).
+            Called by drain_locked() """
+        json_path: str = eml_path[:-len('.eml')] + '.json'
+        with open( json_path ) as fh:
+            envelope: dict = json.loads( fh.read() )
+        with open( eml_path, 'rb' ) as fh:
+            data: bytes = fh.read()
+        for attempt in range( max_attempts ):
+            try:
+                if smtp is None:
+                    smtp = smtplib.SMTP( host, port, timeout=30 )
+                smtp.sendmail( envelope['from'], envelope['recipients'], data )
+                for path in ( eml_path, json_path ):
+                    os.remove( path )
+                log.debug( f'sent ``{eml_path}``' )
+                return ( smtp, 'sent' )
+            except smtplib.SMTPRecipientsRefused as e:
+                return ( smtp, self.mark_failed(eml_path, json_path, e) )
+            except smtplib.SMTPResponseException as e:
+                if 500 <= e.smtp_code < 600:  # permanent rejection; retrying won't help
+                    return ( smtp, self.mark_failed(eml_path, json_path, e) )
+                log.warning( f'transient smtp-error on ``{eml_path}``, attempt ``{attempt + 1}``; ``{repr(e)}``' )
+            except ( smtplib.SMTPException, OSError ) as e:
+                log.warning( f'smtp connection problem on ``{eml_path}``, attempt ``{attempt + 1}``; ``{repr(e)}``' )
+            smtp = close_quietly( smtp )
+            if attempt + 1 < max_attempts:
+                time.sleep( throttle.backoff_seconds(attempt, backoff_base_seconds, backoff_cap_seconds) )
+        log.error( f'giving up on ``{eml_path}`` for now, after ``{max_attempts}`` attempts; it stays spooled' )
+        return ( smtp, 'deferred' )
+
+    def mark_failed( self, eml_path: str, json_path: str, exception ) -> str:
+        """ Moves a permanently-rejected message to failed/.
+            Called by send_one() """
+        log.error( f'message ``{eml_path}`` rejected; moving to failed/; ``{repr(exception)}``' )
+        for path in ( eml_path, json_path ):
+            os.replace( path, os.path.join(self.failed_dir, os.path.basename(path)) )
+        return 'failed'
+
+    ## end class Outbox()
+
+
+def close_quietly( smtp ) -> None:
+    """ Closes a possibly-broken connection; returns None, for reassignment.
+        Called by Outbox.send_one() """
+    if smtp is not None:
+        try:
+            smtp.close()
+        except Exception:
+            pass
+    return None
+
+
+def outbox_from_environ() -> Outbox:
+    """ Returns the Outbox at ANXEODALERTS__OUTBOX_DIR (default: `outbox/`, alongside the tracker-file).
+        The spool must survive reboots, so there's no temp-directory fallback.
+        Called by send() and manage_drain() """
+    spool_dir: str = os.environ.get( 'ANXEODALERTS__OUTBOX_DIR', '' )
+    if not spool_dir:
+        if 'ANXEODALERTS__TRACKER_FILE_PATH' not in os.environ:
+            raise Exception( 'ANXEODALERTS__OUTBOX_DIR (or ANXEODALERTS__TRACKER_FILE_PATH) must be set' )
+        spool_dir = os.path.join( os.path.dirname(os.path.abspath(os.environ['ANXEODALERTS__TRACKER_FILE_PATH'])), 'outbox' )
+    return Outbox( spool_dir )
+
+
+def send( msg, from_addr: str, recipients: list ) -> str:
+    """ Spools the message and starts a background drain; returns the spooled path.
+        Set ANXEODALERTS__OUTBOX_BACKGROUND=false to drain in-process instead.
+        Called by emailer.send_mail() and the lib scripts' send_mail() """
+    eml_path: str = outbox_from_environ().enqueue( msg, from_addr, recipients )
+    if os.environ.get( 'ANXEODALERTS__OUTBOX_BACKGROUND', 'true' ).lower() == 'true':
+        start_background_drain()
+    else:
+        manage_drain()
+    return eml_path
+
+
+def start_background_drain() -> None:
+    """ Starts `outbox.py --drain` in its own session, so it keeps running after the caller exits.
+        It logs to ANXEODALERTS__LOG_PATH, not to the caller's terminal.
+        Called by send() """
+    subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--drain'],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True )
+    log.debug( 'started background drain' )
+    return
+
+
+def manage_drain() -> int:
+    """ Drains the outbox to ANXEODALERTS__EMAIL_HOST/PORT.
+        Called by send() and __main__ """
+    return outbox_from_environ().drain(
+        os.environ['ANXEODALERTS__EMAIL_HOST'],
+        int( os.environ['ANXEODALERTS__EMAIL_PORT'] ),
+        max_attempts=int( os.environ.get('ANXEODALERTS__OUTBOX_MAX_ATTEMPTS', '5') ) )
+
+
+def parse_args() -> dict:
+    """ Parses arguments when module called via __main__ """
+    parser = argparse.ArgumentParser( description='Sends spooled email.' )
+    parser.add_argument( '--drain', help='send everything in the outbox', action='store_true', required=True )
+    args: dict = vars( parser.parse_args() )
+    return args
+
+
+if __name__ == '__main__':
+    if os.environ.get( 'ANXEODALERTS__LOG_PATH' ):
+        log_helper.setup_queue_logging( os.environ['ANXEODALERTS__LOG_PATH'], os.environ.get('ANXEODALERTS__LOG_LEVEL', 'INFO') )
+    else:  # manual run without the project log
+        logging.basicConfig(
+            level=os.environ.get( 'ANXEODALERTS__LOG_LEVEL', 'INFO' ),
+            format=log_helper.LOG_FORMAT,
+            datefmt=log_helper.LOG_DATEFMT )
+    args: dict = parse_args()
+    manage_drain()
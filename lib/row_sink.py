@@ -0,0 +1,74 @@
+"""
+Streaming CSV row-sink for the lib scripts.
+
+- Each finished row is appended to a temp-file on disk (optionally gzipped), and flushed every `flush_every` rows,
+    so memory stays flat on large files, and a crashed run's partial results are left on disk (the path is logged).
+- finish() closes the writer and returns a binary read-handle for the email step; remove() deletes the file once sent.
+
+Configured by ANXEODALERTS__SPOOL_DIR (default: the temp-directory) and ANXEODALERTS__CSV_GZIP ('true' to compress).
+"""
+
+import csv, gzip, logging, os, tempfile
+
+log = logging.getLogger(__name__)
+
+
+class CsvRowSink(object):
+    """ Append-only CSV writer backed by a temp-file. """
+
+    def __init__( self, header_row: list, prefix: str = 'annex_eod_rows_', spool_dir: str = '', compress: bool = False, flush_every: int = 100 ):
+        self.compress = compress
+        self.flush_every = max( 1, flush_every )
+        self.row_count = 0
+        suffix = '.csv.gz' if compress else '.csv'
+        ( fd, self.path ) = tempfile.mkstemp( prefix=prefix, suffix=suffix, dir=(spool_dir or None) )
+        os.close( fd )
+        if compress:
+            self.fh = gzip.open( self.path, 'wt', encoding='utf-8', newline='' )
+        else:
+            self.fh = open( self.path, 'w', encoding='utf-8', newline='' )
+        self.writer = csv.writer( self.fh, dialect='excel' )
+        self.writer.writerow( header_row )
+        log.info( f'writing rows to ``{self.path}``' )
+
+    @property
+    def attachment_suffix( self ) -> str:
+        return '.csv.gz' if self.compress else '.csv'
+
+    def write_row( self, row: list ) -> None:
+        """ Appends a row; flushes to disk every `flush_every` rows.
+            Called by the lib scripts, as each barcode's row is finished """
+        self.writer.writerow( row )
+        self.row_count += 1
+        if self.row_count % self.flush_every == 0:
+            self.fh.flush()
+
+    def finish( self ):
+        """ Closes the writer; returns a binary read-handle positioned at the start.
+            Called by the lib scripts, before emailing """
+        self.fh.close()
+        log.debug( f'``{self.row_count}`` rows written to ``{self.path}``' )
+        return open( self.path, 'rb' )
+
+    def remove( self ) -> None:
+        """ Deletes the temp-file.
+            Called by the lib scripts, after the email is sent """
+        if not self.fh.closed:
+            self.fh.close()
+        try:
+            os.remove( self.path )
+        except FileNotFoundError:
+            pass
+
+    ## end class CsvRowSink()
+
+
+def sink_from_environ( header_row: list, prefix: str = 'annex_eod_rows_' ) -> CsvRowSink:
+    """ Returns a CsvRowSink configured from ANXEODALERTS__SPOOL_DIR and ANXEODALERTS__CSV_GZIP.
+        Called by the lib scripts. """
+    return CsvRowSink(
+        header_row,
+        prefix=prefix,
+        spool_dir=os.environ.get( 'ANXEODALERTS__SPOOL_DIR', '' ),
+        compress=( os.environ.get('ANXEODALERTS__CSV_GZIP', 'false').lower() == 'true' ),
+        flush_every=int( os.environ.get('ANXEODALERTS__CSV_FLUSH_EVERY', '100') ) )
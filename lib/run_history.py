@@ -0,0 +1,195 @@
+'''
+Queryable history of controller runs.
+
+- One `runs` row per run: when, how long (with per-step timings), which files, whether an email went out,
+    and the alma-api metrics. A run that only rechecked barcodes deferred on earlier runs has kind 'recheck', not 'files'.
+- One `run_categories` row per category per run: the file's barcode/not-found/failed/deferred/misplaced counts,
+    the archive-path, and -- counted apart -- the rechecked/not-found/failed/misplaced counts of earlier-deferred barcodes.
+- One `run_barcodes` row per checked barcode, with its outcome ('ok', 'not_found', 'failed', 'deferred', 'misplaced');
+    rechecked barcodes are flagged as such.
+- Each run is written in one transaction, after its email is queued.
+- trends() gives monthly per-category volumes and rates in one indexed query; rechecks don't count as runs or file-barcodes.
+
+The db lives at ANXEODALERTS__RUN_HISTORY_DB_PATH (default: alongside the tracker-file).
+
+Usage...
+- assumes:
+    - ANXEODALERTS__ENCLOSING_PROJECT_PATH and ANXEODALERTS__TRACKER_FILE_PATH are set
+- % cd ./annex_eod_alerts_code
+- % source ../env/bin/activate
+- % python3 ./lib/run_history.py --trends
+- % python3 ./lib/run_history.py --barcode 31236090000000
+'''
+
+import argparse, json, logging, os, sys, threading, time
+
+sys.path.append( os.environ['ANXEODALERTS__ENCLOSING_PROJECT_PATH'] )
+from annex_eod_alerts_code.lib import categories, db_helper
+
+log = logging.getLogger(__name__)
+
+
+OUTCOME_NAMES: dict = { 'unavailable': 'deferred' }  # checker-outcome -> stored outcome, where they differ
+ADDED_CATEGORY_COLUMNS: tuple = ( 'failed_count', 'rechecked_count', 'rechecked_not_found_count', 'rechecked_failed_count', 'rechecked_misplaced_count' )  # run_categories columns added since the table was created
+
+
+class RunHistory(object):
+    """ Append-only store of run-results. """
+
+    def __init__( self, db_path: str ):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = db_helper.connect( db_path )
+        with self.conn:
+            self.conn.execute( '''CREATE TABLE IF NOT EXISTS runs (
+                run_id INTEGER PRIMARY KEY,
+                started_at TEXT NOT NULL,
+                elapsed_seconds REAL NOT NULL,
+                file_names_json TEXT NOT NULL,
+                email_sent INTEGER NOT NULL,
+                timings_json TEXT NOT NULL,
+                alma_metrics_json TEXT NOT NULL,
+                kind TEXT NOT NULL DEFAULT 'files' )''' )
+            db_helper.ensure_column( self.conn, 'runs', 'kind', "TEXT NOT NULL DEFAULT 'files'" )
+            self.conn.execute( 'CREATE INDEX IF NOT EXISTS runs_started_at ON runs (started_at)' )
+            self.conn.execute( '''CREATE TABLE IF NOT EXISTS run_categories (
+                run_id INTEGER NOT NULL,
+                category TEXT NOT NULL,
+                barcode_count INTEGER NOT NULL,
+                not_found_count INTEGER NOT NULL,
+                deferred_count INTEGER NOT NULL,
+                misplaced_count INTEGER NOT NULL,
+                archive_path TEXT NOT NULL,
+                failed_count INTEGER NOT NULL DEFAULT 0,
+                rechecked_count INTEGER NOT NULL DEFAULT 0,
+                rechecked_not_found_count INTEGER NOT NULL DEFAULT 0,
+                rechecked_failed_count INTEGER NOT NULL DEFAULT 0,
+                rechecked_misplaced_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (run_id, category) ) WITHOUT ROWID''' )
+            for column in ADDED_CATEGORY_COLUMNS:
+                db_helper.ensure_column( self.conn, 'run_categories', column, 'INTEGER NOT NULL DEFAULT 0' )
+            self.conn.execute( '''CREATE TABLE IF NOT EXISTS run_barcodes (
+                run_id INTEGER NOT NULL,
+                category TEXT NOT NULL,
+                barcode TEXT NOT NULL,
+                outcome TEXT NOT NULL,
+                rechecked INTEGER NOT NULL DEFAULT 0 )''' )
+            db_helper.ensure_column( self.conn, 'run_barcodes', 'rechecked', 'INTEGER NOT NULL DEFAULT 0' )
+            self.conn.execute( 'CREATE INDEX IF NOT EXISTS run_barcodes_barcode ON run_barcodes (barcode)' )
+
+    def record_run( self, started_at: float, results_dct: dict, file_names: list, email_sent: bool, timings: dict, alma_metrics: dict ) -> int:
+        """ Writes a run's results in one transaction; returns its run_id.
+            A run with no files only rechecked earlier-deferred barcodes, so it's recorded with kind 'recheck'.
+            Called by controller.Controller.record_run() """
+        category_rows: list = []
+        barcode_rows: list = []
+        for category in categories.CATEGORIES:
+            category_results: dict = results_dct[category['results_key']]
+            category_rows.append( (
+                category['results_key'],
+                category_results['count_barcodes'],
+                category_results['count_problematic_barcodes'],
+                category_results['count_deferred_barcodes'],
+                category_results['count_misplaced_barcodes'],
+                category_results['path_to_archived_file'],
+                category_results['count_failed_lookups'],
+                category_results['count_rechecked_barcodes'],
+                len( category_results['list_of_rechecked_not_found'] ),
+                len( category_results['list_of_rechecked_lookup_failed'] ),
+                len( category_results['list_of_rechecked_misplaced'] ) ) )
+            for ( rechecked, outcomes_key ) in ( (0, 'barcode_outcomes'), (1, 'rechecked_outcomes') ):
+                barcode_rows.extend(
+                    (category['results_key'], barcode, OUTCOME_NAMES.get(outcome, outcome), rechecked) for ( barcode, outcome ) in category_results[outcomes_key] )
+        kind: str = 'files' if file_names else 'recheck'
+        with self.lock:
+            with self.conn:
+                cursor = self.conn.execute(
+                    'INSERT INTO runs (started_at, elapsed_seconds, file_names_json, email_sent, timings_json, alma_metrics_json, kind) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    ( time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(started_at)), round(time.time() - started_at, 3), json.dumps(file_names),
+                      int(email_sent), json.dumps(timings), json.dumps(alma_metrics), kind ) )
+                run_id: int = cursor.lastrowid
+                self.conn.executemany(
+                    '''INSERT INTO run_categories (run_id, category, barcode_count, not_found_count, deferred_count, misplaced_count, archive_path,
+                        failed_count, rechecked_count, rechecked_not_found_count, rechecked_failed_count, rechecked_misplaced_count)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                    [ (run_id,) + row for row in category_rows ] )
+                self.conn.executemany(
+                    'INSERT INTO run_barcodes (run_id, category, barcode, outcome, rechecked) VALUES (?, ?, ?, ?, ?)', [ (run_id,) + row for row in barcode_rows ] )
+        log.debug( f'recorded {kind}-run ``{run_id}``; ``{len(barcode_rows)}`` barcode outcomes' )
+        return run_id
+
+    def trends( self, since: str = '' ) -> list:
+        """ Returns per-month, per-category totals, oldest first: runs, barcodes, not-found, failed, deferred, misplaced, and not-found rate
+              for the files processed; and, apart, the earlier-deferred barcodes rechecked, and how many of those were not found.
+            Only runs with a file for the category count as runs; recheck-only runs add only to the recheck-totals.
+            `since` is an optional `YYYY-MM` lower bound.
+            Called by __main__ """
+        with self.lock:
+            rows = self.conn.execute( '''
+                SELECT substr(runs.started_at, 1, 7) AS month, run_categories.category, SUM(barcode_count > 0),
+                    SUM(barcode_count), SUM(not_found_count), SUM(failed_count), SUM(deferred_count), SUM(misplaced_count),
+                    SUM(rechecked_count), SUM(rechecked_not_found_count)
+                FROM runs JOIN run_categories ON run_categories.run_id = runs.run_id
+                WHERE runs.started_at >= ? AND ( barcode_count > 0 OR rechecked_count > 0 )
+                GROUP BY month, run_categories.category
+                ORDER BY month, run_categories.category''', (since,) ).fetchall()
+        return [
+            { 'month': month, 'category': category, 'runs': run_count, 'barcodes': barcode_count, 'not_found': not_found_count,
+              'failed': failed_count, 'deferred': deferred_count, 'misplaced': misplaced_count,
+              'not_found_rate': round(not_found_count / barcode_count, 4) if barcode_count else 0.0,
+              'rechecked': rechecked_count, 'rechecked_not_found': rechecked_not_found_count }
+            for ( month, category, run_count, barcode_count, not_found_count, failed_count, deferred_count, misplaced_count,
+                  rechecked_count, rechecked_not_found_count ) in rows ]
+
+    def barcode_outcomes( self, barcode: str ) -> list:
+        """ Returns the runs in which the barcode was checked, or rechecked, newest first.
+            Called by __main__ """
+        with self.lock:
+            rows = self.conn.execute( '''
+                SELECT runs.started_at, run_barcodes.category, run_barcodes.outcome, run_barcodes.rechecked
+                FROM run_barcodes JOIN runs ON runs.run_id = run_barcodes.run_id
+                WHERE run_barcodes.barcode = ?
+                ORDER BY runs.started_at DESC''', (barcode,) ).fetchall()
+        return [
+            {'started_at': started_at, 'category': category, 'outcome': outcome, 'rechecked': bool(rechecked)}
+            for ( started_at, category, outcome, rechecked ) in rows ]
+
+    def close( self ) -> None:
+        self.conn.close()
+
+    ## end class RunHistory()
+
+
+def history_from_environ( tracker_path: str ) -> RunHistory:
+    """ Returns the RunHistory at ANXEODALERTS__RUN_HISTORY_DB_PATH (default: alongside the tracker-file).
+        Called by controller.Controller.record_run() and __main__ """
+    return RunHistory( os.environ.get('ANXEODALERTS__RUN_HISTORY_DB_PATH', f'{tracker_path}.runs.sqlite3') )
+
+
+def parse_args() -> dict:
+    """ Parses arguments when module called via __main__ """
+    parser = argparse.ArgumentParser( description='Reports on controller run-history.' )
+    parser.add_argument( '--trends', help='monthly per-category volumes and not-found rates', action='store_true' )
+    parser.add_argument( '--since', help='for --trends; first month, eg 2022-10', default='' )
+    parser.add_argument( '--barcode', '-b', help='runs in which the barcode was checked' )
+    args: dict = vars( parser.parse_args() )
+    if not args['trends'] and not args['barcode']:
+        parser.error( '--trends or --barcode required' )
+    return args
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=os.environ.get( 'ANXEODALERTS__LOG_LEVEL', 'INFO' ),
+        format='[%(asctime)s] %(levelname)s [%(module)s-%(funcName)s()::%(lineno)d] %(message)s',
+        datefmt='%d/%b/%Y %H:%M:%S' )
+    args: dict = parse_args()
+    history = history_from_environ( os.environ['ANXEODALERTS__TRACKER_FILE_PATH'] )
+    if args['trends']:
+        print( f'{"month":<8} {"category":<20} {"runs":>5} {"barcodes":>9} {"not_found":>9} {"failed":>6} {"deferred":>8} {"misplaced":>9} {"nf_rate":>8} {"rechecked":>9} {"re_nf":>5}' )
+        for row in history.trends( args['since'] ):
+            print( f'{row["month"]:<8} {row["category"]:<20} {row["runs"]:>5} {row["barcodes"]:>9} {row["not_found"]:>9} {row["failed"]:>6} {row["deferred"]:>8} {row["misplaced"]:>9} {row["not_found_rate"]:>8.2%} {row["rechecked"]:>9} {row["rechecked_not_found"]:>5}' )
+    if args['barcode']:
+        for entry in history.barcode_outcomes( args['barcode'] ):
+            print( f'{entry["started_at"]}  {entry["category"]:<20}  {entry["outcome"]}{"  (recheck)" if entry["rechecked"] else ""}' )
+    history.close()
@@ -0,0 +1,95 @@
+"""
+Checkpoint-journal for the lib scripts, so an interrupted run can be resumed with `--resume`.
+
+- A run is identified by the script-name and the sha256 of the input-file's contents.
+- Each barcode is keyed by its position in the file (so repeated barcodes are journaled separately),
+    and records the fetched response, the evaluated payload, the PUT result, and the finished CSV row.
+- Only rows marked complete are reused on resume; deferred or failed barcodes are looked up (and updated) again.
+- A run's entries are cleared once its email has been sent.
+
+The journal lives at ANXEODALERTS__RUN_JOURNAL_PATH (default: a sqlite file in the temp-directory).
+"""
+
+import json, logging, os, tempfile, threading, time
+
+from annex_eod_alerts_code.lib import checksums, db_helper
+
+log = logging.getLogger(__name__)
+
+
+class RunJournal(object):
+    """ Per-barcode checkpoints for one script-run over one input-file. """
+
+    def __init__( self, db_path: str, script_name: str, file_hash: str ):
+        self.db_path = db_path
+        self.script_name = script_name
+        self.file_hash = file_hash
+        self.lock = threading.Lock()
+        self.conn = db_helper.connect( db_path )
+        with self.conn:
+            self.conn.execute( '''CREATE TABLE IF NOT EXISTS entries (
+                script_name TEXT NOT NULL,
+                file_hash TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                barcode TEXT NOT NULL,
+                item_json TEXT,
+                payload_json TEXT,
+                updated_json TEXT,
+                row_json TEXT,
+                is_complete INTEGER NOT NULL DEFAULT 0,
+                recorded_at REAL NOT NULL,
+                PRIMARY KEY ( script_name, file_hash, position ) )''' )
+
+    def completed_row( self, position: int, barcode: str ):
+        """ Returns the journaled CSV row for a completed barcode, otherwise None.
+            Called by the lib scripts, on --resume """
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT barcode, row_json FROM entries WHERE script_name = ? AND file_hash = ? AND position = ? AND is_complete = 1',
+                (self.script_name, self.file_hash, position) ).fetchone()
+        if row is None or row[0] != barcode:
+            return None
+        return json.loads( row[1] )
+
+    def record_lookup( self, position: int, barcode: str, item_data: dict, payload_data: dict ) -> None:
+        """ Records the fetched response and evaluated payload (starting the barcode's entry over).
+            Called by the lib scripts, after each GET """
+        with self.lock:
+            with self.conn:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO entries (script_name, file_hash, position, barcode, item_json, payload_json, recorded_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (self.script_name, self.file_hash, position, barcode, json.dumps(item_data), json.dumps(payload_data), time.time()) )
+
+    def record_row( self, position: int, barcode: str, updated_item_data: dict, extracted_data: list, is_complete: bool ) -> None:
+        """ Records the PUT result (if any) and the CSV row; incomplete rows are redone on resume.
+            Called by the lib scripts, once a barcode's row is built """
+        with self.lock:
+            with self.conn:
+                self.conn.execute(
+                    'UPDATE entries SET updated_json = ?, row_json = ?, is_complete = ?, recorded_at = ? WHERE script_name = ? AND file_hash = ? AND position = ? AND barcode = ?',
+                    (json.dumps(updated_item_data), json.dumps(extracted_data), int(is_complete), time.time(), self.script_name, self.file_hash, position, barcode) )
+
+    def clear( self ) -> None:
+        """ Drops this run's entries.
+            Called by the lib scripts, on a fresh (non-resume) run and after the email is sent """
+        with self.lock:
+            with self.conn:
+                cursor = self.conn.execute( 'DELETE FROM entries WHERE script_name = ? AND file_hash = ?', (self.script_name, self.file_hash) )
+        log.debug( f'cleared ``{cursor.rowcount}`` journal entries for ``{self.script_name}``, ``{self.file_hash}``' )
+
+    def close( self ) -> None:
+        with self.lock:
+            self.conn.close()
+
+    ## end class RunJournal()
+
+
+def journal_from_environ( script_name: str, file_path: str, resume: bool ) -> RunJournal:
+    """ Returns the RunJournal for this script and input-file; a non-resume run starts from an empty journal.
+        Called by the lib scripts. """
+    db_path: str = os.environ.get( 'ANXEODALERTS__RUN_JOURNAL_PATH', os.path.join(tempfile.gettempdir(), 'annex_eod_alerts_run_journal.sqlite3') )
+    journal = RunJournal( db_path, script_name, checksums.hash_file(file_path) )
+    if not resume:
+        journal.clear()
+    log.info( f'run-journal, ``{db_path}``; file_hash, ``{journal.file_hash}``; resume, ``{resume}``' )
+    return journal
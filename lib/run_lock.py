@@ -0,0 +1,48 @@
+"""
+Single-instance guard for controller runs, so overlapping cron-runs (or a cron-run and the `--watch` daemon)
+  never process the same files at once.
+
+Uses an flock on a lock-file, which the OS releases if the holder dies, so a crashed run never leaves a stale lock.
+Lock-file: ANXEODALERTS__RUN_LOCK_PATH (default: alongside the tracker-file).
+"""
+
+import fcntl, logging, os
+
+log = logging.getLogger(__name__)
+
+
+class RunLock(object):
+    """ Exclusive, process-wide lock. """
+
+    def __init__( self, lock_path: str ):
+        self.lock_path = lock_path
+        self.fh = None
+
+    def acquire( self, blocking: bool = False ) -> bool:
+        """ Returns True once the lock is held; False (without waiting) if another run holds it and `blocking` is False.
+            Called by controller.Controller.manage_processing() """
+        fh = open( self.lock_path, 'a' )
+        try:
+            fcntl.flock( fh, fcntl.LOCK_EX if blocking else (fcntl.LOCK_EX | fcntl.LOCK_NB) )
+        except BlockingIOError:
+            fh.close()
+            return False
+        self.fh = fh
+        log.debug( f'acquired run-lock, ``{self.lock_path}``' )
+        return True
+
+    def release( self ) -> None:
+        """ Releases the lock, if held.
+            Called by controller.Controller.manage_processing() """
+        if self.fh is not None:
+            fcntl.flock( self.fh, fcntl.LOCK_UN )
+            self.fh.close()
+            self.fh = None
+
+    ## end class RunLock()
+
+
+def lock_from_environ( tracker_path: str ) -> RunLock:
+    """ Returns the RunLock at ANXEODALERTS__RUN_LOCK_PATH.
+        Called by controller.Controller() """
+    return RunLock( os.environ.get('ANXEODALERTS__RUN_LOCK_PATH', f'{tracker_path}.lock') )
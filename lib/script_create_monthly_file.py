@@ -1,18 +1,27 @@
 '''
 This script:
-- Takes a date, a source-directory-path, and a destination-file-path
-- Finds all barcode-files for the given month (ignores 'day')
+- Takes a date (or a date-range), a source-directory-path, and a destination-file-path
+- Finds all barcode-files for the given month, or each month in the range (ignores 'day'), in one pass
+    - in the month's `YYYY/MM/` archive-directory, plus any (pre-sharding) archives at the top of the source-directory
 - Combines the barcodes into one file and outputs it to the destination
+    - each distinct line once, in first-seen order, exactly as read (so a month's output is unchanged from earlier versions)
+    - with `--normalize`, lines are read as barcode_reader reads them (whitespace/CR stripped, blank lines skipped),
+        so every output line is a newline-terminated barcode; a month whose archives are all in its manifest is then
+        copied from its rollups (kept up to date at archive-time) instead -- see archive_store.py
+    - months are written concurrently (ANXEODALERTS__MONTHLY_WORKERS threads, default 4)
 
 Usage...
 - assumes:
-    - four environmental-variables are set (see below, after logging config)
+    - ANXEODALERTS__ENCLOSING_PROJECT_PATH is set
 - % cd ./annex_eod_alerts_code
 - % source ../env/bin/activate
 - % python3 ./lib/script_create_monthly_file.py --date 2022-10-01 --source_dir_path /path/to/dir --output_dir_path /path/to/dir
+- % python3 ./lib/script_create_monthly_file.py --date 2022-01-01 --end_date 2022-12-01 --source_dir_path /path/to/dir --output_dir_path /path/to/dir
+- % python3 ./lib/script_create_monthly_file.py --date 2022-10-01 --source_dir_path /path/to/dir --output_dir_path /path/to/dir --normalize
 '''
 
-import argparse, datetime, logging, os, pathlib, pprint, time
+import argparse, datetime, gzip, logging, os, pathlib, pprint, shutil, sys, time
+from concurrent.futures import ThreadPoolExecutor
 
 
 logging.basicConfig(
@@ -23,91 +32,169 @@ logging.basicConfig(
 log = logging.getLogger(__name__)
 log.debug( 'logging ready' )
 
+sys.path.append( os.environ['ANXEODALERTS__ENCLOSING_PROJECT_PATH'] )
+from annex_eod_alerts_code.lib import archive_store, barcode_reader
 
-def manage_monthly_file_creation( date_str: str, source_dir_path: str, output_dir_path: str ) -> None:
-    """ Manages file combining. """
-    ## get files for the month --------------------------------------
-    target_files: list = get_target_files( date_str, source_dir_path)
-    ## populate counts for different file-types ---------------------
-    ( qhacs_bucket, qhref_bucket, qsacs_bucket, qsref_bucket ) = ( [], [], [], [] )
-    update_buckets( target_files, qhacs_bucket, qhref_bucket, qsacs_bucket, qsref_bucket )
-    log.debug( f'len(qhacs_bucket), ``{len(qhacs_bucket)}``' )
-    log.debug( f'len(qhref_bucket), ``{len(qhref_bucket)}``' )
-    log.debug( f'len(qsacs_bucket), ``{len(qsacs_bucket)}``' )
-    log.debug( f'len(qsref_bucket), ``{len(qsref_bucket)}``' )
-    ## write out different file-types -------------------------------
-    date_obj_from_arg  = datetime.datetime.strptime( date_str, '%Y-%m-%d' ).date()
-    buckets = [ qhacs_bucket, qhref_bucket, qsacs_bucket, qsref_bucket ]
-    for i, file_type in enumerate( ['QHACS', 'QHREF', 'QSACS', 'QSREF'] ):
-        output_filename = f'COMBINED_{date_obj_from_arg.year}-{date_obj_from_arg.month}_{file_type}_BARCODES.txt'
-        log.debug( f'output_filename, ``{output_filename}``' )
-        output_filepath = f'{output_dir_path}/{output_filename}'
-        log.debug( f'output_filepath, ``{output_filepath}``' )
-        write_data( output_filepath, buckets[i]  )
+FILE_TYPES: list = [ 'QHACS', 'QHREF', 'QSACS', 'QSREF' ]
+MONTHLY_WORKERS: int = int( os.environ.get('ANXEODALERTS__MONTHLY_WORKERS', '4') )
+
+
+def manage_monthly_file_creation( date_str: str, source_dir_path: str, output_dir_path: str, end_date_str: str = '', normalize: bool = False ) -> None:
+    """ Manages file combining, for the month of `date_str`, or for each month from `date_str` through `end_date_str`. """
+    ## get files, grouped by month ----------------------------------
+    months: list = list_months( date_str, end_date_str or date_str )
+    files_by_month: dict = get_target_files_by_month( months, source_dir_path )
+    ## combine and write each month, concurrently -------------------
+    with ThreadPoolExecutor( max_workers=max(1, min(MONTHLY_WORKERS, len(months))) ) as executor:
+        futures = [ executor.submit(create_month_files, year, month, files_by_month[(year, month)], source_dir_path, output_dir_path, normalize) for ( year, month ) in months ]
+        for future in futures:
+            future.result()  # re-raises a month's exception
     return
 
     ## end def manage_monthly_file_creation()
 
 
-def get_target_files( date_str: str, source_dir_path: str ) -> list:
-    """ Returns list of file_paths that meet the date-specification. 
+def list_months( start_date_str: str, end_date_str: str ) -> list:
+    """ Returns ( year, month ) tuples from the start-date's month through the end-date's month.
         Called by manage_monthly_file_creation() """
-    all_files: list = list( pathlib.Path(source_dir_path).iterdir() )
-    filtered_files = [ f for f in all_files if pathlib.Path(f).is_file()  ]  # ignores folders
-    # log.debug( f'filtered_files, ``{pprint.pformat(filtered_files)}``' )
+    start_date = datetime.datetime.strptime( start_date_str, '%Y-%m-%d' ).date()
+    end_date = datetime.datetime.strptime( end_date_str, '%Y-%m-%d' ).date()
+    if ( end_date.year, end_date.month ) < ( start_date.year, start_date.month ):
+        raise Exception( f'end-date ``{end_date_str}`` is before date ``{start_date_str}``' )
+    ( months, year, month ) = ( [], start_date.year, start_date.month )
+    while ( year, month ) <= ( end_date.year, end_date.month ):
+        months.append( (year, month) )
+        ( year, month ) = ( year + 1, 1 ) if month == 12 else ( year, month + 1 )
+    return months
+
+
+def get_target_files( date_str: str, source_dir_path: str ) -> list:
+    """ Returns list of file_paths that meet the date-specification: the month-directory's archives,
+          then any flat (pre-sharding) archives for the month.
+        Convenience wrapper for one month; see get_target_files_by_month(). """
     date_obj_from_arg  = datetime.datetime.strptime( date_str, '%Y-%m-%d' ).date()
-    target_files: list = []
-    for path_obj in filtered_files:
-        file_name = path_obj.name
-        parts = file_name.split( '_' )  # files are in the format: `ORIG_QHACS_2021-10-01T08-30-05.dat`
-        if parts[0] != 'ORIG':
-            continue
-        if parts[1] not in [ 'QHACS', 'QHREF', 'QSACS', 'QSREF' ]:
-            continue
-        file_date_string_and_extension = parts[2]
-        file_date_str = file_date_string_and_extension.split('T')[0]  # gets date; ignores time
-        date_obj_from_file_name  = datetime.datetime.strptime( file_date_str, '%Y-%m-%d' ).date()
-        if date_obj_from_file_name.year == date_obj_from_arg.year and date_obj_from_file_name.month == date_obj_from_arg.month:
-            target_files.append( path_obj )
-        else:
-            continue
-    log.debug( f'target_files, ``{pprint.pformat(target_files)}``' )
-    return target_files
+    key: tuple = ( date_obj_from_arg.year, date_obj_from_arg.month )
+    return get_target_files_by_month( [key], source_dir_path )[key]
 
     ## end def get_target_files()
 
 
-def update_buckets( target_files: list, qhacs_bucket: list, qhref_bucket: list, qsacs_bucket: list, qsref_bucket: list ) -> None:
-    """ Adds _new_ barcodes to the appropriate bucket-reference.
-        Doesn't 'return' anything, but the bucket references in manage_monthly_file_creation() are updated.
+def get_target_files_by_month( months: list, source_dir_path: str ) -> dict:
+    """ Returns {( year, month ): [file_paths]} for the given months: each month-directory's archives, then any flat
+          (pre-sharding) archives for the month, found in a single scan of the source-directory.
         Called by manage_monthly_file_creation() """
-    for path_obj in target_files:
-        contents = []
-        with open( path_obj, 'r' ) as file_handler:
-            contents = file_handler.readlines()
-        if 'qhacs' in path_obj.name.lower():
-            bucket: list = qhacs_bucket
-            output_file_name = f''
-        elif 'qhref' in path_obj.name.lower():
-            bucket: list = qhref_bucket
-        elif 'qsacs' in path_obj.name.lower():
-            bucket: list = qsacs_bucket
+    files_by_month: dict = {}
+    for ( year, month ) in months:
+        month_path: str = archive_store.month_dir( source_dir_path, year, month, create=False )
+        files_by_month[(year, month)] = [ pathlib.Path(month_path, file_name) for file_name in archive_store.month_archive_names(month_path) ]
+    with os.scandir( source_dir_path ) as entries:
+        for entry in entries:
+            key = flat_archive_month( entry.name )
+            if key in files_by_month and entry.is_file():  # ignores folders
+                files_by_month[key].append( pathlib.Path(entry.path) )
+    log.debug( f'target_files by month, ``{pprint.pformat(files_by_month)}``' )
+    return files_by_month
+
+
+def flat_archive_month( file_name: str ):
+    """ Returns ( year, month ) for a flat archive-name, eg `ORIG_QHACS_2021-10-01T08-30-05.dat`; None for other files.
+        Called by get_target_files_by_month() """
+    parts = file_name.split( '_' )
+    if parts[0] != 'ORIG' or len( parts ) < 3:
+        return None
+    if file_name.endswith( '.sha256' ):  # checksum written alongside each archive
+        return None
+    if parts[1] not in FILE_TYPES:
+        return None
+    file_date_str = parts[2].split('T')[0]  # gets date; ignores time
+    try:
+        date_obj_from_file_name = datetime.datetime.strptime( file_date_str, '%Y-%m-%d' ).date()
+    except ValueError:
+        log.warning( f'skipping archive with unparseable date, ``{file_name}``' )
+        return None
+    return ( date_obj_from_file_name.year, date_obj_from_file_name.month )
+
+
+def create_month_files( year: int, month: int, target_files: list, source_dir_path: str, output_dir_path: str, normalize: bool = False ) -> None:
+    """ Writes one month's QHACS/QHREF/QSACS/QSREF combined files by combining the month's archives;
+          when normalizing, from its rollups instead if they cover every file (the rollups hold normalized barcodes).
+        Called by manage_monthly_file_creation(), on a worker-thread """
+    month_path: str = archive_store.month_dir( source_dir_path, year, month, create=False )
+    if normalize and rollups_cover( target_files, month_path ):
+        copy_rollups( year, month, month_path, output_dir_path )
+        return
+    buckets: dict = { file_type: {} for file_type in FILE_TYPES }  # insertion-ordered sets
+    update_buckets( target_files, buckets, normalize )
+    for file_type in FILE_TYPES:
+        log.debug( f'{year}-{month} len({file_type.lower()}_bucket), ``{len(buckets[file_type])}``' )
+        output_filename = f'COMBINED_{year}-{month}_{file_type}_BARCODES.txt'
+        output_filepath = f'{output_dir_path}/{output_filename}'
+        log.debug( f'output_filepath, ``{output_filepath}``' )
+        write_data( output_filepath, buckets[file_type] )
+    return
+
+
+def rollups_cover( target_files: list, month_path: str ) -> bool:
+    """ Returns True if every target-file is in the month-directory and listed in its manifest,
+          so the month's rollups already hold all of the month's barcodes.
+        Called by create_month_files() """
+    if not target_files:
+        return False
+    manifest_names: set = { entry['file'] for entry in archive_store.read_manifest(month_path) }
+    month_dir_path: str = os.path.normpath( month_path )  # pathlib normalizes `./a/2022/10` to `a/2022/10`; os.path.join doesn't
+    return all( os.path.normpath(path_obj.parent) == month_dir_path and path_obj.name in manifest_names for path_obj in target_files )
+
+
+def copy_rollups( year: int, month: int, month_path: str, output_dir_path: str ) -> None:
+    """ Copies the month's rollups to the output-directory (an empty file for a file-type with no archives that month).
+        Called by create_month_files() """
+    for file_type in FILE_TYPES:
+        rollup_path: str = archive_store.rollup_path( month_path, year, month, file_type )
+        output_filepath = f'{output_dir_path}/{os.path.basename(rollup_path)}'
+        log.debug( f'output_filepath, ``{output_filepath}``' )
+        if os.path.exists( rollup_path ):
+            shutil.copyfile( rollup_path, output_filepath )
         else:
-            bucket: list = qsref_bucket
-        for barcode in contents:
-            # barcode = entry.strip()  # no; works if we keep the newline; but TODO- consider stripping and adding the newline as necessary on the write; it'd be more explicit/reliable.
-            if barcode not in bucket:
-                bucket.append( barcode)
-            else:
-                log.debug( f'not adding barcode, ``{barcode}`` it already exists in the target bucket' )
+            write_data( output_filepath, [] )
+    return
+
+
+def update_buckets( target_files: list, buckets: dict, normalize: bool = False ) -> None:
+    """ Adds _new_ barcodes to the appropriate bucket, keeping first-seen order; streams each file.
+        Buckets are dicts used as insertion-ordered sets, so each membership-check is constant-time.
+        Lines are kept as read (see iter_lines()); with `normalize`, barcodes are normalized as the archive-time rollups are
+          (see archive_store.update_rollup()), so a month built either way gives the same output.
+        Doesn't 'return' anything, but the `buckets` dict ({file_type: bucket}) is updated.
+        Called by create_month_files() """
+    for path_obj in target_files:
+        name = path_obj.name.lower()
+        file_type: str = next( (file_type for file_type in FILE_TYPES[:3] if file_type.lower() in name), 'QSREF' )
+        bucket: dict = buckets[file_type]
+        before_count = len( bucket )
+        read_count = 0
+        lines = ( f'{barcode}\n' for barcode in barcode_reader.iter_barcodes(path_obj) ) if normalize else iter_lines( path_obj )
+        for line in lines:
+            read_count += 1
+            bucket.setdefault( line )
+        log.debug( f'``{path_obj.name}``: ``{len(bucket) - before_count}`` new barcodes of ``{read_count}``' )
     return
 
     ## end def update_buckets()
 
 
-def write_data( output_filepath: str, bucket: list ) -> None:
-    """ Writes barcodes to given path. 
-        Called by manage_monthly_file_creation() """
+def iter_lines( path_obj ):
+    """ Yields a file's lines as text-mode reading gives them: blank lines included, line-endings translated to `\\n`,
+          and an unterminated last line left unterminated.
+        Called by update_buckets() """
+    opener = gzip.open if path_obj.name.endswith( '.gz' ) else open
+    with opener( path_obj, 'rt' ) as file_handler:
+        yield from file_handler
+    return
+
+
+def write_data( output_filepath: str, bucket ) -> None:
+    """ Writes barcodes to given path; `bucket` is any iterable of lines.
+        Called by create_month_files() and copy_rollups() """
     log.debug( f'output_filepath, ``{output_filepath}``' )
     with open( output_filepath, 'w' ) as filehandler:
         filehandler.writelines( bucket )
@@ -118,8 +205,10 @@ def parse_args() -> dict:
     """ Parses arguments when module called via __main__ """
     parser = argparse.ArgumentParser( description='Required: email.' )
     parser.add_argument( '--date', '-d', help='date required in the form of 2022-10-01', required=True )
+    parser.add_argument( '--end_date', '-e', help='optional; also creates files for each month after --date, through this date\'s month', default='' )
     parser.add_argument( '--source_dir_path', '-s', help='source directory-path required', required=True )
     parser.add_argument( '--output_dir_path', '-o', help='output directory-path required', required=True )
+    parser.add_argument( '--normalize', help='optional; strips whitespace and skips blank lines (and uses the archive-time rollups where they cover the month)', action='store_true' )
     args: dict = vars( parser.parse_args() )
     return args
 
@@ -130,4 +219,5 @@ if __name__ == '__main__':
     date_str: str = args['date']
     source_dir_path: str = args['source_dir_path']
     output_file_path: str = args['output_dir_path']
-    manage_monthly_file_creation( date_str, source_dir_path, output_file_path )
+    end_date_str: str = args['end_date']
+    manage_monthly_file_creation( date_str, source_dir_path, output_file_path, end_date_str, args['normalize'] )
@@ -7,132 +7,133 @@ This script:
 
 Usage...
 - assumes:
-    - four environmental-variables are set (see below, after logging config)
+    - five environmental-variables are set (see below, after logging config)
 - % cd ./annex_eod_alerts_code
 - % source ../env/bin/activate
 - % python3 ./lib/script_file_path_to_csv.py --email the-email-address --file_path /the/path.txt
+- add `--resume` to pick up an interrupted run over the same file (see run_journal.py).
 '''
 
 
-import argparse, csv, io, logging, os, pathlib, pprint, smtplib
+import argparse, logging, os, pathlib, sys
 from email.mime.application import MIMEApplication
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
-import requests
-
 
 logging.basicConfig(
     # filename=zzz,
-    level=logging.DEBUG,
+    level=os.environ.get( 'ANXEODALERTS__LOG_LEVEL', 'DEBUG' ),
     format='[%(asctime)s] %(levelname)s [%(module)s-%(funcName)s()::%(lineno)d] %(message)s',
     datefmt='%d/%b/%Y %H:%M:%S' )
 log = logging.getLogger(__name__)
 log.debug( 'logging ready' )
 
 
-ENVAR_SMTP_HOST: str = os.environ[ 'ANXEODALERTS__EMAIL_HOST' ]
-ENVAR_SMTP_PORT: str = os.environ[ 'ANXEODALERTS__EMAIL_PORT' ]
 ENVAR_ITEM_GET_URL_ROOT: str = os.environ['ANXEODALERTS__ITEM_API_ROOT']
 ENVAR_API_KEY: str = os.environ['ANXEODALERTS__ITEM_API_KEY_WRITE']
 
+sys.path.append( os.environ['ANXEODALERTS__ENCLOSING_PROJECT_PATH'] )
+from annex_eod_alerts_code.lib import alma_cache, alma_client, barcode_reader, emailer, item_record, log_helper, outbox, row_sink, run_journal
+
+ALMA_CLIENT = alma_client.AlmaClient( ENVAR_ITEM_GET_URL_ROOT, ENVAR_API_KEY, cache=alma_cache.cache_from_environ() )
+
 
-def manage_barcode_processing( file_path: str, email_address: str ) -> None:
+def manage_barcode_processing( file_path: str, email_address: str, resume: bool = False ) -> None:
 
     ## get filename -------------------------------------------------
     path_obj = pathlib.Path( file_path )
     file_name: str = path_obj.name
     log.debug( f'file_name, ``{file_name}``' )
 
-    ## read barcodes ------------------------------------------------
-    barcodes: list = []
-    with open( file_path, 'r' ) as fh:
-        barcodes = fh.readlines()
-    log.debug( f'``{len(barcodes)}`` barcodes perceived' )
-
-    ## clean barcodes -----------------------------------------------
-    cleaned_barcodes: list = []  # removes newlines and possible empty line
-    for barcode in barcodes:
-        barcode = barcode.strip()
-        if barcode:
-            cleaned_barcodes.append( barcode )
-    barcodes = cleaned_barcodes
-    
-    ## iterate through barcodes
-    all_extracted_data: list = [
-        ['title', 'barcode', 'birkin_note', 'mmsid', 'holding_id', 'item_pid', 'library_info', 'location_info', 'base_status_info', 'process_type_info', 'bruknow_url']
-    ] 
-    assert len( all_extracted_data[0] ) == 11
-    for barcode in barcodes:
+    ## open the run-journal (kept on --resume) ----------------------
+    journal = run_journal.journal_from_environ( 'script_file_path_to_csv', file_path, resume )
+
+    ## read barcodes, lazily (stripped; blank lines skipped) --------
+    barcodes = barcode_reader.iter_barcodes( file_path )
+
+    ## iterate through barcodes, streaming each row to the csv ------
+    header_row: list = ['title', 'barcode', 'birkin_note', 'mmsid', 'holding_id', 'item_pid', 'library_info', 'location_info', 'base_status_info', 'process_type_info', 'bruknow_url']
+    assert len( header_row ) == 11
+    sink = row_sink.sink_from_environ( header_row, prefix=f'{path_obj.stem}_' )
+    for ( position, barcode ) in enumerate( barcodes ):
+
+        ## reuse a completed row from an interrupted run
+        journaled_row = journal.completed_row( position, barcode )
+        if journaled_row is not None:
+            sink.write_row( journaled_row )
+            continue
 
         ## call api
-        url_data: dict = prepare_api_url( barcode )
         item_data: dict = {}
+        query_note: str = ''
         try:
-            r = requests.get( url_data['api_url'], headers=url_data['headers'] )
-            item_data = r.json()
+            item_data = ALMA_CLIENT.get_item( barcode )
             # log.debug( f'item_data, ``{pprint.pformat(item_data)}``' )
+        except alma_client.AlmaUnavailableError as e:
+            log.warning( f'alma unavailable for barcode, ``{barcode}``; ``{e}``' )
+            query_note = 'alma unavailable (throttling or server-error); barcode deferred -- rerun'
         except Exception as e:
             log.exception( 'problem accessing barcode, ``{barcode}``')
 
-        ## extract data elements
-        extracted_data: list = extract_data( barcode, item_data )
-        all_extracted_data.append( extracted_data )  # type: ignore
-        # log.debug( f'all_extracted_data (in-process), ``{pprint.pformat(all_extracted_data)}``' )
+        ## keep just the fields the CSV needs --------------------------
+        item = item_record.project( item_data )
+        item_data = {}
 
-    ## create csv from extracted_data
-    # log.debug( f'all_extracted_data (FINAL), ``{pprint.pformat(all_extracted_data)}``' )
-    file_like_handler = io.StringIO()
-    csv.writer( file_like_handler, dialect='excel' ).writerows( all_extracted_data )
+        ## extract data elements
+        extracted_data: list = extract_data( barcode, item, query_note )
+        journal.record_lookup( position, barcode, item_record.as_jsonable(item), {} )
+        journal.record_row( position, barcode, {}, extracted_data, is_complete=bool(item and not query_note) )
+        sink.write_row( extracted_data )
 
     ## email csv
-    send_mail( file_like_handler, file_name, email_address )
+    with sink.finish() as file_like_handler:
+        send_mail( file_like_handler, file_name, email_address, sink.attachment_suffix )
+    sink.remove()
+    journal.clear()  # queued in the outbox; nothing left to resume
+    journal.close()
+    log.info( f'alma-api metrics, ``{ALMA_CLIENT.metrics}``' )
+    ALMA_CLIENT.close()
 
     return
 
     ## end def manage_barcode_processing()
 
 
-def prepare_api_url( barcode: str ) -> dict:
-    headers = {}
-    api_url: str = f'{ENVAR_ITEM_GET_URL_ROOT}?item_barcode={barcode}&apikey={ENVAR_API_KEY}'
-    headers: dict = {'Accept': 'application/json'}
-    url_data: dict = {
-        'headers': headers, 'api_url': api_url }
-    log.debug( 'api url_data prepared' )
-    return url_data
-
-
-def extract_data( barcode: str, item_data: dict ) -> list:
+def extract_data( barcode: str, item, query_note: str = '' ) -> list:
     """ Returns data-elements for the CSV from either:
-        - populated api item_data
-        - or, on unsuccessful api-call, just the barcode and note
+        - populated api data (an item_record.ItemRecord)
+        - or, on unsuccessful api-call, just the barcode and note (item is {} or the raw error-response)
+        query_note, if given, explains a deferred lookup.
         """
     try:
         ## initialize vars
         ( title, barcode, birkin_note, mmsid, holding_id, item_pid, library_info, location_info, base_status_info, process_type_info, bruknow_url ) = ( '', barcode, '', '', '', '', '', '', '', '', '' )
         # if item_data == {}:
         #     birkin_note = 'unable to query barcode'
-        if 'errorsExist' in item_data.keys():
+        item_data = {} if isinstance( item, item_record.ItemRecord ) else item  # raw error-response, if any
+        if query_note:
+            birkin_note: str = query_note
+        elif 'errorsExist' in item_data.keys():
             birkin_note: str = 'unable to query barcode'
-            log.info( f'item_data on extraction-problem, ``{pprint.pformat(item_data)}``' )
+            log.info( 'item_data on extraction-problem, ``%s``', log_helper.LazyPformat(item_data) )
         else:
-            title: str = item_data['bib_data']['title']  # accessing elements separately so if there's an error, the traceback will show where it occurred
+            title: str = item.title  # accessing elements separately so if there's an error, the traceback will show where it occurred
             if len(title) > 30:
                 title = f'{title[0:27]}...'
-            mmsid: str = stringify_data( item_data['bib_data']['mms_id'] ) 
-            holding_id: str = stringify_data( item_data['holding_data']['holding_id'] )
-            item_pid: str = stringify_data( item_data['item_data']['pid'] )
-            library_info: str = stringify_data( item_data['item_data']['library'] )
-            location_info: str = stringify_data( item_data['item_data']['location'] )
-            base_status_info: str = stringify_data( item_data['item_data']['base_status'] )
-            process_type_info: str = stringify_data( item_data['item_data']['process_type'] )
+            mmsid: str = stringify_data( item.mms_id ) 
+            holding_id: str = stringify_data( item.holding_id )
+            item_pid: str = stringify_data( item.pid )
+            library_info: str = stringify_data( item.library )
+            location_info: str = stringify_data( item.location )
+            base_status_info: str = stringify_data( item.base_status )
+            process_type_info: str = stringify_data( item.process_type )
             bruknow_url: str = f'<https://bruknow.library.brown.edu/discovery/fulldisplay?docid=alma{mmsid}&vid=01BU_INST:BROWN>'
         extracted_data = [ title, barcode, birkin_note, mmsid, holding_id, item_pid, library_info, location_info, base_status_info, process_type_info, bruknow_url ]
     except Exception as e:
-        log.exception( f'problem extracting data from item_data, ``{pprint.pformat(item_data)}``' )
+        log.exception( 'problem extracting data from item, ``%s``', log_helper.LazyPformat(item_record.as_jsonable(item)) )
         raise Exception( 'problem extracting data; see logs' )
-    log.debug( f'extracted_data, ``{pprint.pformat(extracted_data)}``' )
+    log.debug( 'extracted_data, ``%s``', log_helper.LazyPformat(extracted_data) )
     assert len(extracted_data) == 11
     return extracted_data
     
@@ -145,7 +146,7 @@ def stringify_data( data ) -> str:
     return data
 
 
-def send_mail( file_like_handler, file_name: str, email_address: str ) -> None:
+def send_mail( file_like_handler, file_name: str, email_address: str, attachment_suffix: str = '.csv' ) -> None:
     """ Tests build of email with a CSV attachment.
         Called by manage_csv_email() 
         TODO test multiple attachments. """
@@ -158,12 +159,10 @@ def send_mail( file_like_handler, file_name: str, email_address: str ) -> None:
     MESSAGE_BODY: str = 'The message body.'
     if '.' in file_name:
         name_parts: list = file_name.split( '.' )
-        file_name = f'{name_parts[0]}.csv'
+        file_name = f'{name_parts[0]}{attachment_suffix}'
     else:
-        file_name = f'{file_name}.csv'
+        file_name = f'{file_name}{attachment_suffix}'
     FILE_NAME: str = file_name
-    SMTP_SERVER: str = ENVAR_SMTP_HOST
-    SMTP_PORT: int = int( ENVAR_SMTP_PORT )
     ## create multipart message
     msg = MIMEMultipart()
     body_part = MIMEText(MESSAGE_BODY, _subtype='plain', _charset='utf-8' )
@@ -175,12 +174,12 @@ def send_mail( file_like_handler, file_name: str, email_address: str ) -> None:
     msg.attach(body_part)
     ## add CSV
     file_like_handler.seek( 0 )
-    msg.attach( MIMEApplication(file_like_handler.read(), Name=FILE_NAME) )
-    ## create SMTP object
-    smtp_obj = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-    ## send mail
-    smtp_obj.sendmail( msg['From'], msg['To'], msg.as_string() )
-    smtp_obj.quit()
+    if attachment_suffix == '.csv':
+        msg.attach( emailer.csv_attachment(FILE_NAME, file_like_handler.read()) )  # gzipped if large
+    else:
+        msg.attach( MIMEApplication(file_like_handler.read(), Name=FILE_NAME) )  # already compressed
+    ## queue for sending (the outbox sends in the background) -----
+    outbox.send( msg, msg['From'], [ email_address ] )
     return
 
     ## end def send_mail()
@@ -191,6 +190,7 @@ def parse_args() -> dict:
     parser = argparse.ArgumentParser( description='Required: email.' )
     parser.add_argument( '--file_path', '-f', help='file_path required', required=True )
     parser.add_argument( '--email', '-e', help='email required', required=True )
+    parser.add_argument( '--resume', help='reuse completed barcodes from an interrupted run over the same file; only the rest are looked up', action='store_true' )
     args: dict = vars( parser.parse_args() )
     return args
 
@@ -200,4 +200,4 @@ if __name__ == '__main__':
     log.debug( f'args, ```{args}```' )
     file_path: str = args['file_path']
     email_address: str = args['email']
-    manage_barcode_processing( file_path, email_address )
+    manage_barcode_processing( file_path, email_address, resume=args['resume'] )
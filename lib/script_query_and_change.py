@@ -11,37 +11,50 @@ This script:
 
 Usage...
 - assumes:
-    - five required environmental-variables are set (see below, after logging config)
+    - six required environmental-variables are set (see below, after logging config)
 - % cd ./annex_eod_alerts_code
 - % source ../env/bin/activate
 - % python3 ./lib/script_file_path_to_csv.py --email the-email-address --file_path /the/path.txt
+- add `--resume` to pick up an interrupted run over the same file (see run_journal.py).
+- add `--pipeline` to run GETs and PUTs concurrently (large fix-up runs); CSV rows still follow the file's barcode-order.
 '''
 
-import argparse, copy, csv, io, logging, os, pathlib, pprint, smtplib
+import argparse, collections, concurrent.futures, functools, logging, os, pathlib, sys
 from email.mime.application import MIMEApplication
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
-import requests
-
 
 logging.basicConfig(
     # filename=zzz,
-    level=logging.DEBUG,
+    level=os.environ.get( 'ANXEODALERTS__LOG_LEVEL', 'DEBUG' ),
     format='[%(asctime)s] %(levelname)s [%(module)s-%(funcName)s()::%(lineno)d] %(message)s',
     datefmt='%d/%b/%Y %H:%M:%S' )
 log = logging.getLogger(__name__)
 log.debug( 'logging ready' )
 
 
-ENVAR_SMTP_HOST: str = os.environ[ 'ANXEODALERTS__EMAIL_HOST' ]
-ENVAR_SMTP_PORT: str = os.environ[ 'ANXEODALERTS__EMAIL_PORT' ]
 ENVAR_ITEM_GET_URL_ROOT: str = os.environ['ANXEODALERTS__ITEM_API_ROOT']
 ENVAR_ITEM_PUT_URL_ROOT: str = os.environ['ANXEODALERTS__ITEM_PUT_API_ROOT']
 ENVAR_API_KEY: str = os.environ['ANXEODALERTS__ITEM_API_KEY_WRITE']
 
+sys.path.append( os.environ['ANXEODALERTS__ENCLOSING_PROJECT_PATH'] )
+from annex_eod_alerts_code.lib import alma_cache, alma_client, barcode_reader, emailer, item_record, item_rules, log_helper, outbox, row_sink, run_journal, throttle
+
+## pipelined-mode (--pipeline) sizing; GETs and PUTs share the rate-limit
+PIPELINE_GET_WORKERS: int = int( os.environ.get('ANXEODALERTS__PIPELINE_GET_WORKERS', '8') )
+PIPELINE_PUT_WORKERS: int = int( os.environ.get('ANXEODALERTS__PIPELINE_PUT_WORKERS', '4') )
+PIPELINE_WINDOW: int = int( os.environ.get('ANXEODALERTS__PIPELINE_WINDOW', '64') )  # max barcodes in flight; bounds memory and queueing
+ALMA_REQUESTS_PER_SECOND = float( os.environ.get('ANXEODALERTS__ALMA_REQUESTS_PER_SECOND', '10') )
+
+ALMA_CLIENT = alma_client.AlmaClient(
+    ENVAR_ITEM_GET_URL_ROOT, ENVAR_API_KEY, put_url_root=ENVAR_ITEM_PUT_URL_ROOT, timeout=20,
+    pool_size=PIPELINE_GET_WORKERS + PIPELINE_PUT_WORKERS, rate_limiter=throttle.TokenBucket( ALMA_REQUESTS_PER_SECOND ),
+    cache=alma_cache.cache_from_environ() )
+BARCODE_LOG_SAMPLER = log_helper.sampler_from_environ()  # per-barcode payload-dumps are logged for every nth barcode
 
-def manage_barcode_processing( file_path: str, emails: list ) -> None:
+
+def manage_barcode_processing( file_path: str, emails: list, pipeline: bool = False, resume: bool = False ) -> None:
 
     ## get filename -------------------------------------------------
     path_obj = pathlib.Path( file_path )
@@ -51,69 +64,166 @@ def manage_barcode_processing( file_path: str, emails: list ) -> None:
     ## get file_type ------------------------------------------------
     file_type: str = determine_file_type( file_name )  # used when evaluating GET data
 
-    ## read barcodes ------------------------------------------------
-    barcodes: list = []
-    with open( file_path, 'r' ) as fh:
-        barcodes = fh.readlines()
-    log.debug( f'``{len(barcodes)}`` barcodes perceived' )
-
-    ## clean barcodes -----------------------------------------------
-    cleaned_barcodes: list = []  # removes newlines and possible empty line
-    for barcode in barcodes:
-        barcode = barcode.strip()
-        if barcode:
-            cleaned_barcodes.append( barcode )
-    barcodes = cleaned_barcodes
-    
-    ## iterate through barcodes
-    all_extracted_data: list = [
-        ['title', 'barcode', 'birkin_note', 'library_before', 'library_todo', 'library_after', 'location_before', 'location_todo', 'location_after', 'base_status_before', 'base_status_todo', 'base_status_after', 'process_type_before', 'process_type_todo', 'process_type_after', 'bruknow_url']
-    ] 
-    assert len( all_extracted_data[0] ) == 16
-    for barcode in barcodes:
-
-        ## call api -------------------------------------------------
-        url_data: dict = prepare_api_url( barcode )
-        item_data: dict = {}
-        try:
-            r = requests.get( url_data['api_url'], headers=url_data['headers'], timeout=20 )
-            item_data = r.json()
-            log.debug( f'returned-get-api data, ``{pprint.pformat(item_data)}``' )
-        except Exception as e:
-            log.exception( 'problem accessing barcode, ``{barcode}``')
-
-        ## evaluate data --------------------------------------------
-        payload_data: dict = evaluate_data( file_type, item_data )
-
-        ## try update if needed -------------------------------------
-        updated_item_data: dict = {}
-        if payload_data:
-            updated_item_data = try_update( payload_data )
-
-        ## extract data elements ------------------------------------
-        extracted_data: list = extract_data( barcode, item_data, updated_item_data )
+    ## open the run-journal (kept on --resume) ----------------------
+    journal = run_journal.journal_from_environ( 'script_query_and_change', file_path, resume )
 
-        all_extracted_data.append( extracted_data )  # type: ignore
-        log.debug( f'all_extracted_data (in-process), ``{pprint.pformat(all_extracted_data)}``' )
+    ## read barcodes, lazily (stripped; blank lines skipped) --------
+    barcodes = barcode_reader.iter_barcodes( file_path )
 
-    ## create csv from extracted_data
-    log.debug( f'all_extracted_data (FINAL), ``{pprint.pformat(all_extracted_data)}``' )
-    file_like_handler = io.StringIO()
-    csv.writer( file_like_handler, dialect='excel' ).writerows( all_extracted_data )
+    ## iterate through barcodes, streaming each row to the csv ------
+    header_row: list = ['title', 'barcode', 'birkin_note', 'library_before', 'library_todo', 'library_after', 'location_before', 'location_todo', 'location_after', 'base_status_before', 'base_status_todo', 'base_status_after', 'process_type_before', 'process_type_todo', 'process_type_after', 'bruknow_url']
+    assert len( header_row ) == 16
+    sink = row_sink.sink_from_environ( header_row, prefix=f'{path_obj.stem}_' )
+    if pipeline:
+        ( get_workers, put_workers, window ) = ( PIPELINE_GET_WORKERS, PIPELINE_PUT_WORKERS, PIPELINE_WINDOW )
+    else:
+        ( get_workers, put_workers, window ) = ( 1, 1, 1 )  # strictly one barcode at a time
+    for extracted_data in process_barcodes( barcodes, file_type, get_workers, put_workers, window, journal ):
+        sink.write_row( extracted_data )
 
     ## email csv
-    send_mail( file_like_handler, file_name, emails )
+    with sink.finish() as file_like_handler:
+        send_mail( file_like_handler, file_name, emails, sink.attachment_suffix )
+    sink.remove()
+    journal.clear()  # queued in the outbox; nothing left to resume
+    journal.close()
+    log.info( f'alma-api metrics, ``{ALMA_CLIENT.metrics}``' )
+    ALMA_CLIENT.close()
 
     return
 
     ## end def manage_barcode_processing()
 
 
+# -------------------------------------------------------------------
+# pipeline
+# -------------------------------------------------------------------
+
+
+def process_barcodes( barcodes, file_type: str, get_workers: int, put_workers: int, window: int, journal ):
+    """ Yields a CSV row per barcode, in input order.
+        - GET+evaluate runs on one pool, PUTs on another, so lookups keep flowing while updates wait on alma.
+        - At most `window` barcodes are in flight; reading pauses until the oldest row is done (backpressure).
+        - A repeated barcode's GET waits until the previous occurrence's PUT has finished, so updates to an item are never reordered.
+        - Barcodes the journal already has a completed row for (on --resume) are not looked up again.
+        Called by manage_barcode_processing() """
+    pending: collections.deque = collections.deque()  # row-futures, in input order
+    latest_row_futures: dict = {}  # barcode -> row-future of its most recent occurrence
+    resumed_count: int = 0
+    with concurrent.futures.ThreadPoolExecutor( max_workers=get_workers, thread_name_prefix='get' ) as get_pool, \
+         concurrent.futures.ThreadPoolExecutor( max_workers=put_workers, thread_name_prefix='put' ) as put_pool:
+        for ( position, barcode ) in enumerate( barcodes ):
+            row_future: concurrent.futures.Future = concurrent.futures.Future()
+            journaled_row = journal.completed_row( position, barcode )
+            if journaled_row is not None:
+                row_future.set_result( journaled_row )
+                resumed_count += 1
+            else:
+                predecessor = latest_row_futures.get( barcode )
+                get_future = get_pool.submit( lookup_stage, position, barcode, file_type, predecessor, journal )
+                get_future.add_done_callback( functools.partial(hand_off_to_update, position, barcode, row_future, put_pool, journal) )
+            latest_row_futures[barcode] = row_future
+            pending.append( (barcode, row_future) )
+            while len( pending ) >= window:
+                yield pop_row( pending, latest_row_futures )
+        while pending:
+            yield pop_row( pending, latest_row_futures )
+    if resumed_count:
+        log.info( f'reused ``{resumed_count}`` completed rows from the run-journal' )
+    return
+
+
+def pop_row( pending: collections.deque, latest_row_futures: dict ) -> list:
+    """ Waits for and returns the oldest in-flight row, forgetting its barcode once no later occurrence depends on it.
+        Called by process_barcodes() """
+    ( barcode, row_future ) = pending.popleft()
+    extracted_data: list = row_future.result()  # re-raises a stage's exception
+    if latest_row_futures.get( barcode ) is row_future:
+        del latest_row_futures[barcode]
+    return extracted_data
+
+
+def lookup_stage( position: int, barcode: str, file_type: str, predecessor, journal ) -> tuple:
+    """ GETs and evaluates a barcode, and journals both; returns ( item, payload_data, query_note ).
+        `item` is an item_record.ItemRecord for a found item, otherwise the (small) raw response; the full response
+          survives only inside payload_data, when a PUT is needed.
+        Called by process_barcodes(), on the get-pool """
+    if predecessor is not None:
+        concurrent.futures.wait( [predecessor] )  # earlier occurrence's PUT must land first
+    ( item_data, query_note ) = fetch_item( barcode )
+    ( item, payload_data ) = evaluate_data( file_type, item_data )
+    journal.record_lookup( position, barcode, item_record.as_jsonable(item), payload_data )
+    return ( item, payload_data, query_note )
+
+
+def hand_off_to_update( position: int, barcode: str, row_future, put_pool, journal, get_future ) -> None:
+    """ Routes an evaluated barcode to the put-pool if it needs a PUT; otherwise completes (and journals) its row.
+        Called as a done-callback of the lookup_stage() future """
+    try:
+        ( item, payload_data, query_note ) = get_future.result()
+        if payload_data:
+            put_future = put_pool.submit( update_stage, position, barcode, item, payload_data, query_note, journal )
+            put_future.add_done_callback( functools.partial(copy_outcome, row_future) )
+        else:
+            extracted_data: list = extract_data( barcode, item, {}, query_note )
+            journal.record_row( position, barcode, {}, extracted_data, is_complete=bool(item and not query_note) )
+            row_future.set_result( extracted_data )
+    except Exception as e:
+        row_future.set_exception( e )
+    return
+
+
+def update_stage( position: int, barcode: str, item, payload_data: dict, query_note: str, journal ) -> list:
+    """ PUTs the payload, journals the result, and returns the barcode's CSV row.
+        A failed or deferred PUT is journaled as incomplete, so a resumed run retries it.
+        Called by hand_off_to_update(), on the put-pool """
+    updated_item_data: dict = {}
+    try:
+        updated_item_data = try_update( payload_data )
+    except alma_client.AlmaUnavailableError as e:
+        log.warning( f'alma unavailable for update of barcode, ``{barcode}``; ``{e}``' )
+        query_note = 'alma unavailable (throttling or server-error); update deferred -- rerun'
+    is_complete: bool = bool( updated_item_data ) and 'errorsExist' not in updated_item_data and not query_note
+    updated_item = item_record.project( updated_item_data )
+    extracted_data: list = extract_data( barcode, item, updated_item, query_note )
+    journal.record_row( position, barcode, item_record.as_jsonable(updated_item), extracted_data, is_complete=is_complete )
+    return extracted_data
+
+
+def copy_outcome( row_future, source_future ) -> None:
+    """ Completes row_future with source_future's result or exception.
+        Called as a done-callback of the update_stage() future """
+    exception = source_future.exception()
+    if exception is not None:
+        row_future.set_exception( exception )
+    else:
+        row_future.set_result( source_future.result() )
+    return
+
+
 # -------------------------------------------------------------------
 # helper functions
 # -------------------------------------------------------------------
 
 
+def fetch_item( barcode: str ) -> tuple:
+    """ GETs fresh item-data; returns ( item_data, query_note ), with item_data {} on failure.
+        Called by lookup_stage() """
+    item_data: dict = {}
+    query_note: str = ''
+    try:
+        item_data = ALMA_CLIENT.get_item( barcode, bypass_cache=True )  # always fresh data before a possible PUT
+        if log.isEnabledFor( logging.DEBUG ) and BARCODE_LOG_SAMPLER.sample():
+            log.debug( 'sampled returned-get-api data, ``%s``', log_helper.LazyPformat(item_data) )
+    except alma_client.AlmaUnavailableError as e:
+        log.warning( f'alma unavailable for barcode, ``{barcode}``; ``{e}``' )
+        query_note = 'alma unavailable (throttling or server-error); barcode deferred -- rerun'
+    except Exception as e:
+        log.exception( f'problem accessing barcode, ``{barcode}``' )
+    return ( item_data, query_note )
+
+
+
 def determine_file_type( file_name: str ) -> str:
     """ Returns the file_type from inspecting the file-name. 
         Called by: manage_barcode_processing() """
@@ -126,132 +236,67 @@ def determine_file_type( file_name: str ) -> str:
     return file_type
 
 
-def prepare_api_url( barcode: str ) -> dict:
-    headers = {}
-    api_url: str = f'{ENVAR_ITEM_GET_URL_ROOT}?item_barcode={barcode}&apikey={ENVAR_API_KEY}'
-    headers: dict = {'Accept': 'application/json'}
-    url_data: dict = {
-        'headers': headers, 'api_url': api_url }
-    log.debug( 'api url_data prepared' )
-    return url_data
-
-
-def evaluate_data( file_type: str, item_data: dict ) -> dict:
-    """ Evaluates existing item_data, updates item_data REFERENCE, for CSV, _and_ returns update payload-dict. 
-        Called by manage_barcode_processing() 
-        Based on March 25, 2022 email logic. """
-    log.debug( f'item_data at beginning of evaluate, ``{pprint.pformat(item_data)}``' )
-    ## check for no-barcode-found -----------------------------------
-
-    if 'errorList' in item_data.keys():
-        # log.debug( 'hereA' )
-        if 'error' in item_data['errorList']:
-            # log.debug( 'hereB' )
-            errors: list = item_data['errorList']['error']
-            for error in errors:
-                # log.debug( 'hereC' )
-                if 'errorMessage' in error.keys():
-                    # log.debug( 'hereD' )
-                    # if error['errorMessage'] == 'no items found for barcode'.lower():
-                    if 'no items found for barcode' in error['errorMessage'].lower():
-                        # log.debug( 'hereE' )
-                        return {}
-                        
-    ## setup --------------------------------------------------------
-    # payload_data: dict = item_data.copy()  # copy of GET response
-    # payload_data_reference: dict = item_data.copy()  # to see if there are any updates to perform
-    payload_data: dict = copy.deepcopy( item_data )
-    payload_data_reference: dict = copy.deepcopy( item_data )
-    assert payload_data == payload_data_reference
-    item_data['item_data']['library_eval'] = 'no-change'
-    item_data['item_data']['location_eval'] = 'no-change'
-    item_data['item_data']['base_status_eval'] = 'no-change'
-    item_data['item_data']['process_type_eval'] = 'no-change'    
-    ## handle process_type ------------------------------------------
-    continue_after_process_type_flag: bool = False
-    process_type: dict = item_data['item_data']['process_type']
-    log.debug( f'process_type for evaluation, ``{process_type}``' )
-    if process_type == {'desc': 'Technical - Migration', 'value': 'TECHNICAL' }:
-        log.debug( 'found "technical" process_type info' )
-        payload_data['item_data']['process_type'] = {'desc': None, 'value': ''}
-        item_data['item_data']['process_type_eval'] = "should change to ``{'desc': None, 'value': ''}``"
-        continue_after_process_type_flag = True
-    elif process_type == {'desc': None, 'value': '' }:
-        log.debug( 'found None process_type info, so continuing' )
-        continue_after_process_type_flag = True
-    if continue_after_process_type_flag == True:
-        ## handle base_status ---------------------------------------
-        base_status_ideal: dict = {'desc': 'Item in place', 'value': '1'}
-        if item_data['item_data']['base_status'] != base_status_ideal:
-            payload_data['item_data']['base_status'] = base_status_ideal
-            item_data['item_data']['base_status_eval'] = f'should change to ``{base_status_ideal}``'
-        ## handle library ------------------------------------------
-        library_ideal: dict = {}
-        if file_type == 'QHACS' or file_type == 'QHREF':
-            library_ideal: dict = {'desc': 'John Hay Library', 'value': 'HAY'}
-        elif file_type == 'QSACS' or file_type == 'QSREF':
-            library_ideal: dict = {'desc': 'Rockefeller Library', 'value': 'ROCK'}
-        if item_data['item_data']['library'] != library_ideal:
-            payload_data['item_data']['library'] = library_ideal
-            item_data['item_data']['library_eval'] = f'should change to ``{library_ideal}``'
-        ## handle location ------------------------------------------
-        location_ideal: dict = {}
-        if file_type == 'QHACS' or file_type == 'QHREF':
-            location_ideal: dict = {'desc': 'Annex Hay', 'value': 'HAYSTOR'}
-        elif file_type == 'QSACS' or file_type == 'QSREF':
-            location_ideal: dict = { 'desc': 'Annex Storage', 'value': 'RKSTORAGE' }
-        if item_data['item_data']['location'] != location_ideal:
-            payload_data['item_data']['location'] = location_ideal
-            item_data['item_data']['location_eval'] = f'should change to ``{location_ideal}``'
-    ## see if payload_data has been updated -------------------------
-    if payload_data == payload_data_reference:  # no change, so let's return a form of None
-        log.debug( 'no changes made, so returning empty payload' )
-        payload_data = {}
+def evaluate_data( file_type: str, item_data: dict ) -> tuple:
+    """ Evaluates existing item_data; returns ( item, payload_data ).
+        - item: an item_record.ItemRecord (with its `changes`, for the CSV) for a found item; otherwise item_data as-is.
+        - payload_data: the update payload, or {} if no PUT is needed.
+        Called by lookup_stage() 
+        Rules (based on March 25, 2022 email logic) are in item_rules.py. """
+    ## check for no usable item-data (failed or deferred lookup, or an alma error-response, eg "no items found") --
+    ## extract_data() writes the CSV note for these
+    if 'item_data' not in item_data:
+        log.debug( 'no item_data to evaluate, so returning empty payload' )
+        return ( item_data, {} )
+    ## diff the governed fields against the file-type's rules -------
+    record = item_record.project( item_data )
+    record.changes = item_rules.diff_item( file_type, record )
+    ## build payload only if there's something to PUT ---------------
+    payload_data: dict = {}
+    if record.changes:
+        payload_data = item_rules.build_payload( item_data, record.changes )
+        log.debug( f'payload updated; changes, ``{record.changes}``' )
     else:
-        log.debug( 'payload updated' )
-    log.debug( f'item_data at END of evaluate, ``{pprint.pformat(item_data)}``' )
-    return payload_data
+        log.debug( 'no changes made, so returning empty payload' )
+    return ( record, payload_data )
 
     ## end def evaluate_data()
 
 
 def try_update( payload_data: dict ) -> dict:
     """ Will try update here.
-        Called by manage_barcode_processing() """
+        Called by update_stage() """
     log.debug( 'about to try PUT...' )
-    log.debug( f'payload_data, ``{pprint.pformat(payload_data)}``' )
+    log.debug( 'payload_data, ``%s``', log_helper.LazyPformat(payload_data) )
     ## setup --------------------------------------------------------
     mmsid: str = stringify_data( payload_data['bib_data']['mms_id'] ) 
     holding_id: str = stringify_data( payload_data['holding_data']['holding_id'] )
     item_pid: str = stringify_data( payload_data['item_data']['pid'] )
     ## call item-put api --------------------------------------------
-    put_url_base = ENVAR_ITEM_PUT_URL_ROOT.replace( '{MMSID}', mmsid ).replace( '{HOLDING_ID}', holding_id ).replace( '{ITEM_PID}', item_pid )
-    put_url = f'{put_url_base}?generate_description=false&apikey={ENVAR_API_KEY}'
-    # log.debug( f'put_url, ``{put_url}``' )
-    header_dct = {'Accept': 'application/json', 'Content-Type': 'application/json'}  # 'Content-Type' not needed for GET
     returned_put_data: dict = {}
     try:
-        r = requests.put( put_url, json=payload_data, headers=header_dct, timeout=20 )
-        ## inspect result -----------------------------------------------
-        # log.debug( f' r.content, ``{r.content}``')
-        returned_put_data: dict = r.json()
+        returned_put_data: dict = ALMA_CLIENT.update_item( mmsid, holding_id, item_pid, payload_data )
+    except alma_client.AlmaUnavailableError:
+        raise  # transient; caller notes the deferral
     except Exception as e:
         log.exception( f'Problem on PUT, ``{repr(e)}``' )
-    log.debug( f'returned_put_data, ``{pprint.pformat(returned_put_data)}``' )
+    log.debug( 'returned_put_data, ``%s``', log_helper.LazyPformat(returned_put_data) )
     return returned_put_data
 
 
-def extract_data( barcode: str, item_data: dict, updated_item_data: dict ) -> list:
+def extract_data( barcode: str, item, updated_item, query_note: str = '' ) -> list:
     """ Returns data-elements for the CSV from either:
-        - populated api item_data
-        - or, on unsuccessful api-call, just the barcode and note
+        - populated api data (item, and the PUT's updated_item, are item_record.ItemRecord projections)
+        - or, on unsuccessful api-call, just the barcode and note (item is {} or the raw error-response)
+        query_note, if given, explains a deferred GET or PUT.
         """
     try:
         ## initialize vars
         ( title, barcode, birkin_note, library_before, library_todo, library_after, location_before, location_todo, location_after, base_status_before, base_status_todo, base_status_after, process_type_before, process_type_todo, process_type_after, bruknow_url ) = ( '', barcode, '', '', '', '', '', '', '', '', '', '', '', '', '', '' )
-        if item_data == {}:
+        item_data = {} if isinstance( item, item_record.ItemRecord ) else item  # raw error-response, if any
+        updated_item_data = {} if isinstance( updated_item, item_record.ItemRecord ) else updated_item
+        if item == {}:
             log.debug( 'item_data is {}' )
-            birkin_note: str = 'could not query barcode'
+            birkin_note: str = query_note if query_note else 'could not query barcode'
         elif 'errorsExist' in item_data.keys():
             log.debug( 'errors exist in item_data' )
             birkin_note: str = 'error in query response'
@@ -273,57 +318,66 @@ def extract_data( barcode: str, item_data: dict, updated_item_data: dict ) -> li
                                 err_msg: str = error['errorMessage']
                                 birkin_note = f'update-error-response, ``{err_msg}``' 
                                 break
-            log.info( f'item_data on extraction-problem, ``{pprint.pformat(item_data)}``' )
+            log.info( 'item_data on extraction-problem, ``%s``', log_helper.LazyPformat(item_data) )
         elif 'errorsExist' in updated_item_data.keys():
             birkin_note: str = f'update error-response, ``{repr(updated_item_data)}``'
         else:  ## all should be good
-            title: str = item_data['bib_data']['title']  # accessing elements separately so if there's an error, the traceback will show where it occurred
+            birkin_note = query_note  # empty unless the update was deferred
+            title: str = item.title  # accessing elements separately so if there's an error, the traceback will show where it occurred
             if len(title) > 30:
                 title = f'{title[0:27]}...'
-            mmsid: str = stringify_data( item_data['bib_data']['mms_id'] ) 
-            holding_id: str = stringify_data( item_data['holding_data']['holding_id'] )
-            item_pid: str = stringify_data( item_data['item_data']['pid'] )
+            mmsid: str = stringify_data( item.mms_id ) 
+            holding_id: str = stringify_data( item.holding_id )
+            item_pid: str = stringify_data( item.pid )
             ##
-            library_before: str = stringify_data( item_data['item_data']['library'] )
-            library_todo: str = item_data['item_data']['library_eval']
+            library_before: str = stringify_data( item.library )
+            library_todo: str = eval_note( item, 'library' )
             library_after: str = 'no-change-made'
-            if updated_item_data:
-                if updated_item_data['item_data']['library'] != item_data['item_data']['library']:
-                    library_after = stringify_data( updated_item_data['item_data']['library'] )
+            if updated_item:
+                if updated_item.library != item.library:
+                    library_after = stringify_data( updated_item.library )
             ##
-            location_before: str = stringify_data( item_data['item_data']['location'] )
-            location_todo: str = item_data['item_data']['location_eval']
+            location_before: str = stringify_data( item.location )
+            location_todo: str = eval_note( item, 'location' )
             location_after: str = 'no-change-made'
-            if updated_item_data:
-                if updated_item_data['item_data']['location'] != item_data['item_data']['location']:
-                    location_after = stringify_data( updated_item_data['item_data']['location'] )
+            if updated_item:
+                if updated_item.location != item.location:
+                    location_after = stringify_data( updated_item.location )
             ##
-            base_status_before: str = stringify_data( item_data['item_data']['base_status'] )
-            base_status_todo: str = item_data['item_data']['base_status_eval']
+            base_status_before: str = stringify_data( item.base_status )
+            base_status_todo: str = eval_note( item, 'base_status' )
             base_status_after: str = 'no-change-made'
-            if updated_item_data:
-                if updated_item_data['item_data']['base_status'] != item_data['item_data']['base_status']:
-                    base_status_after = stringify_data( updated_item_data['item_data']['base_status'] )
+            if updated_item:
+                if updated_item.base_status != item.base_status:
+                    base_status_after = stringify_data( updated_item.base_status )
             ##
-            process_type_before: str = stringify_data( item_data['item_data']['process_type'] )
-            process_type_todo: str = item_data['item_data']['process_type_eval']
+            process_type_before: str = stringify_data( item.process_type )
+            process_type_todo: str = eval_note( item, 'process_type' )
             process_type_after: str = 'no-change-made'
-            if updated_item_data:
-                if updated_item_data['item_data']['process_type'] != item_data['item_data']['process_type']:
-                    process_type_after = stringify_data( updated_item_data['item_data']['process_type'] )
+            if updated_item:
+                if updated_item.process_type != item.process_type:
+                    process_type_after = stringify_data( updated_item.process_type )
             ##
             bruknow_url: str = f'<https://bruknow.library.brown.edu/discovery/fulldisplay?docid=alma{mmsid}&vid=01BU_INST:BROWN>'
         extracted_data = [ title, barcode, birkin_note, library_before, library_todo, library_after, location_before, location_todo, location_after, base_status_before, base_status_todo, base_status_after, process_type_before, process_type_todo, process_type_after, bruknow_url ]
     except Exception as e:
-        log.exception( f'problem extracting data from item_data, ``{pprint.pformat(item_data)}``' )
+        log.exception( 'problem extracting data from item, ``%s``', log_helper.LazyPformat(item_record.as_jsonable(item)) )
         raise Exception( 'problem extracting data; see logs' )
-    log.debug( f'extracted_data, ``{pprint.pformat(extracted_data)}``' )
+    log.debug( 'extracted_data, ``%s``', log_helper.LazyPformat(extracted_data) )
     assert len(extracted_data) == 16
     return extracted_data
 
     ## end def extract_data()
     
 
+def eval_note( record, field: str ) -> str:
+    """ Returns the CSV's "todo" note for a governed field.
+        Called by extract_data() """
+    if record.changes and field in record.changes:
+        return f'should change to ``{record.changes[field]}``'
+    return 'no-change'
+
+
 def stringify_data( data ) -> str:
     """ Ensures data (in this example sometimes a dict) is returned as a string.
         Called by extract_data() """
@@ -332,7 +386,7 @@ def stringify_data( data ) -> str:
     return data
 
 
-def send_mail( file_like_handler, file_name: str, emails: list ) -> None:
+def send_mail( file_like_handler, file_name: str, emails: list, attachment_suffix: str = '.csv' ) -> None:
     """ Tests build of email with a CSV attachment.
         Called by manage_barcode_processing()() 
         TODO test multiple attachments. """
@@ -344,12 +398,10 @@ def send_mail( file_like_handler, file_name: str, emails: list ) -> None:
     MESSAGE_BODY: str = 'The message body.'
     if '.' in file_name:
         name_parts: list = file_name.split( '.' )
-        file_name = f'{name_parts[0]}.csv'
+        file_name = f'{name_parts[0]}{attachment_suffix}'
     else:
-        file_name = f'{file_name}.csv'
+        file_name = f'{file_name}{attachment_suffix}'
     FILE_NAME: str = file_name
-    SMTP_SERVER: str = ENVAR_SMTP_HOST
-    SMTP_PORT: int = int( ENVAR_SMTP_PORT )
     ## create multipart message -------------------------------------
     msg = MIMEMultipart()
     body_part = MIMEText(MESSAGE_BODY, _subtype='plain', _charset='utf-8' )
@@ -361,13 +413,12 @@ def send_mail( file_like_handler, file_name: str, emails: list ) -> None:
     msg.attach(body_part)
     ## add CSV ------------------------------------------------------
     file_like_handler.seek( 0 )
-    msg.attach( MIMEApplication(file_like_handler.read(), Name=FILE_NAME) )
-    ## create SMTP object -------------------------------------------
-    smtp_obj = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-    ## send mail ----------------------------------------------------
-    # smtp_obj.sendmail( msg['From'], msg['To'], msg.as_string() )
-    smtp_obj.sendmail( msg['From'], emails, msg.as_string() )
-    smtp_obj.quit()
+    if attachment_suffix == '.csv':
+        msg.attach( emailer.csv_attachment(FILE_NAME, file_like_handler.read()) )  # gzipped if large
+    else:
+        msg.attach( MIMEApplication(file_like_handler.read(), Name=FILE_NAME) )  # already compressed
+    ## queue for sending (the outbox sends in the background) -----
+    outbox.send( msg, msg['From'], emails )
     return
 
     ## end def send_mail()
@@ -383,6 +434,8 @@ def parse_args() -> dict:
     parser = argparse.ArgumentParser( description='Required: file_path and email (comma-separated if multiple).' )
     parser.add_argument( '--file_path', '-f', help='file_path required', required=True )
     parser.add_argument( '--email', '-e', help='email (comma-separated if multiple) required', required=True )
+    parser.add_argument( '--resume', help='reuse completed barcodes from an interrupted run over the same file; only the rest are looked up (and updated)', action='store_true' )
+    parser.add_argument( '--pipeline', help='run GETs and PUTs concurrently on bounded worker-pools (see ANXEODALERTS__PIPELINE_* envars)', action='store_true' )
     args: dict = vars( parser.parse_args() )
     return args
 
@@ -394,4 +447,4 @@ if __name__ == '__main__':
     email_str: str = args['email']
     emails: list = email_str.split( ',' )
     log.debug( f'emails, ``{emails}``' )
-    manage_barcode_processing( file_path, emails )
+    manage_barcode_processing( file_path, emails, pipeline=args['pipeline'], resume=args['resume'] )
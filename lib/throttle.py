@@ -0,0 +1,97 @@
+import logging, random, threading, time
+
+log = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """ Thread-safe token-bucket rate-limiter shared by concurrent alma-api callers.
+        `rate` is requests-per-second; `capacity` is the allowed burst (defaults to one second's worth). """
+
+    def __init__( self, rate, capacity=None ):
+        assert float(rate) > 0
+        self.rate = float( rate )
+        self.capacity = float( capacity ) if capacity else max( 1.0, self.rate )
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire( self ):
+        """ Blocks until a token is available, then consumes it.
+            Called by alma_client.AlmaClient.request() """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min( self.capacity, self.tokens + ((now - self.last_refill) * self.rate) )
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_seconds = ( 1 - self.tokens ) / self.rate
+            time.sleep( wait_seconds )
+
+    ## end class TokenBucket()
+
+
+class CircuitOpenError(Exception):
+    """ Raised, without a network-call, while the circuit-breaker is open. """
+    pass
+
+
+class CircuitBreaker(object):
+    """ Stops calls to alma after `failure_threshold` consecutive transient failures.
+        After `reset_seconds` one trial call is let through ("half-open"); success closes the circuit, failure re-opens it. """
+
+    def __init__( self, failure_threshold=10, reset_seconds=60 ):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def before_call( self ) -> bool:
+        """ Raises CircuitOpenError if calls shouldn't be made now; returns True if this call is the half-open trial,
+              in which case the caller must call end_trial() when it's done, however it ends.
+            Called by alma_client.AlmaClient.request() """
+        with self.lock:
+            if self.opened_at is None:
+                return False
+            if ( time.monotonic() - self.opened_at ) < self.reset_seconds or self.trial_in_flight:
+                raise CircuitOpenError( 'alma circuit-breaker open; call not attempted' )
+            self.trial_in_flight = True  # half-open: let this one call through
+            return True
+
+    def end_trial( self ):
+        """ Clears the trial-flag, even if the trial ended without record_success() or record_failure() (eg on an unexpected
+              exception); the circuit stays open, and the next call is a new trial.
+            Called by alma_client.AlmaClient.request(), in a `finally` """
+        with self.lock:
+            self.trial_in_flight = False
+
+    def record_success( self ):
+        """ Called by alma_client.AlmaClient.request() """
+        with self.lock:
+            if self.opened_at is not None:
+                log.info( 'alma circuit-breaker closed' )
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure( self ):
+        """ Called by alma_client.AlmaClient.request() """
+        with self.lock:
+            self.consecutive_failures += 1
+            if self.trial_in_flight or self.consecutive_failures >= self.failure_threshold:
+                if self.opened_at is None or self.trial_in_flight:
+                    log.warning( f'alma circuit-breaker opened after ``{self.consecutive_failures}`` consecutive failures' )
+                self.opened_at = time.monotonic()
+                self.trial_in_flight = False
+
+    ## end class CircuitBreaker()
+
+
+def backoff_seconds( attempt, base_seconds=0.5, cap_seconds=8.0 ):
+    """ Returns a "full-jitter" exponential-backoff delay for the (zero-based) retry attempt.
+        Called by alma_client.AlmaClient.request() """
+    ceiling = min( cap_seconds, base_seconds * (2 ** attempt) )
+    return random.uniform( 0, ceiling )
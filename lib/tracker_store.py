@@ -0,0 +1,165 @@
+"""
+Indexed store of processed end-of-day file-names; replaces rewriting the json tracker-list on every update.
+
+- Membership checks are primary-key lookups.
+- File-names are staged during a run and written in one transaction by commit().
+- Entries older than the retention-period are dropped by compact().
+- The legacy json tracker-file (ANXEODALERTS__TRACKER_FILE_PATH) is imported once, on first use.
+- Size-observations of not-yet-ready files are kept between runs, so a file still being written can be told
+    from one that's stable (see file_handler.filter_ready_files()).
+- Barcodes deferred because alma was unavailable are kept, per category, until a later run rechecks them
+    (see checker.check_category()); they're written in the same transaction as their file's name.
+    Each is rechecked at most once per interval, and only a limited number of times.
+"""
+
+import json, logging, os, threading, time
+
+from annex_eod_alerts_code.lib import db_helper
+
+log = logging.getLogger(__name__)
+
+
+class TrackerStore(object):
+    """ Supports `file_name in tracker`, so it can stand in for the old recent-files list. """
+
+    def __init__( self, db_path: str, json_import_path: str = '' ):
+        self.db_path = db_path
+        self.staged_names: list = []
+        self.staged_deferrals: list = []  # ( barcode, results_key, file_name ) rows
+        self.staged_resolutions: list = []  # ( barcode, results_key ) rows
+        self.staged_rechecks: list = []  # ( barcode, results_key ) rows, rechecked but still deferred
+        self.lock = threading.Lock()
+        self.conn = db_helper.connect( db_path )
+        with self.conn:
+            self.conn.execute( 'CREATE TABLE IF NOT EXISTS processed_files ( file_name TEXT PRIMARY KEY, processed_at REAL NOT NULL )' )
+            self.conn.execute( 'CREATE INDEX IF NOT EXISTS processed_files_processed_at ON processed_files (processed_at)' )
+            self.conn.execute( 'CREATE TABLE IF NOT EXISTS meta ( key TEXT PRIMARY KEY, value TEXT )' )
+            self.conn.execute( 'CREATE TABLE IF NOT EXISTS pending_files ( file_name TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, observed_at REAL NOT NULL )' )
+            self.conn.execute( '''CREATE TABLE IF NOT EXISTS deferred_barcodes (
+                barcode TEXT NOT NULL,
+                results_key TEXT NOT NULL,
+                file_name TEXT NOT NULL,
+                deferred_at REAL NOT NULL,
+                checked_at REAL NOT NULL DEFAULT 0,
+                recheck_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (barcode, results_key) )''' )
+            db_helper.ensure_column( self.conn, 'deferred_barcodes', 'checked_at', 'REAL NOT NULL DEFAULT 0' )
+            db_helper.ensure_column( self.conn, 'deferred_barcodes', 'recheck_count', 'INTEGER NOT NULL DEFAULT 0' )
+        if json_import_path:
+            self.import_json_once( json_import_path )
+
+    def __contains__( self, file_name: str ) -> bool:
+        with self.lock:
+            row = self.conn.execute( 'SELECT 1 FROM processed_files WHERE file_name = ?', (file_name,) ).fetchone()
+        return row is not None
+
+    def import_json_once( self, json_path: str ) -> None:
+        """ Loads the legacy json tracker-list, if it exists and hasn't already been imported.
+            Called by __init__() """
+        with self.lock:
+            row = self.conn.execute( "SELECT value FROM meta WHERE key = 'json_imported_from'" ).fetchone()
+            if row is not None or not os.path.exists( json_path ):
+                return
+            with open( json_path ) as fh:
+                legacy_names: list = json.loads( fh.read() )
+            now = time.time()
+            with self.conn:
+                self.conn.executemany( 'INSERT OR IGNORE INTO processed_files (file_name, processed_at) VALUES (?, ?)', [(name, now) for name in legacy_names] )
+                self.conn.execute( "INSERT INTO meta (key, value) VALUES ('json_imported_from', ?)", (json_path,) )
+        log.info( f'imported ``{len(legacy_names)}`` entries from legacy tracker-file, ``{json_path}``' )
+
+    def observe( self, file_name: str, size: int, mtime_ns: int ):
+        """ Records a pending file's current size and mtime; returns the previous observation's `observed_at`
+              if the file is unchanged since then, otherwise None.
+            Called by file_handler.filter_ready_files() """
+        with self.lock:
+            row = self.conn.execute( 'SELECT size, mtime_ns, observed_at FROM pending_files WHERE file_name = ?', (file_name,) ).fetchone()
+            if row is not None and row[0] == size and row[1] == mtime_ns:
+                return row[2]
+            with self.conn:
+                self.conn.execute( 'INSERT OR REPLACE INTO pending_files (file_name, size, mtime_ns, observed_at) VALUES (?, ?, ?, ?)', (file_name, size, mtime_ns, time.time()) )
+        return None
+
+    def stage( self, file_name: str ) -> None:
+        """ Queues a processed file-name for the run's commit().
+            Called by checker.update_tracker() """
+        with self.lock:
+            self.staged_names.append( file_name )
+
+    def stage_deferred( self, results_key: str, file_name: str, barcodes: list ) -> None:
+        """ Queues a file's deferred barcodes for the run's commit().
+            Called by checker.update_tracker() """
+        with self.lock:
+            self.staged_deferrals.extend( (barcode, results_key, file_name) for barcode in barcodes )
+
+    def stage_resolved( self, results_key: str, barcodes: list ) -> None:
+        """ Queues previously-deferred barcodes that have now been checked, for removal by the run's commit().
+            Called by checker.check_category() """
+        with self.lock:
+            self.staged_resolutions.extend( (barcode, results_key) for barcode in barcodes )
+
+    def stage_rechecked( self, results_key: str, barcodes: list ) -> None:
+        """ Queues previously-deferred barcodes that were rechecked but are still deferred; commit() counts the recheck.
+            Called by checker.check_category() """
+        with self.lock:
+            self.staged_rechecks.extend( (barcode, results_key) for barcode in barcodes )
+
+    def deferred_barcodes( self, results_key: str, checked_before: float ) -> list:
+        """ Returns ( barcode, recheck_count ) for the category's deferred barcodes last checked before `checked_before`, oldest first.
+            Called by checker.check_category() """
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT barcode, recheck_count FROM deferred_barcodes WHERE results_key = ? AND checked_at < ? ORDER BY deferred_at, rowid',
+                (results_key, checked_before) ).fetchall()
+        return rows
+
+    def has_deferred_barcodes( self, checked_before: float ) -> bool:
+        """ Returns True if any deferred barcode was last checked before `checked_before`, ie is due a recheck.
+            Called by controller.process_source_directory() """
+        with self.lock:
+            row = self.conn.execute( 'SELECT 1 FROM deferred_barcodes WHERE checked_at < ? LIMIT 1', (checked_before,) ).fetchone()
+        return row is not None
+
+    def commit( self ) -> None:
+        """ Writes all staged file-names, deferrals, rechecks, and resolutions in one transaction.
+            A barcode already awaiting a recheck keeps its original entry.
+            Called by controller.process_new_files() """
+        with self.lock:
+            if not ( self.staged_names or self.staged_deferrals or self.staged_resolutions or self.staged_rechecks ):
+                return
+            now = time.time()
+            with self.conn:
+                self.conn.executemany( 'INSERT OR REPLACE INTO processed_files (file_name, processed_at) VALUES (?, ?)', [(name, now) for name in self.staged_names] )
+                self.conn.executemany( 'DELETE FROM pending_files WHERE file_name = ?', [(name,) for name in self.staged_names] )
+                self.conn.executemany( 'DELETE FROM deferred_barcodes WHERE barcode = ? AND results_key = ?', self.staged_resolutions )
+                self.conn.executemany(
+                    'UPDATE deferred_barcodes SET checked_at = ?, recheck_count = recheck_count + 1 WHERE barcode = ? AND results_key = ?',
+                    [ (now,) + row for row in self.staged_rechecks ] )
+                self.conn.executemany(
+                    'INSERT OR IGNORE INTO deferred_barcodes (barcode, results_key, file_name, deferred_at, checked_at) VALUES (?, ?, ?, ?, ?)',
+                    [ row + (now, now) for row in self.staged_deferrals ] )
+            log.debug( f'committed tracker entries, ``{self.staged_names}``; ``{len(self.staged_deferrals)}`` deferrals; '
+                       f'``{len(self.staged_rechecks)}`` still deferred; ``{len(self.staged_resolutions)}`` resolutions' )
+            ( self.staged_names, self.staged_deferrals, self.staged_resolutions, self.staged_rechecks ) = ( [], [], [], [] )
+
+    def compact( self, retention_days: float ) -> int:
+        """ Drops entries older than the retention-period; returns the count removed.
+            Called by controller.process_new_files() """
+        cutoff = time.time() - ( retention_days * 86400 )
+        with self.lock:
+            with self.conn:
+                cursor = self.conn.execute( 'DELETE FROM processed_files WHERE processed_at < ?', (cutoff,) )
+                self.conn.execute( 'DELETE FROM pending_files WHERE observed_at < ?', (cutoff,) )  # files that vanished unprocessed
+                self.conn.execute( 'DELETE FROM deferred_barcodes WHERE deferred_at < ?', (cutoff,) )
+        if cursor.rowcount:
+            log.info( f'removed ``{cursor.rowcount}`` tracker entries older than ``{retention_days}`` days' )
+        return cursor.rowcount
+
+    ## end class TrackerStore()
+
+
+def store_from_environ( tracker_path: str ) -> TrackerStore:
+    """ Returns the TrackerStore, at ANXEODALERTS__TRACKER_DB_PATH (default: alongside the legacy json tracker-file).
+        Called by file_handler.load_recent_file_list() """
+    db_path: str = os.environ.get( 'ANXEODALERTS__TRACKER_DB_PATH', f'{tracker_path}.sqlite3' )
+    return TrackerStore( db_path, json_import_path=tracker_path )
@@ -7,27 +7,22 @@ Usage...
 - % python3 ./api_proof_of_concept_READ.py
 '''
 
-import json, os, pprint
-import requests
+import json, os, pprint, sys
 
-URL_ROOT = os.environ['ANXEODALERTS__ITEM_API_ROOT']
-API_KEY = os.environ['ANXEODALERTS__ITEM_API_KEY']
 POC_BARCODES_SOURCE = os.environ['ANXEODALERTS__POC_BARCODES_SOURCE_FILEPATH']
 POC_OUTPUT = os.environ['ANXEODALERTS__POC_BARCODES_OUTPUT_FILEPATH']
 
-headers = {'Accept': 'application/json'}
-url = "%s?item_barcode={barcode}&apikey=%s" % ( URL_ROOT, API_KEY )
-print( f'url, ``{url}``' )
+sys.path.append( os.environ['ANXEODALERTS__ENCLOSING_PROJECT_PATH'] )
+from annex_eod_alerts_code.lib import alma_client
 
-tfp = [ 'BARCODE, LIBRARY, LOCATION, BASE_STATUS, PROCESS_TYPE\n' ]  # heading-row
+client = alma_client.client_from_environ( 'ANXEODALERTS__ITEM_API_KEY', timeout=10 )
 
-with open( POC_BARCODES_SOURCE, 'rb') as fp:
+with open( POC_BARCODES_SOURCE, 'rb') as fp, open( POC_OUTPUT, 'w', encoding="utf-8" ) as txt:
+    txt.write( 'BARCODE, LIBRARY, LOCATION, BASE_STATUS, PROCESS_TYPE\n' )  # heading-row
     for line in fp:
         barcode=line.decode('utf8').strip()
-        full_url = url.format(barcode=barcode)
-        print( f'full_ulr, ``{full_url}``' )
-        req = requests.get(full_url, headers=headers, timeout=10 )
-        data = req.json()
+        print( f'barcode, ``{barcode}``' )
+        data = client.get_item( barcode )
         print( f'data, ``{pprint.pformat(data)}``' )
 
         ## k, i took these out of the append(), cuz one was failing and I couldn't tell which (was process_type)
@@ -45,11 +40,10 @@ with open( POC_BARCODES_SOURCE, 'rb') as fp:
         print( f'base_status_info, ``{base_status_info}``' )
         print( f'process_type_info, ``{process_type_info}``' )
 
-        tfp.append(barcode_info + ', ' +
-                   library_info + ', ' +
-                   location_info + ', ' +
-                   base_status_info + ', ' +
-                   process_type_info +
-                   '\n')
-        with open( POC_OUTPUT, 'w', encoding="utf-8") as txt:
-            txt.writelines(tfp)
+        txt.write(barcode_info + ', ' +
+                  library_info + ', ' +
+                  location_info + ', ' +
+                  base_status_info + ', ' +
+                  process_type_info +
+                  '\n')
+        txt.flush()  # each row is on disk as soon as it's looked up
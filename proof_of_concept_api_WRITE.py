@@ -7,7 +7,7 @@ This will take a barcode, and update the item's 'internal_note_1' field with a n
 Usage...
 - assumes:
     - `requests` is in python-environment
-    - three environmental-variables are set (see below, after logging config)
+    - four environmental-variables are set (see below, after logging config)
 - % cd ./annex_eod_alerts_code
 - % source ../env/bin/activate
 - % python3 ./api_proof_of_concept_WRITE.py --barcode 12345678
@@ -22,7 +22,6 @@ Steps...
 '''
 
 import argparse, datetime, json, logging, os, pprint, sys
-import requests
 
 
 logging.basicConfig(
@@ -38,17 +37,16 @@ ITEM_GET_URL_ROOT: str = os.environ['ANXEODALERTS__ITEM_API_ROOT']
 ITEM_PUT_URL_ROOT: str = os.environ['ANXEODALERTS__ITEM_PUT_API_ROOT']
 API_KEY_WRITE: str = os.environ['ANXEODALERTS__ITEM_API_KEY_WRITE']
 
+sys.path.append( os.environ['ANXEODALERTS__ENCLOSING_PROJECT_PATH'] )
+from annex_eod_alerts_code.lib import alma_client
+
+ALMA_CLIENT = alma_client.AlmaClient( ITEM_GET_URL_ROOT, API_KEY_WRITE, put_url_root=ITEM_PUT_URL_ROOT, timeout=10 )
+
 
 def manage_update( barcode: str ) -> None:
     ## call item-get api --------------------------------------------
     log.debug( f'ITEM_GET_URL_ROOT, ``{ITEM_GET_URL_ROOT}``' )
-    get_url: str = f'{ITEM_GET_URL_ROOT}?item_barcode={barcode}&apikey={API_KEY_WRITE}'
-    # log.debug( f'get_url, ``{get_url}``' )
-    r = requests.get( get_url, headers={'Accept': 'application/json'}, timeout=10 )
-    ## inspect result -----------------------------------------------
-    # log.debug( f'item-get r.status_code, ``{r.status_code}``' )
-    # log.debug( f' r.content, ``{r.content}``')
-    data: dict = r.json()
+    data: dict = ALMA_CLIENT.get_item( barcode )
     log.debug( f'original data, ``{pprint.pformat(data)}``' )
     ## extract data -------------------------------------------------
     mmsid = data['bib_data']['mms_id']
@@ -81,14 +79,7 @@ def manage_update( barcode: str ) -> None:
     payload_dct: dict = data.copy()  # copy of GET response
     payload_dct['item_data']['internal_note_1'] = new_note
     ## call item-put api --------------------------------------------
-    put_url_base = ITEM_PUT_URL_ROOT.replace( '{MMSID}', mmsid ).replace( '{HOLDING_ID}', holding_id ).replace( '{ITEM_PID}', item_pid )
-    put_url = f'{put_url_base}?generate_description=false&apikey={API_KEY_WRITE}'
-    # log.debug( f'put_url, ``{put_url}``' )
-    header_dct = {'Accept': 'application/json', 'Content-Type': 'application/json'}  # 'Content-Type' not needed for GET
-    r = requests.put( put_url, json=payload_dct, headers=header_dct, timeout=10 )
-    ## inspect result -----------------------------------------------
-    # log.debug( f' r.content, ``{r.content}``')
-    post_put_data: dict = r.json()
+    post_put_data: dict = ALMA_CLIENT.update_item( mmsid, holding_id, item_pid, payload_dct )
     log.debug( f'post_put_data, ``{pprint.pformat(post_put_data)}``' )
     assert post_put_data['item_data']['internal_note_1'] == new_note
     log.info( 'success!' )
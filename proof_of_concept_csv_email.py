@@ -10,11 +10,11 @@ Usage...
 
 Steps...
 - extract necessary/convenient data from Alma item-api responses
-- build a CSV using a file-like-object, instead of reading/writing to an actual file-system file
+- build a CSV by streaming rows to a temp-file (lib/row_sink.py), instead of holding them all in memory
 - build the email, attaching the CSV, and send
 '''
 
-import argparse, csv, io, logging, os, pprint, smtplib
+import argparse, logging, os, smtplib, sys
 
 from email.mime.application import MIMEApplication
 from email.mime.multipart import MIMEMultipart
@@ -33,6 +33,9 @@ log.debug( 'logging ready' )
 ENVAR_SMTP_SERVER: str = os.environ[ 'ANXEODALERTS__TEST_EMAIL_SMTP_SERVER' ]
 ENVAR_SMTP_PORT: str = os.environ[ 'ANXEODALERTS__TEST_EMAIL_SMTP_PORT' ]
 
+sys.path.append( os.environ['ANXEODALERTS__ENCLOSING_PROJECT_PATH'] )
+from annex_eod_alerts_code.lib import row_sink
+
 
 def manage_csv_email( email_address: str ) -> None:
     """ Manages creation and sending of CSV file.
@@ -42,7 +45,7 @@ def manage_csv_email( email_address: str ) -> None:
     ## extract necessary data ---------------------------------------
     header_row = ['title', 'mmsid', 'holding_id', 'item_pid', 'library_info', 'location_info', 'base_status_info', 'process_type_info', 'bruknow_url'] 
     assert len( header_row ) == 9
-    extracted_results: list = [ header_row ]
+    sink = row_sink.sink_from_environ( header_row, prefix='poc_' )
     for data in results:
         assert type(data) == dict
         title: str = data['bib_data']['title']  # accessing elements separately so if there's an error, the traceback will show where it occurred
@@ -59,18 +62,11 @@ def manage_csv_email( email_address: str ) -> None:
         extracted_data: list = [
             title, mmsid, holding_id, item_pid, library_info, location_info, base_status_info, process_type_info, bruknow_url ] 
         assert len( extracted_data ) == 9
-        extracted_results.append( extracted_data )  # type: ignore
-    log.debug( f'extracted_results, ``{pprint.pformat(extracted_results)}``' )
-    ## build csv ----------------------------------------------------
-    file_like_handler = io.StringIO()
-    csv.writer( file_like_handler, dialect='excel' ).writerows( extracted_results )
-    # csv.writer( file_like_handler, delimiter=',', quoting=csv.QUOTE_ALL, doublequote=False, escapechar='\\' ).writerows( extracted_results )
-    # file_like_handler.seek( 0 )
-    # rows: list = file_like_handler.readlines()
-    # for row in rows:
-    #     log.debug( f'row, ``{row}``' )
+        sink.write_row( extracted_data )
     ## build and send email -----------------------------------------
-    send_mail( file_like_handler, email_address )
+    with sink.finish() as file_like_handler:
+        send_mail( file_like_handler, email_address, sink.attachment_suffix )
+    sink.remove()
     return
 
     ## end def manage_csv_email()
@@ -84,7 +80,7 @@ def stringify_data( data ) -> str:
     return data
 
 
-def send_mail( file_like_handler, email_address: str ):
+def send_mail( file_like_handler, email_address: str, attachment_suffix: str = '.csv' ):
     """ Tests build of email with a CSV attachment.
         Called by manage_csv_email() 
         TODO test multiple attachments. """
@@ -95,7 +91,7 @@ def send_mail( file_like_handler, email_address: str ):
     # EMAIL_TO = os.environ[ 'ANXEODALERTS__TEST_EMAIL_TO_STRING' ]
     EMAIL_TO: str = email_address
     MESSAGE_BODY: str = 'The message body.'
-    FILE_NAME: str = 'test.csv'  # this could be the name of the file-processed; TODO: multiple files!
+    FILE_NAME: str = f'test{attachment_suffix}'  # this could be the name of the file-processed; TODO: multiple files!
     SMTP_SERVER: str = ENVAR_SMTP_SERVER
     SMTP_PORT: int = int( ENVAR_SMTP_PORT )
     ## create multipart message
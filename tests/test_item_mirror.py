@@ -0,0 +1,126 @@
+'''
+Tests for lib/item_mirror.py: csv and xml import, the annex-only filter, and the checker's fallback to the live api
+  for records older than the max-age.
+
+Usage...
+- assumes:
+    - ANXEODALERTS__ENCLOSING_PROJECT_PATH is set
+- % cd ./annex_eod_alerts_code
+- % source ../env/bin/activate
+- % python3 -m unittest discover -s ./tests
+'''
+
+import os, shutil, sys, tempfile, time, unittest
+from unittest import mock
+
+sys.path.append( os.environ['ANXEODALERTS__ENCLOSING_PROJECT_PATH'] )
+from annex_eod_alerts_code.lib import item_mirror
+
+CSV_EXPORT: str = '''Barcode,Title,MMS Id,Holding Id,Item Id,Library Code,Library Name,Location Code,Location Name,Base Status Code,Base Status
+31236000000001,Annex title,991001,221001,231001,ROCK,Rockefeller Library,RKSTORAGE,Annex,1,Item in place
+31236000000002,Hay annex title,991002,221002,231002,HAY,John Hay Library,HAYSTOR,Hay Annex,1,Item in place
+31236000000003,Stacks title,991003,221003,231003,ROCK,Rockefeller Library,STACKS,Stacks,1,Item in place
+'''
+
+XML_EXPORT: str = '''<?xml version="1.0" encoding="UTF-8"?>
+<items>
+  <item><barcode>31236000000011</barcode><title>Annex title</title><mms_id>991011</mms_id><holding_id>221011</holding_id><pid>231011</pid>
+    <library>ROCK</library><location>RKSTORAGE</location><base_status>1</base_status></item>
+  <item><barcode>31236000000012</barcode><title>Stacks title</title><mms_id>991012</mms_id><holding_id>221012</holding_id><pid>231012</pid>
+    <library>ROCK</library><location>STACKS</location><base_status>1</base_status></item>
+</items>
+'''
+
+
+def api_item( barcode: str, location: str = 'RKSTORAGE' ) -> dict:
+    """ Returns a minimal live item-api response. """
+    return {
+        'bib_data': { 'title': 'Live title', 'mms_id': '991999' },
+        'holding_data': { 'holding_id': '221999' },
+        'item_data': {
+            'barcode': barcode, 'pid': '231999',
+            'library': { 'desc': 'Rockefeller Library', 'value': 'ROCK' },
+            'location': { 'desc': 'Annex', 'value': location },
+            'base_status': { 'desc': 'Item in place', 'value': '1' },
+            'process_type': { 'desc': None, 'value': '' } } }
+
+
+class ItemMirrorTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.temp_dir = tempfile.mkdtemp( prefix='item_mirror_test_' )
+        self.mirror = item_mirror.ItemMirror( os.path.join(self.temp_dir, 'item_mirror.sqlite3') )
+
+    def tearDown( self ):
+        self.mirror.conn.close()
+        shutil.rmtree( self.temp_dir )
+
+    def write_export( self, file_name: str, contents: str ) -> str:
+        export_path = os.path.join( self.temp_dir, file_name )
+        with open( export_path, 'w', encoding='utf-8' ) as fh:
+            fh.write( contents )
+        return export_path
+
+    def age_record( self, barcode: str, hours: float ):
+        """ Backdates a record's sync-time. """
+        with self.mirror.conn:
+            self.mirror.conn.execute( 'UPDATE items SET synced_at = ? WHERE barcode = ?', (time.time() - hours * 3600, barcode) )
+
+    def test_csv_import( self ):
+        """ Checks that a csv export's annex items are imported, with their fields, under the export's column names. """
+        self.assertEqual( 2, self.mirror.import_export(self.write_export('export.csv', CSV_EXPORT)) )
+        item_data = self.mirror.lookup( '31236000000002', max_age_seconds=3600 )
+        self.assertEqual( 'HAYSTOR', item_data['item_data']['location']['value'] )
+        self.assertEqual( 'HAY', item_data['item_data']['library']['value'] )
+        self.assertEqual( '991002', item_data['bib_data']['mms_id'] )
+        self.assertEqual( '231002', item_data['item_data']['pid'] )
+
+    def test_xml_import( self ):
+        """ Checks that an xml export's annex items are imported. """
+        self.assertEqual( 1, self.mirror.import_export(self.write_export('export.xml', XML_EXPORT)) )
+        item_data = self.mirror.lookup( '31236000000011', max_age_seconds=3600 )
+        self.assertEqual( 'RKSTORAGE', item_data['item_data']['location']['value'] )
+        self.assertEqual( 'Annex title', item_data['bib_data']['title'] )
+
+    def test_annex_only_filter( self ):
+        """ Checks that non-annex items are skipped, unless annex_only is off; and that api-upserts are annex-only too. """
+        self.mirror.import_export( self.write_export('export.csv', CSV_EXPORT) )
+        self.assertIsNone( self.mirror.lookup('31236000000003', max_age_seconds=3600) )
+        self.assertEqual( 3, self.mirror.import_export(self.write_export('export.csv', CSV_EXPORT), annex_only=False) )
+        self.assertIsNotNone( self.mirror.lookup('31236000000003', max_age_seconds=3600) )
+        self.mirror.upsert_from_api( api_item('31236000000021', location='STACKS') )
+        self.assertIsNone( self.mirror.lookup('31236000000021', max_age_seconds=3600) )
+        self.mirror.upsert_from_api( api_item('31236000000022') )
+        self.assertIsNotNone( self.mirror.lookup('31236000000022', max_age_seconds=3600) )
+
+    def test_max_age_fallback_to_live_api( self ):
+        """ Checks that the checker answers from a record younger than the default 168-hour max-age without an api-call,
+              and falls back to the live api (refreshing the mirror) for an older one, or a miss. """
+        with mock.patch.dict( os.environ, {'ANXEODALERTS__ITEM_MIRROR_PATH': os.path.join(self.temp_dir, 'from_environ.sqlite3')} ):
+            ( environ_mirror, max_age_seconds ) = item_mirror.mirror_from_environ()
+        environ_mirror.conn.close()
+        self.assertEqual( 168 * 3600, max_age_seconds )
+        with mock.patch.dict( os.environ, {'ANXEODALERTS__ITEM_API_ROOT': 'http://127.0.0.1:9/items', 'ANXEODALERTS__ITEM_API_KEY': 'test'} ):
+            from annex_eod_alerts_code.lib import checker
+        self.mirror.import_export( self.write_export('export.csv', CSV_EXPORT) )
+        fake_api = mock.Mock()
+        fake_api.get_item.side_effect = lambda barcode: api_item( barcode )
+        with mock.patch.object( checker, 'alma_api', fake_api ), \
+                mock.patch.object( checker, 'item_mirror_store', self.mirror ), \
+                mock.patch.object( checker, 'ITEM_MIRROR_MAX_AGE_SECONDS', max_age_seconds ):
+            self.age_record( '31236000000001', hours=167 )
+            ( err, item ) = checker.check_alma_api( '31236000000001' )
+            self.assertIsNone( err )
+            self.assertEqual( 'RKSTORAGE', item.location['value'] )
+            fake_api.get_item.assert_not_called()
+            self.age_record( '31236000000001', hours=169 )
+            ( err, item ) = checker.check_alma_api( '31236000000001' )
+            self.assertIsNone( err )
+            fake_api.get_item.assert_called_once_with( '31236000000001' )
+            self.assertEqual( 'Live title', self.mirror.lookup('31236000000001', max_age_seconds=3600)['bib_data']['title'] )
+            checker.check_alma_api( '31236000000099' )  # not in the mirror
+            self.assertEqual( 2, fake_api.get_item.call_count )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+'''
+Tests for lib/outbox.py, against a local SMTP stand-in.
+
+Usage...
+- assumes:
+    - ANXEODALERTS__ENCLOSING_PROJECT_PATH is set
+- % cd ./annex_eod_alerts_code
+- % source ../env/bin/activate
+- % python3 -m unittest discover -s ./tests
+'''
+
+import os, shutil, socketserver, sys, tempfile, threading, unittest
+from email.mime.text import MIMEText
+
+sys.path.append( os.environ['ANXEODALERTS__ENCLOSING_PROJECT_PATH'] )
+from annex_eod_alerts_code.lib import outbox
+
+
+class FakeSMTPHandler( socketserver.StreamRequestHandler ):
+    """ Speaks just enough SMTP for smtplib.sendmail(); replies to each end-of-DATA with the server's next scripted reply. """
+
+    def handle( self ):
+        self.reply( '220 fake-smtp ready' )
+        for raw_line in self.rfile:
+            command: str = raw_line.decode( 'utf-8' ).strip().upper()
+            if command.startswith( ('EHLO', 'HELO') ):
+                self.reply( '250 fake-smtp' )
+            elif command.startswith( ('MAIL', 'RCPT', 'RSET', 'NOOP') ):
+                self.reply( '250 ok' )
+            elif command == 'DATA':
+                self.reply( '354 end with <CRLF>.<CRLF>' )
+                data_lines: list = []
+                for data_line in self.rfile:
+                    if data_line == b'.\r\n':
+                        break
+                    data_lines.append( data_line )
+                reply: str = self.server.next_reply()
+                if reply.startswith( '250' ):
+                    self.server.received.append( b''.join(data_lines) )
+                self.reply( reply )
+            elif command == 'QUIT':
+                self.reply( '221 bye' )
+                return
+            else:
+                self.reply( '502 not implemented' )
+
+    def reply( self, line: str ):
+        self.wfile.write( f'{line}\r\n'.encode('utf-8') )
+        self.wfile.flush()
+
+
+class FakeSMTPServer( socketserver.ThreadingTCPServer ):
+    """ Local SMTP stand-in; `replies` are the scripted end-of-DATA replies (then `250 ok` once they run out). """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__( self, replies: list ):
+        super().__init__( ('127.0.0.1', 0), FakeSMTPHandler )
+        self.replies = list( replies )
+        self.received: list = []
+        self.lock = threading.Lock()
+
+    def next_reply( self ) -> str:
+        with self.lock:
+            return self.replies.pop( 0 ) if self.replies else '250 ok'
+
+
+class OutboxTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.spool_dir = tempfile.mkdtemp( prefix='outbox_test_' )
+        self.outbox = outbox.Outbox( self.spool_dir )
+        self.server = None
+
+    def tearDown( self ):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        shutil.rmtree( self.spool_dir )
+
+    def start_server( self, replies: list ) -> int:
+        """ Starts the SMTP stand-in; returns its port. """
+        self.server = FakeSMTPServer( replies )
+        threading.Thread( target=self.server.serve_forever, daemon=True ).start()
+        return self.server.server_address[1]
+
+    def enqueue( self, body: str ) -> str:
+        msg = MIMEText( body )
+        msg['Subject'] = 'test'
+        return self.outbox.enqueue( msg, 'from@example.edu', ['to@example.edu'] )
+
+    def drain( self, port: int, max_attempts: int = 3 ) -> int:
+        return self.outbox.drain( '127.0.0.1', port, max_attempts=max_attempts, backoff_base_seconds=0.0, backoff_cap_seconds=0.0 )
+
+    def test_sent( self ):
+        """ Checks that spooled messages are sent, in order, and removed from the spool. """
+        port = self.start_server( [] )
+        self.enqueue( 'first' )
+        self.enqueue( 'second' )
+        self.assertEqual( 2, self.drain(port) )
+        self.assertEqual( [], self.outbox.pending() )
+        self.assertEqual( ['.drain.lock', 'failed'], sorted(os.listdir(self.spool_dir)) )
+        self.assertIn( b'first', self.server.received[0] )
+        self.assertIn( b'second', self.server.received[1] )
+
+    def test_transient_error_is_retried( self ):
+        """ Checks that a 4xx reply is retried, and the message then sent. """
+        port = self.start_server( ['451 try again later'] )
+        self.enqueue( 'retried' )
+        self.assertEqual( 1, self.drain(port) )
+        self.assertEqual( [], self.outbox.pending() )
+        self.assertEqual( 1, len(self.server.received) )
+
+    def test_permanent_rejection_goes_to_failed( self ):
+        """ Checks that a 5xx reply moves the message (and its envelope) to failed/, and the drain carries on. """
+        port = self.start_server( ['550 mailbox unavailable'] )
+        eml_path = self.enqueue( 'rejected' )
+        self.enqueue( 'accepted' )
+        self.assertEqual( 1, self.drain(port) )
+        self.assertEqual( [], self.outbox.pending() )
+        eml_name: str = os.path.basename( eml_path )
+        self.assertEqual( sorted([eml_name, eml_name[:-len('.eml')] + '.json']), sorted(os.listdir(self.outbox.failed_dir)) )
+        self.assertIn( b'accepted', self.server.received[0] )
+
+    def test_deferred_when_server_keeps_failing( self ):
+        """ Checks that messages stay spooled once max_attempts transient failures are used up, and a later drain sends them. """
+        port = self.start_server( ['451 try again later'] * 3 )
+        self.enqueue( 'first' )
+        self.enqueue( 'second' )
+        self.assertEqual( 0, self.drain(port, max_attempts=3) )
+        self.assertEqual( 2, len(self.outbox.pending()) )
+        self.assertEqual( [], os.listdir(self.outbox.failed_dir) )
+        self.assertEqual( 2, self.drain(port, max_attempts=3) )
+        self.assertEqual( [], self.outbox.pending() )
+
+    def test_deferred_when_server_unreachable( self ):
+        """ Checks that a refused connection leaves the message spooled. """
+        port = self.start_server( [] )
+        self.server.shutdown()
+        self.server.server_close()
+        self.server = None
+        self.enqueue( 'unsent' )
+        self.assertEqual( 0, self.drain(port, max_attempts=2) )
+        self.assertEqual( 1, len(self.outbox.pending()) )
+
+
+if __name__ == '__main__':
+    unittest.main()
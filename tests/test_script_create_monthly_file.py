@@ -0,0 +1,108 @@
+'''
+Tests for lib/script_create_monthly_file.py: a month's combined files are byte-for-byte what the original
+  (readlines-based) combining wrote, whether the archives are flat or in month-directories; `--normalize` strips lines.
+
+Usage...
+- assumes:
+    - ANXEODALERTS__ENCLOSING_PROJECT_PATH is set
+- % cd ./annex_eod_alerts_code
+- % source ../env/bin/activate
+- % python3 -m unittest discover -s ./tests
+'''
+
+import os, pathlib, shutil, sys, tempfile, unittest
+
+sys.path.append( os.environ['ANXEODALERTS__ENCLOSING_PROJECT_PATH'] )
+from annex_eod_alerts_code.lib import archive_store, script_create_monthly_file
+
+FILE_TYPES: list = [ 'QHACS', 'QHREF', 'QSACS', 'QSREF' ]
+
+ARCHIVES: dict = {  # CRLF endings, blank lines, repeats, surrounding whitespace, and unterminated last lines
+    'ORIG_QSACS_2022-10-03T08-30-05.dat': b'1001\r\n1002\r\n\r\n1001\r\n9001',
+    'ORIG_QSACS_2022-10-04T08-30-05.dat': b'1003\n\n 1002\n1001\n',
+    'ORIG_QHACS_2022-10-03T09-00-00.dat': b'2001\n2001\n2002\n',
+    'ORIG_QSREF_2022-10-05T10-15-00.dat': b'3001\n3002',
+    'ORIG_QSREF_2022-10-06T10-15-00.dat': b'3003\n3001\n',
+    'ORIG_QSACS_2022-11-01T08-30-05.dat': b'5001\n',  # another month
+}
+
+
+def baseline_month_files( target_files: list, output_dir_path: str, year: int, month: int ) -> None:
+    """ The original script's combining, as of the baseline commit: raw readlines(), list-dedupe, writelines(). """
+    buckets: dict = { file_type: [] for file_type in FILE_TYPES }
+    for path_obj in target_files:
+        with open( path_obj, 'r' ) as file_handler:
+            contents = file_handler.readlines()
+        name = path_obj.name.lower()
+        bucket: list = next( (buckets[file_type] for file_type in FILE_TYPES[:3] if file_type.lower() in name), buckets['QSREF'] )
+        for barcode in contents:
+            if barcode not in bucket:
+                bucket.append( barcode )
+    for file_type in FILE_TYPES:
+        with open( f'{output_dir_path}/COMBINED_{year}-{month}_{file_type}_BARCODES.txt', 'w' ) as filehandler:
+            filehandler.writelines( buckets[file_type] )
+
+
+class CreateMonthlyFileTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.temp_dir = tempfile.mkdtemp( prefix='monthly_file_test_' )
+        ( self.source_dir, self.expected_dir, self.output_dir ) = [ os.path.join(self.temp_dir, name) for name in ('source', 'expected', 'output') ]
+        for dir_path in ( self.source_dir, self.expected_dir, self.output_dir ):
+            os.makedirs( dir_path )
+        for ( file_name, contents ) in ARCHIVES.items():
+            with open( os.path.join(self.source_dir, file_name), 'wb' ) as fh:
+                fh.write( contents )
+
+    def tearDown( self ):
+        shutil.rmtree( self.temp_dir )
+
+    def october_archives( self, dir_path: str ) -> list:
+        """ Returns the month's archives in `dir_path`, in directory-listing order, as the original script found them. """
+        return [ path_obj for path_obj in pathlib.Path(dir_path).iterdir() if path_obj.is_file() and '_2022-10-' in path_obj.name ]
+
+    def read_outputs( self, dir_path: str ) -> dict:
+        outputs: dict = {}
+        for file_type in FILE_TYPES:
+            with open( os.path.join(dir_path, f'COMBINED_2022-10_{file_type}_BARCODES.txt'), 'rb' ) as fh:
+                outputs[file_type] = fh.read()
+        return outputs
+
+    def test_flat_archives_match_baseline( self ):
+        """ Checks that one month's output, from flat archives, is byte-for-byte the original script's. """
+        baseline_month_files( self.october_archives(self.source_dir), self.expected_dir, 2022, 10 )
+        script_create_monthly_file.manage_monthly_file_creation( '2022-10-01', self.source_dir, self.output_dir )
+        self.assertEqual( self.read_outputs(self.expected_dir), self.read_outputs(self.output_dir) )
+
+    def test_month_directory_matches_baseline( self ):
+        """ Checks that a migrated month (all archives in its manifest, with rollups) still gives the original output,
+              not the normalized rollups. """
+        flat_archives: list = sorted( self.october_archives(self.source_dir) )  # migration keeps chronological order
+        baseline_month_files( flat_archives, self.expected_dir, 2022, 10 )
+        archive_store.migrate_flat_archives( self.source_dir )
+        script_create_monthly_file.manage_monthly_file_creation( '2022-10-01', self.source_dir, self.output_dir )
+        expected = self.read_outputs( self.expected_dir )
+        self.assertEqual( expected, self.read_outputs(self.output_dir) )
+        self.assertEqual( b'1001\n1002\n\n90011003\n 1002\n', expected['QSACS'] )  # the original run-together last line
+
+    def test_normalize( self ):
+        """ Checks that `normalize` strips lines and skips blank ones, and matches the rollups. """
+        archive_store.migrate_flat_archives( self.source_dir )
+        script_create_monthly_file.manage_monthly_file_creation( '2022-10-01', self.source_dir, self.output_dir, normalize=True )
+        outputs = self.read_outputs( self.output_dir )
+        self.assertEqual( b'1001\n1002\n9001\n1003\n', outputs['QSACS'] )
+        self.assertEqual( b'3001\n3002\n3003\n', outputs['QSREF'] )
+        self.assertEqual( b'', outputs['QHREF'] )
+        with open( archive_store.rollup_path(archive_store.month_dir(self.source_dir, 2022, 10, create=False), 2022, 10, 'QSACS'), 'rb' ) as fh:
+            self.assertEqual( fh.read(), outputs['QSACS'] )
+
+    def test_normalize_without_rollups( self ):
+        """ Checks that normalizing flat archives (no rollups) strips lines and skips blank ones too. """
+        script_create_monthly_file.manage_monthly_file_creation( '2022-10-01', self.source_dir, self.output_dir, normalize=True )
+        outputs = self.read_outputs( self.output_dir )
+        self.assertEqual( {b'1001\n', b'1002\n', b'9001\n', b'1003\n'}, set(outputs['QSACS'].splitlines(keepends=True)) )
+        self.assertNotIn( b'\n\n', outputs['QSACS'] )
+
+
+if __name__ == '__main__':
+    unittest.main()